@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from direct.showbase.MessengerGlobal import messenger
+from panda3d.core import NodePath
+from typing import Optional, Sequence, TYPE_CHECKING
+import xr
+
+if TYPE_CHECKING:
+    from .actionset import ActionSet
+
+
+ACTION_TYPES = {
+    'boolean': xr.ActionType.BOOLEAN_INPUT,
+    'float': xr.ActionType.FLOAT_INPUT,
+    'vector2': xr.ActionType.VECTOR2F_INPUT,
+    'pose': xr.ActionType.POSE_INPUT,
+    'haptic': xr.ActionType.VIBRATION_OUTPUT,
+}
+
+
+def get_pose_name(action_name: str, subaction_path: Optional[str]) -> str:
+    """
+    Return the name of a linked pose in the pose history and in the session recordings, the subaction path for the
+    default hand pose action and the action name alone for an action without subaction path.
+    """
+
+    if action_name == 'hand_pose':
+        return subaction_path
+    if subaction_path is None:
+        return action_name
+    return f"{subaction_path}:{action_name}"
+
+
+class Action:
+    """
+    An OpenXR action of the given type ('boolean', 'float', 'vector2', 'pose' or 'haptic').
+
+    If subaction paths are given (e.g. '/user/hand/left'), the state of the action can be queried for each of
+    them independently.
+    """
+
+    def __init__(
+            self,
+            action_set: ActionSet,
+            name: str,
+            action_type: str,
+            localized_name: str = None,
+            subaction_paths: Sequence[str] = ()):
+        if action_type not in ACTION_TYPES:
+            raise ValueError(f"Unknown action type '{action_type}'")
+        self.action_set = action_set
+        self.name = name
+        self.action_type = action_type
+        instance = action_set.session.system.instance
+        self.subaction_paths = {
+            path: action_set.backend.string_to_path(instance.handle, path) for path in subaction_paths}
+        if localized_name is None:
+            localized_name = name
+        paths = list(self.subaction_paths.values())
+        self.handle = action_set.backend.create_action(
+            action_set=action_set.handle,
+            create_info=xr.ActionCreateInfo(
+                action_type=ACTION_TYPES[action_type],
+                action_name=name,
+                localized_action_name=localized_name,
+                count_subaction_paths=len(paths),
+                subaction_paths=paths,
+            ),
+        )
+
+    def get_subaction_path(self, path: str = None) -> xr.Path:
+        if path is None:
+            return xr.NULL_PATH
+        if path not in self.subaction_paths:
+            raise ValueError(f"'{path}' is not a subaction path of action '{self.name}'")
+        return self.subaction_paths[path]
+
+
+class ActionSubscription:
+    """
+    Read back the state of an input action and send a Panda3D event when it changed since the last sync.
+
+    The event carries the new value (a bool, a float or a (x, y) tuple) and the time of the change.
+    """
+
+    def __init__(self, action: Action, subaction_path: str, event: str):
+        backend = action.action_set.backend
+        self.action = action
+        self.event = event
+        # The structures are allocated once and updated in place
+        self.get_info = xr.ActionStateGetInfo(
+            action=action.handle, subaction_path=action.get_subaction_path(subaction_path))
+        if action.action_type == 'boolean':
+            self.state = xr.ActionStateBoolean()
+            self.get_state = backend.get_action_state_boolean_into
+        elif action.action_type == 'float':
+            self.state = xr.ActionStateFloat()
+            self.get_state = backend.get_action_state_float_into
+        elif action.action_type == 'vector2':
+            self.state = xr.ActionStateVector2f()
+            self.get_state = backend.get_action_state_vector2f_into
+        else:
+            raise ValueError(f"Can not subscribe to {action.action_type} action '{action.name}'")
+
+    @property
+    def value(self):
+        if self.action.action_type == 'boolean':
+            return bool(self.state.current_state)
+        elif self.action.action_type == 'float':
+            return self.state.current_state
+        else:
+            return (self.state.current_state.x, self.state.current_state.y)
+
+    def poll(self, session_handle) -> None:
+        self.get_state(session_handle, self.get_info, self.state)
+        if self.state.changed_since_last_sync:
+            messenger.send(self.event, [self.value, self.state.last_change_time])
+
+
+class PoseLink:
+    """
+    Action space of a pose action driving the transform of a NodePath.
+    """
+
+    def __init__(self, action: Action, subaction_path: str, nodepath: NodePath):
+        backend = action.action_set.backend
+        self.action = action
+        self.nodepath = nodepath
+        self.name = get_pose_name(action.name, subaction_path)
+        path = action.get_subaction_path(subaction_path)
+        self.space = backend.create_action_space(
+            session=action.action_set.session.handle,
+            create_info=xr.ActionSpaceCreateInfo(
+                action=action.handle,
+                subaction_path=path,
+            ),
+        )
+        self.get_info = xr.ActionStateGetInfo(action=action.handle, subaction_path=path)
+        self.state = xr.ActionStatePose()
@@ -1,10 +1,12 @@
 import ctypes
+import json
 import logging
-from panda3d.core import CS_yup_right, CS_default, LMatrix4, LPoint3, LQuaternion
+from panda3d.core import CS_yup_right, CS_default, LMatrix4, LPoint3, LQuaternion, NodePath
 import xr
 
+from .action import Action, ActionSubscription, PoseLink
 from .session import Session
-from .space import Space
+from .space import Space, SpaceLocator
 
 
 class ActionSet:
@@ -12,104 +14,191 @@ class ActionSet:
     def __init__(self, session: Session, app_space: Space, name: str, localized_name: str, priority: int = 0):
         self.logger = logging.getLogger("actionset::" + name)
         self.session = session
+        self.backend = session.backend
         self.app_space = app_space
         self.coord_mat = LMatrix4.convert_mat(CS_yup_right, CS_default)
-        self.pose_links = {}
+        self.actions: dict[str, Action] = {}
+        self.bindings: dict[str, list[tuple[Action, str]]] = {}
+        self.subscriptions: dict[str, ActionSubscription] = {}
+        self.pose_links: list[PoseLink] = []
+        self.pose_locator: SpaceLocator = None
+        self.attached = False
         instance = self.session.system.instance
         action_set_info = xr.ActionSetCreateInfo(
             action_set_name=name,
             localized_action_set_name=localized_name,
             priority=priority,
         )
-        self.handle = xr.create_action_set(instance.handle, action_set_info)
+        self.handle = self.backend.create_action_set(instance.handle, action_set_info)
 
         self.hands_path_string = [
             "/user/hand/left",
             "/user/hand/right",
             ]
 
-        self.hands_path = [xr.string_to_path(instance.handle, path) for path in self.hands_path_string]
+        self.hand_pose_action = self.add_action("hand_pose", 'pose', "Hand Pose", self.hands_path_string)
+        # Suggest bindings for KHR Simple.
+        self.suggest_binding(
+            "/interaction_profiles/khr/simple_controller", "hand_pose", "/user/hand/left/input/grip/pose")
+        self.suggest_binding(
+            "/interaction_profiles/khr/simple_controller", "hand_pose", "/user/hand/right/input/grip/pose")
 
-        self.hand_pose_action = xr.create_action(
-            action_set=self.handle,
-            create_info=xr.ActionCreateInfo(
-                action_type=xr.ActionType.POSE_INPUT,
-                action_name="hand_pose",
-                localized_action_name="Hand Pose",
-                count_subaction_paths=len(self.hands_path),
-                subaction_paths=self.hands_path,
-            ),
+        # The structures used to poll the actions are allocated once and updated in place
+        self.active_action_set = xr.ActiveActionSet(self.handle, xr.NULL_PATH)
+        self.actions_sync_info = xr.ActionsSyncInfo(
+            count_active_action_sets=1,
+            active_action_sets=ctypes.pointer(self.active_action_set)
         )
-        self.hand_pose_path = [
-            xr.string_to_path(instance.handle, "/user/hand/left/input/grip/pose"),
-            xr.string_to_path(instance.handle, "/user/hand/right/input/grip/pose")]
-        # Suggest bindings for KHR Simple.
-        khr_bindings = [
-            # Fall back to a click input for the grab action.
-            xr.ActionSuggestedBinding(self.hand_pose_action, self.hand_pose_path[0]),
-            xr.ActionSuggestedBinding(self.hand_pose_action, self.hand_pose_path[1]),
-        ]
-
-        self.hands_space = []
-        for hand_path in self.hands_path:
-            action_space_info = xr.ActionSpaceCreateInfo(
-                action=self.hand_pose_action,
-                subaction_path=hand_path,
-                )
-            self.hands_space.append(xr.create_action_space(
-                session=self.session.handle,
-                create_info=action_space_info,
-            ))
-
-        xr.suggest_interaction_profile_bindings(
-            instance=instance.handle,
-            suggested_bindings=xr.InteractionProfileSuggestedBinding(
-                interaction_profile=xr.string_to_path(
-                    instance.handle,
-                    "/interaction_profiles/khr/simple_controller",
-                ),
-                suggested_bindings=khr_bindings,
-            ),
+
+    def add_action(self, name: str, action_type: str, localized_name: str = None, subaction_paths=()) -> Action:
+        """
+        Create a new action, see Action for the supported types.
+        """
+
+        if self.attached:
+            raise RuntimeError("Actions can not be added once the action set is attached")
+        action = Action(self, name, action_type, localized_name, subaction_paths)
+        self.actions[name] = action
+        return action
+
+    def suggest_binding(self, interaction_profile: str, action_name: str, binding: str) -> None:
+        """
+        Suggest a binding of the action for the given interaction profile.
+
+        All the bindings are sent to the runtime when the action set is attached.
+        """
+
+        self.bindings.setdefault(interaction_profile, []).append((self.actions[action_name], binding))
+
+    def load_manifest(self, manifest) -> None:
+        """
+        Create the actions and suggest the bindings described in a manifest, given as a dict or as the name of
+        a JSON file :
+
+            {
+              "actions": [
+                {"name": "grab", "type": "boolean", "localized_name": "Grab",
+                 "subaction_paths": ["/user/hand/left", "/user/hand/right"]},
+                ...
+              ],
+              "bindings": {
+                "/interaction_profiles/khr/simple_controller": {
+                  "grab": ["/user/hand/left/input/select/click", "/user/hand/right/input/select/click"],
+                  ...
+                },
+                ...
+              }
+            }
+
+        The bindings may also refer to the predefined hand_pose action.
+        """
+
+        if not isinstance(manifest, dict):
+            with open(manifest) as manifest_file:
+                manifest = json.load(manifest_file)
+        for action in manifest.get('actions', []):
+            self.add_action(
+                action['name'],
+                action['type'],
+                action.get('localized_name'),
+                action.get('subaction_paths', ()))
+        for interaction_profile, bindings in manifest.get('bindings', {}).items():
+            for action_name, paths in bindings.items():
+                if isinstance(paths, str):
+                    paths = [paths]
+                for path in paths:
+                    self.suggest_binding(interaction_profile, action_name, path)
+
+    def subscribe(self, action_name: str, subaction_path: str = None) -> str:
+        """
+        Request the state of an input action to be read back and return the name of the event sent when it
+        changes. The event is sent with the new value and the time of the change as arguments.
+
+        Only the subscribed actions are read back when the actions are polled.
+        """
+
+        action = self.actions[action_name]
+        event = f"openxr-{action_name}"
+        if subaction_path is not None:
+            event += '-' + subaction_path.rsplit('/', 1)[-1]
+        if event not in self.subscriptions:
+            self.subscriptions[event] = ActionSubscription(action, subaction_path, event)
+        return event
+
+    def unsubscribe(self, action_name: str, subaction_path: str = None) -> None:
+        event = f"openxr-{action_name}"
+        if subaction_path is not None:
+            event += '-' + subaction_path.rsplit('/', 1)[-1]
+        self.subscriptions.pop(event, None)
+
+    def link_pose(self, path: str, nodepath: NodePath, action_name: str = 'hand_pose') -> None:
+        """
+        Drive the transform of the nodepath with the given pose action, for the given subaction path.
+        """
+
+        if self.attached:
+            raise RuntimeError("Poses can not be linked once the action set is attached")
+        self.pose_links.append(PoseLink(self.actions[action_name], path, nodepath))
+
+    def apply_haptic_feedback(
+            self, action_name: str, subaction_path: str = None, amplitude: float = 1.0,
+            duration: int = xr.MIN_HAPTIC_DURATION, frequency: float = xr.FREQUENCY_UNSPECIFIED) -> None:
+        """
+        Send a vibration using a haptic action, the duration is in nanoseconds.
+        """
+
+        action = self.actions[action_name]
+        vibration = xr.HapticVibration(duration=duration, frequency=frequency, amplitude=amplitude)
+        self.backend.apply_haptic_feedback(
+            self.session.handle,
+            xr.HapticActionInfo(action=action.handle, subaction_path=action.get_subaction_path(subaction_path)),
+            ctypes.cast(ctypes.pointer(vibration), ctypes.POINTER(xr.HapticBaseHeader)).contents,
         )
 
-    def link_pose(self, path, nodepath):
-        self.pose_links[path] = nodepath
+    def stop_haptic_feedback(self, action_name: str, subaction_path: str = None) -> None:
+        action = self.actions[action_name]
+        self.backend.stop_haptic_feedback(
+            self.session.handle,
+            xr.HapticActionInfo(action=action.handle, subaction_path=action.get_subaction_path(subaction_path)),
+        )
 
     def attach(self) -> None:
-        xr.attach_session_action_sets(
+        instance = self.session.system.instance
+        for interaction_profile, bindings in self.bindings.items():
+            self.backend.suggest_interaction_profile_bindings(
+                instance=instance.handle,
+                suggested_bindings=xr.InteractionProfileSuggestedBinding(
+                    interaction_profile=self.backend.string_to_path(instance.handle, interaction_profile),
+                    suggested_bindings=[
+                        xr.ActionSuggestedBinding(action.handle, self.backend.string_to_path(instance.handle, path))
+                        for action, path in bindings],
+                ),
+            )
+        self.backend.attach_session_action_sets(
             session=self.session.handle,
             attach_info=xr.SessionActionSetsAttachInfo(
                 count_action_sets=1,
                 action_sets=ctypes.pointer(self.handle),
             ),
         )
+        # All the linked poses are located at once
+        self.pose_locator = SpaceLocator(self.session, self.app_space, [link.space for link in self.pose_links])
+        self.attached = True
 
     def poll_actions(self):
         if not self.session.session_active():
             return
-        active_action_set = xr.ActiveActionSet(self.handle, xr.NULL_PATH)
-        xr.sync_actions(
-            self.session.handle,
-            xr.ActionsSyncInfo(
-                count_active_action_sets=1,
-                active_action_sets=ctypes.pointer(active_action_set)
-            ),
-        )
-        for path_string, hand_path, hand_space in zip(self.hands_path_string, self.hands_path, self.hands_space):
-            nodepath = self.pose_links[path_string]
-            state = xr.get_action_state_pose(
-                session=self.session.handle,
-                get_info=xr.ActionStateGetInfo(
-                    action=self.hand_pose_action,
-                    subaction_path=hand_path,
-                ),
-            )
+        self.backend.sync_actions(self.session.handle, self.actions_sync_info)
+        for subscription in self.subscriptions.values():
+            subscription.poll(self.session.handle)
+        if not self.pose_links:
+            return
+        locations = self.pose_locator.locate(self.session.frame_state.predicted_display_time)
+        for link, space_location in zip(self.pose_links, locations):
+            nodepath = link.nodepath
+            state = link.state
+            self.backend.get_action_state_pose_into(self.session.handle, link.get_info, state)
             if state.is_active:
-                space_location = xr.locate_space(
-                    space=hand_space,
-                    base_space=self.app_space.handle,
-                    time=self.session.frame_state.predicted_display_time,
-                )
                 flags = space_location.location_flags
                 pose_valid = (
                     flags & xr.SPACE_LOCATION_POSITION_VALID_BIT != 0 and
@@ -127,5 +216,5 @@ class ActionSet:
 
     def destroy(self):
         if self.handle is not None:
-            xr.destroy_action_set(self.handle)
+            self.backend.destroy_action_set(self.handle)
             self.handle = None
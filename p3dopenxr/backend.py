@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import ctypes
+import xr
+
+
+class OpenXRBackend:
+    """
+    Backend forwarding all the calls to the OpenXR runtime through pyopenxr.
+
+    The wrapper classes never call the functions of the xr module directly but go through a backend, this allows
+    to replace the actual runtime with a stand-in implementation (see SimulatedBackend).
+    Any function not defined here is looked up in the xr module, so a backend exposes the same API as pyopenxr.
+    """
+
+    # True if the swapchain images are not actual OpenGL textures
+    headless = False
+
+    def __init__(self):
+        self.locate_spaces_functions = {}
+        self.locate_hand_joints_functions = {}
+
+    def __getattr__(self, name):
+        return getattr(xr, name)
+
+    @staticmethod
+    def check(result: xr.Result) -> None:
+        result = xr.check_result(result)
+        if result.is_exception():
+            raise result
+
+    # The following variants of the pyopenxr functions write their result in structures allocated by the caller
+    # instead of allocating new ones, they are used in the frame loop.
+
+    def wait_frame_into(self, session, frame_wait_info: xr.FrameWaitInfo, frame_state: xr.FrameState) -> None:
+        self.check(xr.raw_functions.xrWaitFrame(session, frame_wait_info, frame_state))
+
+    def locate_views_into(
+            self, session, view_locate_info: xr.ViewLocateInfo, view_state: xr.ViewState, views,
+            view_count: ctypes.c_uint32) -> int:
+        self.check(xr.raw_functions.xrLocateViews(
+            session, view_locate_info, view_state, len(views), view_count, views))
+        return view_count.value
+
+    def acquire_swapchain_image_into(
+            self, swapchain, acquire_info: xr.SwapchainImageAcquireInfo, index: ctypes.c_uint32) -> int:
+        self.check(xr.raw_functions.xrAcquireSwapchainImage(swapchain, acquire_info, index))
+        return index.value
+
+    def get_action_state_pose_into(
+            self, session, get_info: xr.ActionStateGetInfo, state: xr.ActionStatePose) -> None:
+        self.check(xr.raw_functions.xrGetActionStatePose(session, get_info, state))
+
+    def get_action_state_boolean_into(
+            self, session, get_info: xr.ActionStateGetInfo, state: xr.ActionStateBoolean) -> None:
+        self.check(xr.raw_functions.xrGetActionStateBoolean(session, get_info, state))
+
+    def get_action_state_float_into(
+            self, session, get_info: xr.ActionStateGetInfo, state: xr.ActionStateFloat) -> None:
+        self.check(xr.raw_functions.xrGetActionStateFloat(session, get_info, state))
+
+    def get_action_state_vector2f_into(
+            self, session, get_info: xr.ActionStateGetInfo, state: xr.ActionStateVector2f) -> None:
+        self.check(xr.raw_functions.xrGetActionStateVector2f(session, get_info, state))
+
+    def locate_space_into(self, space, base_space, time: int, location: xr.SpaceLocation) -> None:
+        self.check(xr.raw_functions.xrLocateSpace(space, base_space, time, location))
+
+    def locate_spaces_into(self, instance, session, locate_info: xr.SpacesLocateInfo,
+                           space_locations: xr.SpaceLocations) -> None:
+        """
+        Call xrLocateSpacesKHR, or xrLocateSpaces if the instance uses OpenXR 1.1 without the extension.
+        """
+
+        key = ctypes.cast(instance, ctypes.c_void_p).value
+        function = self.locate_spaces_functions.get(key)
+        if function is None:
+            try:
+                function = ctypes.cast(
+                    xr.get_instance_proc_addr(instance, "xrLocateSpacesKHR"), xr.PFN_xrLocateSpacesKHR)
+            except xr.FunctionUnsupportedError:
+                function = xr.raw_functions.xrLocateSpaces
+            self.locate_spaces_functions[key] = function
+        self.check(function(session, ctypes.byref(locate_info), ctypes.byref(space_locations)))
+
+    def locate_hand_joints_into(
+            self, hand_tracker: xr.HandTrackerEXT, locate_info: xr.HandJointsLocateInfoEXT,
+            locations: xr.HandJointLocationsEXT) -> None:
+        key = ctypes.cast(hand_tracker.instance, ctypes.c_void_p).value
+        function = self.locate_hand_joints_functions.get(key)
+        if function is None:
+            function = ctypes.cast(
+                xr.get_instance_proc_addr(hand_tracker.instance, "xrLocateHandJointsEXT"),
+                xr.PFN_xrLocateHandJointsEXT)
+            self.locate_hand_joints_functions[key] = function
+        self.check(function(hand_tracker, ctypes.byref(locate_info), ctypes.byref(locations)))
+
+    def get_opengl_graphics_requirements(self, instance, system_id) -> xr.GraphicsRequirementsOpenGLKHR:
+        pxrGetOpenGLGraphicsRequirementsKHR = ctypes.cast(
+            xr.get_instance_proc_addr(
+                instance,
+                "xrGetOpenGLGraphicsRequirementsKHR",
+            ),
+            xr.PFN_xrGetOpenGLGraphicsRequirementsKHR
+        )
+        graphics_requirements = xr.GraphicsRequirementsOpenGLKHR()
+        result = pxrGetOpenGLGraphicsRequirementsKHR(
+            instance,
+            system_id,
+            ctypes.byref(graphics_requirements))
+        result = xr.check_result(xr.Result(result))
+        if result.is_exception():
+            raise result
+        return graphics_requirements
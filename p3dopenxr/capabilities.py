@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Optional
+import xr
+
+
+# Version of the snapshot file format, a snapshot with another version is ignored
+SNAPSHOT_VERSION = 1
+
+VIEW_FIELDS = (
+    'recommended_image_rect_width',
+    'max_image_rect_width',
+    'recommended_image_rect_height',
+    'max_image_rect_height',
+    'recommended_swapchain_sample_count',
+    'max_swapchain_sample_count',
+)
+
+
+class RuntimeCapabilities:
+    """
+    Snapshot of the capabilities of an OpenXR runtime and of its system : extensions, system properties, view
+    configurations, swapchain formats and reference spaces.
+
+    The snapshot is filled while the instance, the system and the session are created, it can then be saved and
+    reused at the next launches to skip the enumeration calls. It is only valid for the runtime name and version,
+    and the system name, it was captured with, see matches_runtime() and matches_system().
+
+    A snapshot recorded with a headset can also be given to the SimulatedBackend to reproduce its capabilities.
+    """
+
+    def __init__(self, runtime_name: str = None, runtime_version: int = None):
+        self.logger = logging.getLogger("capabilities")
+        self.runtime_name = runtime_name
+        # Packed xr.Version
+        self.runtime_version = int(runtime_version) if runtime_version is not None else None
+        # Extension name -> version
+        self.extensions: dict[str, int] = None
+        self.system_name: str = None
+        self.vendor_id: int = None
+        self.max_swapchain_image_width: int = None
+        self.max_swapchain_image_height: int = None
+        self.max_layer_count: int = None
+        self.orientation_tracking: bool = None
+        self.position_tracking: bool = None
+        # View configuration type value -> list of views, each a dict of VIEW_FIELDS
+        self.view_configurations: dict[int, list[dict[str, int]]] = None
+        self.swapchain_formats: list[int] = None
+        self.reference_spaces: list[int] = None
+        # Set when a part of the snapshot has been captured and it must be saved again
+        self.modified = False
+
+    def reset(self, runtime_name: str, runtime_version: int) -> None:
+        """
+        Forget all the captured capabilities and start a snapshot of the given runtime.
+        """
+
+        self.__init__(runtime_name, runtime_version)
+        self.modified = True
+
+    def matches_runtime(self, runtime_name: str, runtime_version: int) -> bool:
+        return self.runtime_name == runtime_name and self.runtime_version == int(runtime_version)
+
+    def matches_system(self, system_name: str) -> bool:
+        return self.system_name == system_name
+
+    def has_extension(self, name: str) -> bool:
+        return name in self.extensions
+
+    def set_extensions(self, extension_properties) -> None:
+        self.extensions = {
+            extension.extension_name.decode(): extension.extension_version for extension in extension_properties}
+        self.modified = True
+
+    def set_system_properties(self, properties: xr.SystemProperties) -> None:
+        self.system_name = properties.system_name.decode()
+        self.vendor_id = properties.vendor_id
+        self.max_swapchain_image_width = properties.graphics_properties.max_swapchain_image_width
+        self.max_swapchain_image_height = properties.graphics_properties.max_swapchain_image_height
+        self.max_layer_count = properties.graphics_properties.max_layer_count
+        self.orientation_tracking = bool(properties.tracking_properties.orientation_tracking)
+        self.position_tracking = bool(properties.tracking_properties.position_tracking)
+        # The views and the formats depend on the system
+        self.view_configurations = None
+        self.swapchain_formats = None
+        self.reference_spaces = None
+        self.modified = True
+
+    def set_view_configurations(self, view_configuration_types: list[int]) -> None:
+        self.view_configurations = {int(config_type): None for config_type in view_configuration_types}
+        self.modified = True
+
+    def set_views(self, view_configuration_type: int, views: list[xr.ViewConfigurationView]) -> None:
+        self.view_configurations[int(view_configuration_type)] = [
+            {field: getattr(view, field) for field in VIEW_FIELDS} for view in views]
+        self.modified = True
+
+    def get_views(self, view_configuration_type: int) -> Optional[list[xr.ViewConfigurationView]]:
+        """
+        Return the views of the given configuration, or None if they have not been captured.
+        """
+
+        if self.view_configurations is None:
+            return None
+        views = self.view_configurations.get(int(view_configuration_type))
+        if views is None:
+            return None
+        return [xr.ViewConfigurationView(**view) for view in views]
+
+    def set_swapchain_formats(self, swapchain_formats: list[int]) -> None:
+        self.swapchain_formats = [int(sc_format) for sc_format in swapchain_formats]
+        self.modified = True
+
+    def set_reference_spaces(self, reference_spaces: list[int]) -> None:
+        self.reference_spaces = [int(space_type) for space_type in reference_spaces]
+        self.modified = True
+
+    def to_dict(self) -> dict:
+        return {
+            'version': SNAPSHOT_VERSION,
+            'runtime_name': self.runtime_name,
+            'runtime_version': self.runtime_version,
+            'extensions': self.extensions,
+            'system': {
+                'name': self.system_name,
+                'vendor_id': self.vendor_id,
+                'max_swapchain_image_width': self.max_swapchain_image_width,
+                'max_swapchain_image_height': self.max_swapchain_image_height,
+                'max_layer_count': self.max_layer_count,
+                'orientation_tracking': self.orientation_tracking,
+                'position_tracking': self.position_tracking,
+            },
+            # JSON keys are strings
+            'view_configurations': {
+                str(config_type): views for config_type, views in self.view_configurations.items()
+            } if self.view_configurations is not None else None,
+            'swapchain_formats': self.swapchain_formats,
+            'reference_spaces': self.reference_spaces,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> RuntimeCapabilities:
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported capability snapshot version {data.get('version')}")
+        capabilities = cls(data['runtime_name'], data['runtime_version'])
+        capabilities.extensions = data['extensions']
+        system = data['system']
+        capabilities.system_name = system['name']
+        capabilities.vendor_id = system['vendor_id']
+        capabilities.max_swapchain_image_width = system['max_swapchain_image_width']
+        capabilities.max_swapchain_image_height = system['max_swapchain_image_height']
+        capabilities.max_layer_count = system['max_layer_count']
+        capabilities.orientation_tracking = system['orientation_tracking']
+        capabilities.position_tracking = system['position_tracking']
+        if data['view_configurations'] is not None:
+            capabilities.view_configurations = {
+                int(config_type): views for config_type, views in data['view_configurations'].items()}
+        capabilities.swapchain_formats = data['swapchain_formats']
+        capabilities.reference_spaces = data['reference_spaces']
+        return capabilities
+
+    def save(self, filename: str) -> None:
+        """
+        Write the snapshot in the given JSON file, the file is replaced atomically.
+        """
+
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'w') as snapshot_file:
+            json.dump(self.to_dict(), snapshot_file, indent=1)
+        os.replace(temp_filename, filename)
+        self.modified = False
+        self.logger.debug(f"Saved capabilities of '{self.runtime_name}' in {filename}")
+
+    @classmethod
+    def load(cls, filename: str) -> Optional[RuntimeCapabilities]:
+        """
+        Read a snapshot from the given JSON file, return None if it does not exist or is not valid.
+        """
+
+        logger = logging.getLogger("capabilities")
+        try:
+            with open(filename) as snapshot_file:
+                capabilities = cls.from_dict(json.load(snapshot_file))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(f"Ignoring invalid capability snapshot {filename}: {e}")
+            return None
+        logger.debug(f"Loaded capabilities of '{capabilities.runtime_name}' from {filename}")
+        return capabilities
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import ctypes
+import logging
+import queue
+import subprocess
+import threading
+from collections import deque
+import numpy as np
+from panda3d.core import Filename, Texture
+from typing import Callable, Sequence, TYPE_CHECKING
+
+from .formats import get_color_format
+from .gl import GL
+from .mirror import blit_framebuffer, create_read_framebuffer
+
+if TYPE_CHECKING:
+    from .swapchain import Swapchain
+
+
+class CapturedFrame:
+    """
+    Image of one view read back from the GPU.
+
+    pixels is a (height, width, 4) array of 8 bits BGRA pixels, with the bottom row first like the RAM image of a
+    Panda3D texture. The frames are recycled once written, the pixels must be copied to be kept.
+    """
+
+    def __init__(self, size: int):
+        self.buffer = np.empty(size, dtype=np.uint8)
+        self.pixels: np.ndarray = None
+        self.view = 0
+        self.frame = 0
+        self.display_time = 0
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    def set(self, view: int, frame: int, display_time: int, width: int, height: int) -> None:
+        self.view = view
+        self.frame = frame
+        self.display_time = display_time
+        self.pixels = self.buffer[:width * height * 4].reshape(height, width, 4)
+
+
+class ImageWriter:
+    """
+    Write each captured frame into an image file, in any format supported by Panda3D.
+
+    pattern is formatted with the index of the view, the frame number and the predicted display time of the frame.
+    Unless alpha is True, the alpha channel is made opaque, the background of the views is cleared to transparent.
+    """
+
+    def __init__(self, pattern: str = 'capture-{view}-{frame:06d}.png', alpha: bool = False):
+        self.pattern = pattern
+        self.alpha = alpha
+        self.texture = Texture("capture")
+
+    def __call__(self, frame: CapturedFrame) -> None:
+        texture = self.texture
+        if texture.get_x_size() != frame.width or texture.get_y_size() != frame.height:
+            texture.setup_2d_texture(frame.width, frame.height, Texture.T_unsigned_byte, Texture.F_rgba8)
+        if not self.alpha:
+            frame.pixels[..., 3] = 255
+        # The RAM image of a Panda3D texture is BGRA and bottom-up, like the pixels read back
+        texture.set_ram_image(frame.pixels)
+        filename = self.pattern.format(view=frame.view, frame=frame.frame, time=frame.display_time)
+        texture.write(Filename.from_os_specific(filename))
+
+    def close(self) -> None:
+        pass
+
+
+class VideoWriter:
+    """
+    Encode the captured frames of one view into a video file with an ffmpeg process, fed with the raw frames on
+    its standard input.
+
+    The process is started on the first frame, once the size of the images is known. frame_rate should be the rate
+    of the capture, i.e. the display refresh rate divided by the capture interval. options are the ffmpeg output
+    options, by default H.264 for a fast encoding.
+    """
+
+    def __init__(
+            self, filename: str, frame_rate: float = 30.0, view: int = 0,
+            options: Sequence[str] = ('-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'),
+            executable: str = 'ffmpeg'):
+        self.logger = logging.getLogger("capture")
+        self.filename = filename
+        self.frame_rate = frame_rate
+        self.view = view
+        self.options = list(options)
+        self.executable = executable
+        self.process: subprocess.Popen = None
+
+    def __call__(self, frame: CapturedFrame) -> None:
+        if frame.view != self.view:
+            return
+        if self.process is None:
+            command = [
+                self.executable, '-loglevel', 'error', '-y',
+                '-f', 'rawvideo', '-pix_fmt', 'bgr0', '-s', f"{frame.width}x{frame.height}",
+                '-framerate', str(self.frame_rate), '-i', '-',
+                '-vf', 'vflip', *self.options, self.filename]
+            self.logger.debug(f"Start {' '.join(command)}")
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.process.stdin.write(frame.pixels.data)
+
+    def close(self) -> None:
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+
+class FrameCapture:
+    """
+    Capture the images of the views to disk or to a video without stalling the rendering.
+
+    The images are copied, while the swapchain images are still acquired, into a ring of pixel buffer objects with
+    an asynchronous glReadPixels and a fence. The pixel buffers are only mapped one or more frames later, once
+    their fence is signaled, so the draw thread never waits for the GPU. The pixels are then copied into frames
+    taken from a preallocated pool and handed to a background thread, which gives them to writer, e.g. an
+    ImageWriter or a VideoWriter, and puts them back in the pool.
+
+    views are the indices of the captured views. Only one frame out of interval is captured, and the images are
+    downscaled by scale, a multisampled image is first resolved. When all the pixel buffers are in flight, or when
+    the writer is too slow and the pool of frames is empty, the frame is skipped and counted in dropped.
+
+    update() must be called before each frame is rendered and capture() from the draw callbacks, with the OpenGL
+    context current.
+    """
+
+    def __init__(
+            self, writer: Callable[[CapturedFrame], None], views: Sequence[int] = (0,), interval: int = 1,
+            scale: float = 1.0, ring_size: int = 3, pool_size: int = 4):
+        self.logger = logging.getLogger("capture")
+        if interval < 1 or not 0 < scale <= 1 or ring_size < 1 or pool_size < 1:
+            raise ValueError("Invalid capture interval, scale, ring or pool size")
+        self.writer = writer
+        self.views = list(views)
+        self.interval = interval
+        self.scale = scale
+        self.ring_size = ring_size
+        self.pool_size = pool_size
+        self.swapchains: list[Swapchain] = []
+        self.headless = False
+        self.multisampled = False
+        self.sc_format = None
+        self.staging_format = None
+        # Size of the captured images
+        self.size: tuple[int, int] = None
+        self.buffer_size = 0
+        self.buffers: list[int] = []
+        self.free_buffers: list[int] = []
+        # Pixel buffers being read back, with their fence and the view and frame they hold
+        self.pending: deque = deque()
+        self.read_framebuffers: dict[tuple[int, int], int] = {}
+        self.resolve_target: tuple[int, int] = None
+        self.staging_target: tuple[int, int] = None
+        self.free_frames: queue.Queue = queue.Queue()
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: threading.Thread = None
+        self.first_frame: int = None
+        self.frame = 0
+        self.display_time = 0
+        self.capture_pending = False
+        self.collect_pending = False
+        self.stopping = False
+        self.done = False
+        # Number of frames selected for the capture, and of images read back, written and skipped
+        self.frames = 0
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+
+    def setup(self, swapchains: Sequence[Swapchain], sc_format: int, headless: bool = False) -> None:
+        """
+        Capture the views rendered into the given swapchains, one per view, and start the writer thread.
+        """
+
+        self.swapchains = list(swapchains)
+        self.headless = headless
+        for view in self.views:
+            if not 0 <= view < len(self.swapchains):
+                raise ValueError(f"Invalid captured view {view}")
+        self.multisampled = any(self.swapchains[view].sample_count > 1 for view in self.views)
+        self.sc_format = sc_format
+        color_format = get_color_format(sc_format)
+        # The encoded values of an sRGB image are kept, the other formats are converted to 8 bits
+        if color_format is not None and color_format.srgb:
+            self.staging_format = GL.GL_SRGB8_ALPHA8
+        else:
+            self.staging_format = GL.GL_RGBA8
+        swapchain = self.swapchains[self.views[0]]
+        self.size = (max(1, round(swapchain.width * self.scale)), max(1, round(swapchain.height * self.scale)))
+        self.buffer_size = self.size[0] * self.size[1] * 4
+        for i in range(self.pool_size):
+            self.free_frames.put(CapturedFrame(self.buffer_size))
+        self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Capture views {self.views} {self.size[0]}x{self.size[1]} every {self.interval} frames")
+
+    def update(self, frame: int, display_time: int) -> bool:
+        """
+        Decide if the given frame is captured, must be called before the frame is rendered. Return True if it is.
+        """
+
+        if self.first_frame is None:
+            self.first_frame = frame
+        self.frame = frame
+        self.display_time = display_time
+        self.collect_pending = True
+        self.capture_pending = not self.stopping and (frame - self.first_frame) % self.interval == 0
+        if self.capture_pending:
+            self.frames += 1
+        return self.capture_pending
+
+    def capture(self, view: int, image: int, layer: int = None) -> None:
+        """
+        Start the readback of the rendered image of the view, or of the given layer of a texture array image, if
+        the frame is captured. The image must still be acquired.
+        """
+
+        if self.headless or self.done:
+            return
+        if self.collect_pending:
+            self.collect_pending = False
+            self.collect()
+            if self.stopping and not self.pending:
+                self.release()
+                return
+        if not self.capture_pending or view not in self.views:
+            return
+        if not self.buffers:
+            self.create_buffers()
+        if not self.free_buffers:
+            # All the pixel buffers are still in flight
+            self.dropped += 1
+            return
+        swapchain = self.swapchains[view]
+        source = (0, 0, swapchain.image_rect_width, swapchain.image_rect_height)
+        framebuffer = self.get_read_framebuffer(image, layer)
+        if self.multisampled:
+            if self.resolve_target is None:
+                # A resolve requires identical formats and can not scale, the image is resolved first
+                self.resolve_target = self.create_target(self.sc_format, swapchain.width, swapchain.height)
+            blit_framebuffer(framebuffer, self.resolve_target[0], source, source, GL.GL_NEAREST)
+            framebuffer = self.resolve_target[0]
+        width, height = self.size
+        if source[2:] != self.size:
+            if self.staging_target is None:
+                self.staging_target = self.create_target(self.staging_format, width, height)
+            blit_framebuffer(framebuffer, self.staging_target[0], source, (0, 0, width, height), GL.GL_LINEAR)
+            framebuffer = self.staging_target[0]
+        buffer = self.free_buffers.pop()
+        previous_read = GL.glGetIntegerv(GL.GL_READ_FRAMEBUFFER_BINDING)
+        previous_pack = GL.glGetIntegerv(GL.GL_PIXEL_PACK_BUFFER_BINDING)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, framebuffer)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        # With a pixel pack buffer bound, the pixels are copied asynchronously at offset 0 of the buffer
+        GL.glReadPixels(0, 0, width, height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, 0)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, previous_pack)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, previous_read)
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.pending.append((buffer, fence, view, self.frame, self.display_time))
+        self.captured += 1
+
+    def collect(self) -> None:
+        """
+        Hand the pixel buffers whose readback is complete to the writer thread, without waiting for the others.
+        """
+
+        while self.pending:
+            buffer, fence, view, frame_number, display_time = self.pending[0]
+            status = GL.glClientWaitSync(fence, 0, 0)
+            if status != GL.GL_ALREADY_SIGNALED and status != GL.GL_CONDITION_SATISFIED:
+                break
+            self.pending.popleft()
+            GL.glDeleteSync(fence)
+            try:
+                frame = self.free_frames.get_nowait()
+            except queue.Empty:
+                # The writer does not keep up, the frame is skipped
+                frame = None
+                self.dropped += 1
+            if frame is not None:
+                previous = GL.glGetIntegerv(GL.GL_PIXEL_PACK_BUFFER_BINDING)
+                GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+                pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.buffer_size, GL.GL_MAP_READ_BIT)
+                if pointer:
+                    ctypes.memmove(frame.buffer.ctypes.data, pointer, self.buffer_size)
+                GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+                GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, previous)
+                if pointer:
+                    frame.set(view, frame_number, display_time, *self.size)
+                    self.queue.put(frame)
+                else:
+                    self.logger.error("Could not map capture buffer")
+                    self.free_frames.put(frame)
+            self.free_buffers.append(buffer)
+
+    def run(self) -> None:
+        """
+        Writer thread, give the frames to the writer until the capture is closed.
+        """
+
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.writer(frame)
+                self.written += 1
+            except Exception:
+                self.logger.exception("Could not write captured frame")
+            self.free_frames.put(frame)
+        close = getattr(self.writer, 'close', None)
+        if close is not None:
+            close()
+
+    def get_read_framebuffer(self, image: int, layer: int = None) -> int:
+        key = (image, layer)
+        framebuffer = self.read_framebuffers.get(key)
+        if framebuffer is None:
+            framebuffer = create_read_framebuffer(image, layer)
+            self.read_framebuffers[key] = framebuffer
+        return framebuffer
+
+    def create_buffers(self) -> None:
+        previous = GL.glGetIntegerv(GL.GL_PIXEL_PACK_BUFFER_BINDING)
+        count = self.ring_size * len(self.views)
+        buffers = GL.glGenBuffers(count)
+        self.buffers = [buffers] if count == 1 else list(buffers)
+        for buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.buffer_size, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, previous)
+        self.free_buffers = list(self.buffers)
+        self.logger.debug(f"Created {count} capture buffers of {self.buffer_size} bytes")
+
+    def create_target(self, color_format: int, width: int, height: int) -> tuple[int, int]:
+        previous = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        previous_rb = GL.glGetIntegerv(GL.GL_RENDERBUFFER_BINDING)
+        framebuffer = GL.glGenFramebuffers(1)
+        color_buffer = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, color_buffer)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, color_format, width, height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, previous_rb)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, framebuffer)
+        GL.glFramebufferRenderbuffer(GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, color_buffer)
+        status = GL.glCheckFramebufferStatus(GL.GL_DRAW_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            self.logger.error(f"Capture framebuffer is incomplete: {status:#x}")
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, previous)
+        return framebuffer, color_buffer
+
+    def release(self) -> None:
+        """
+        Release the OpenGL objects and let the writer thread finish, must be called from a draw callback.
+        """
+
+        for buffer, fence, view, frame_number, display_time in self.pending:
+            GL.glDeleteSync(fence)
+        self.pending.clear()
+        if self.buffers:
+            GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        self.buffers = []
+        self.free_buffers = []
+        framebuffers = list(self.read_framebuffers.values())
+        for target in (self.resolve_target, self.staging_target):
+            if target is not None:
+                framebuffers.append(target[0])
+                GL.glDeleteRenderbuffers(1, [target[1]])
+        if framebuffers:
+            GL.glDeleteFramebuffers(len(framebuffers), framebuffers)
+        self.read_framebuffers = {}
+        self.resolve_target = None
+        self.staging_target = None
+        self.finish()
+
+    def stop(self) -> None:
+        """
+        Stop capturing, the frames already read back are still written. The OpenGL objects are released and the
+        writer thread ends during the next frames, see finished.
+        """
+
+        self.stopping = True
+        self.capture_pending = False
+        if self.headless or not self.buffers:
+            self.finish()
+
+    @property
+    def finished(self) -> bool:
+        return self.done and (self.thread is None or not self.thread.is_alive())
+
+    def finish(self) -> None:
+        if not self.done:
+            self.done = True
+            self.queue.put(None)
+
+    def close(self) -> None:
+        """
+        Stop capturing and wait for the writer thread, the frames still in flight on the GPU are discarded and the
+        OpenGL objects are released with the context.
+        """
+
+        self.stopping = True
+        self.finish()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.logger.info(f"Captured {self.captured} images, {self.written} written, {self.dropped} dropped")
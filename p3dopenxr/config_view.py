@@ -8,6 +8,8 @@ class ConfigurationView:
     def __init__(self, index: int, config: xr.ViewConfigurationView):
         self.index = index
         self.config = config
+        # Resolution of the view relative to the recommended one, see ViewPolicy
+        self.render_scale = 1.0
 
     @property
     def max_image_rect_width(self) -> int:
@@ -32,3 +34,15 @@ class ConfigurationView:
     @property
     def recommended_swapchain_sample_count(self) -> int:
         return self.config.recommended_swapchain_sample_count
+
+    @property
+    def render_width(self) -> int:
+        """
+        Width of the rendered images, the recommended width scaled by the render scale of the view.
+        """
+
+        return min(max(1, round(self.recommended_image_rect_width * self.render_scale)), self.max_image_rect_width)
+
+    @property
+    def render_height(self) -> int:
+        return min(max(1, round(self.recommended_image_rect_height * self.render_scale)), self.max_image_rect_height)
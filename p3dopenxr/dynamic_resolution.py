@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+from collections import deque
+import ctypes
+import logging
+from panda3d.core import DisplayRegion
+from typing import Sequence, TYPE_CHECKING
+
+from .gl import GL
+
+if TYPE_CHECKING:
+    from .config_view import ConfigurationView
+    from .swapchain import Swapchain
+
+
+class GpuTimer:
+    """
+    Measure the GPU time spent per frame using GL_TIME_ELAPSED queries.
+
+    The results are read back a few frames later, once available, so the measure never stalls the pipeline.
+    All the methods must be called from the draw callback, with the OpenGL context current.
+    """
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self.free_queries: list[int] = []
+        self.pending: deque = deque()
+        self.current_frame = None
+        self.current_time = 0
+        # Whether begin() started a query that end() must end
+        self.active = False
+        self.result = ctypes.c_uint64()
+        self.available = ctypes.c_int()
+
+    def begin(self, frame: int) -> None:
+        if not self.free_queries and not self.pending:
+            self.free_queries = list(GL.glGenQueries(self.size))
+        if not self.free_queries:
+            # All the queries are in flight, this frame is not measured
+            return
+        query = self.free_queries.pop()
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        self.pending.append((frame, query))
+        self.active = True
+
+    def end(self) -> None:
+        if self.active:
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+            self.active = False
+
+    def collect(self) -> list[float]:
+        """
+        Return the GPU time, in seconds, of each frame whose measures are all available.
+        """
+
+        frame_times = []
+        while self.pending:
+            frame, query = self.pending[0]
+            GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE, ctypes.byref(self.available))
+            if not self.available.value:
+                break
+            self.pending.popleft()
+            GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, ctypes.byref(self.result))
+            self.free_queries.append(query)
+            if frame != self.current_frame:
+                if self.current_frame is not None:
+                    frame_times.append(self.current_time / 1e9)
+                self.current_frame = frame
+                self.current_time = 0
+            self.current_time += self.result.value
+        return frame_times
+
+    def release(self) -> None:
+        queries = self.free_queries + [query for frame, query in self.pending]
+        if queries:
+            GL.glDeleteQueries(len(queries), queries)
+        self.free_queries = []
+        self.pending.clear()
+
+
+class FrameTimeController:
+    """
+    Base of the controllers adapting the rendering cost to the measured frame time.
+
+    The frame time is the largest of the GPU time, measured with timer queries around the draw callbacks, and of
+    the CPU time between the start of the frame and its end. When it stays above upper_threshold, or below
+    lower_threshold, of target times the display period for more than hysteresis frames, the quality must be
+    decreased, or increased.
+
+    The controllers implement update(display_period), called once per frame, which adapts the quality from the
+    result of measure() and returns True if it changed.
+    """
+
+    def __init__(self, target: float, upper_threshold: float, lower_threshold: float, hysteresis: int):
+        self.target = target
+        self.upper_threshold = upper_threshold
+        self.lower_threshold = lower_threshold
+        self.hysteresis = hysteresis
+        self.gpu_time = 0.0
+        self.cpu_time = 0.0
+        self.load = 0.0
+        self.over_budget = 0
+        self.under_budget = 0
+
+    def add_gpu_time(self, duration: float) -> None:
+        self.gpu_time = duration
+
+    def add_cpu_time(self, duration: float) -> None:
+        self.cpu_time = duration
+
+    def measure(self, display_period: float) -> int:
+        """
+        Update the load from the last measures, the display period is in seconds. Return -1 if the quality must be
+        decreased, 1 if it can be increased or else 0.
+        """
+
+        if display_period <= 0:
+            return 0
+        load = max(self.gpu_time, self.cpu_time) / (display_period * self.target)
+        self.load = load
+        if load > self.upper_threshold:
+            self.over_budget += 1
+            self.under_budget = 0
+        elif load < self.lower_threshold:
+            self.under_budget += 1
+            self.over_budget = 0
+        else:
+            self.over_budget = 0
+            self.under_budget = 0
+        if self.over_budget > self.hysteresis:
+            self.over_budget = 0
+            return -1
+        if self.under_budget > self.hysteresis:
+            self.under_budget = 0
+            return 1
+        return 0
+
+
+class DynamicResolution(FrameTimeController):
+    """
+    Adapt the rendering resolution to the measured frame time to keep up with the display rate.
+
+    The scale is relative to the resolution of each view, the recommended one scaled by the ViewPolicy of the
+    view, and is kept between min_scale and max_scale. The swapchains are allocated for max_scale, within the
+    maximum size supported by the runtime, and only a part of the images is rendered and submitted.
+
+    The scale is decreased, or increased, by step when the frame time is over, or under, budget, see
+    FrameTimeController.
+    """
+
+    def __init__(
+            self,
+            min_scale: float = 0.5,
+            max_scale: float = 1.0,
+            step: float = 0.05,
+            target: float = 0.9,
+            upper_threshold: float = 1.0,
+            lower_threshold: float = 0.8,
+            hysteresis: int = 10):
+        super().__init__(target, upper_threshold, lower_threshold, hysteresis)
+        self.logger = logging.getLogger("dynamic-resolution")
+        if not 0 < min_scale <= max_scale:
+            raise ValueError("Invalid dynamic resolution scale bounds")
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.step = step
+        self.scale = min(1.0, max_scale)
+        self.targets: list[tuple[Swapchain, DisplayRegion]] = []
+
+    def get_swapchain_size(self, view: ConfigurationView) -> tuple[int, int]:
+        """
+        Return the size of the swapchain to allocate for the view.
+        """
+
+        width = min(max(1, round(view.render_width * self.max_scale)), view.max_image_rect_width)
+        height = min(max(1, round(view.render_height * self.max_scale)), view.max_image_rect_height)
+        return width, height
+
+    def setup(self, swapchains: Sequence[Swapchain], display_regions: Sequence[DisplayRegion]) -> None:
+        self.targets = list(zip(swapchains, display_regions))
+        self.apply()
+
+    def update(self, display_period: float) -> bool:
+        """
+        Update the scale from the last measures, the display period is in seconds. Return True if it changed.
+        """
+
+        change = self.measure(display_period)
+        if change < 0:
+            scale = max(self.min_scale, self.scale - self.step)
+        elif change > 0:
+            scale = min(self.max_scale, self.scale + self.step)
+        else:
+            return False
+        if scale == self.scale:
+            return False
+        self.logger.debug(f"Render scale {self.scale:.2f} -> {scale:.2f} (load {self.load:.2f})")
+        self.scale = scale
+        self.apply()
+        return True
+
+    def apply(self) -> None:
+        """
+        Resize the rendered area of the swapchain images and the display regions to the current scale.
+        """
+
+        for swapchain, dr in self.targets:
+            view = swapchain.view
+            width = min(max(1, round(view.render_width * self.scale)), swapchain.width)
+            height = min(max(1, round(view.render_height * self.scale)), swapchain.height)
+            swapchain.set_image_rect(width, height)
+            dr.set_dimensions(0, width / swapchain.width, 0, height / swapchain.height)
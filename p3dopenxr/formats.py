@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import functools
+import logging
+from panda3d.core import FrameBufferProperties
+from typing import Optional, Sequence
+
+from .gl import GL
+from .session import get_format_names
+
+
+class ColorFormat:
+    """
+    Description of an OpenGL color swapchain format.
+
+    size is the number of bytes per pixel stored by the GPU, the formats with three components are usually padded
+    to four and are counted as such.
+    """
+
+    def __init__(
+            self, red: int, green: int, blue: int, alpha: int, size: int, float_color: bool = False,
+            srgb: bool = False):
+        self.red = red
+        self.green = green
+        self.blue = blue
+        self.alpha = alpha
+        self.size = size
+        self.float_color = float_color
+        self.srgb = srgb
+
+    @property
+    def components(self) -> int:
+        return (self.red > 0) + (self.green > 0) + (self.blue > 0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_color_formats() -> dict[int, ColorFormat]:
+    """
+    Return the description of the color formats the swapchains can be negotiated with.
+    """
+
+    return {
+        GL.GL_R8: ColorFormat(8, 0, 0, 0, 1),
+        GL.GL_RG8: ColorFormat(8, 8, 0, 0, 2),
+        GL.GL_RGB8: ColorFormat(8, 8, 8, 0, 4),
+        GL.GL_RGBA8: ColorFormat(8, 8, 8, 8, 4),
+        GL.GL_SRGB8: ColorFormat(8, 8, 8, 0, 4, srgb=True),
+        GL.GL_SRGB8_ALPHA8: ColorFormat(8, 8, 8, 8, 4, srgb=True),
+        GL.GL_RGB10_A2: ColorFormat(10, 10, 10, 2, 4),
+        GL.GL_R16: ColorFormat(16, 0, 0, 0, 2),
+        GL.GL_RG16: ColorFormat(16, 16, 0, 0, 4),
+        GL.GL_RGBA16: ColorFormat(16, 16, 16, 16, 8),
+        GL.GL_R11F_G11F_B10F: ColorFormat(11, 11, 10, 0, 4, float_color=True),
+        GL.GL_R16F: ColorFormat(16, 0, 0, 0, 2, float_color=True),
+        GL.GL_RG16F: ColorFormat(16, 16, 0, 0, 4, float_color=True),
+        GL.GL_RGB16F: ColorFormat(16, 16, 16, 0, 8, float_color=True),
+        GL.GL_RGBA16F: ColorFormat(16, 16, 16, 16, 8, float_color=True),
+        GL.GL_R32F: ColorFormat(32, 0, 0, 0, 4, float_color=True),
+        GL.GL_RG32F: ColorFormat(32, 32, 0, 0, 8, float_color=True),
+        GL.GL_RGB32F: ColorFormat(32, 32, 32, 0, 16, float_color=True),
+        GL.GL_RGBA32F: ColorFormat(32, 32, 32, 32, 16, float_color=True),
+    }
+
+
+def get_color_format(gl_format: int) -> Optional[ColorFormat]:
+    return get_color_formats().get(gl_format)
+
+
+def satisfies(color_format: ColorFormat, fb_props: FrameBufferProperties, components: int) -> bool:
+    """
+    Return True if the format has all the features requested by the framebuffer properties : components, alpha,
+    sRGB encoding, floating point (HDR) and bits per component.
+    """
+
+    if color_format.components < components:
+        return False
+    if fb_props.alpha_bits > 0 and color_format.alpha < fb_props.alpha_bits:
+        return False
+    if color_format.srgb != bool(fb_props.srgb_color):
+        return False
+    if fb_props.float_color and not color_format.float_color:
+        return False
+    if (color_format.red < fb_props.red_bits
+            or color_format.green < fb_props.green_bits
+            or color_format.blue < fb_props.blue_bits):
+        return False
+    # A color_bits of 1 means any size
+    if fb_props.color_bits > 1 and color_format.red + color_format.green + color_format.blue < fb_props.color_bits:
+        return False
+    return True
+
+
+def negotiate_color_format(
+        fb_props: FrameBufferProperties, preferred: int, supported_formats: Sequence[int]) -> Optional[int]:
+    """
+    Return the smallest format supported by the runtime with all the features requested by the framebuffer
+    properties, see satisfies().
+
+    preferred is the format matching exactly the properties, it is picked among the formats of the same size. A
+    floating point format is only used for a normalized request when no normalized format is supported, and
+    the remaining ties follow the order of the runtime, which lists its preferred formats first.
+
+    Return None if no supported format has the requested features.
+    """
+
+    preferred_format = get_color_format(preferred)
+    components = preferred_format.components if preferred_format is not None else 3
+    candidates = []
+    for index, gl_format in enumerate(supported_formats):
+        color_format = get_color_format(gl_format)
+        if color_format is None or not satisfies(color_format, fb_props, components):
+            continue
+        rank = (color_format.float_color and not fb_props.float_color, color_format.size, gl_format != preferred,
+                index)
+        candidates.append((rank, gl_format))
+    if not candidates:
+        return None
+    return min(candidates)[1]
+
+
+def select_color_format(
+        fb_props: FrameBufferProperties, preferred: int, supported_formats: Sequence[int]) -> int:
+    """
+    Negotiate the color format of the swapchains with the runtime, see negotiate_color_format().
+
+    If no supported format has all the requested features, the first color format of the runtime keeping the
+    requested sRGB encoding and floating point is used, or else keeping only the sRGB encoding, or else its first
+    color format.
+    """
+
+    logger = logging.getLogger("formats")
+    gl_format = negotiate_color_format(fb_props, preferred, supported_formats)
+    if gl_format is not None:
+        return gl_format
+    color_formats = [sc_format for sc_format in supported_formats if get_color_format(sc_format) is not None]
+    if not color_formats:
+        raise ValueError("The runtime does not support any known color swapchain format")
+    srgb_formats = [
+        sc_format for sc_format in color_formats if get_color_format(sc_format).srgb == bool(fb_props.srgb_color)]
+    float_formats = [
+        sc_format for sc_format in srgb_formats
+        if get_color_format(sc_format).float_color == bool(fb_props.float_color)]
+    gl_format = (float_formats or srgb_formats or color_formats)[0]
+    logger.warning(
+        f"No swapchain format supported by the runtime has the requested features, using "
+        f"{get_format_names().get(gl_format, hex(gl_format))}")
+    return gl_format
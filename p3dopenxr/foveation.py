@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import logging
+from panda3d.core import DisplayRegion, LVector3, NodePath
+from typing import Sequence, TYPE_CHECKING
+
+from .gl import GL
+
+if TYPE_CHECKING:
+    from .projection_view import ProjectionView
+    from .swapchain import Swapchain
+
+
+class FoveatedRenderer:
+    """
+    Render the periphery of each view at a reduced resolution and only the fovea at full resolution.
+
+    For each view, the whole FOV is first rendered into a periphery buffer scaled by periphery_scale, then the
+    fovea, covering fovea_size of the width and height of the image, is rendered at full resolution with a
+    sub-frustum of the view. The periphery is upscaled into the swapchain image before the fovea is drawn over it.
+
+    In 'fixed' mode the fovea is centered on the optical axis of the view, in 'gaze' mode it follows the eye gaze
+    given by XR_EXT_eye_gaze_interaction, or stays at the center when the gaze is not tracked.
+    """
+
+    def __init__(self, mode: str = 'fixed', fovea_size: float = 0.35, periphery_scale: float = 0.5):
+        self.logger = logging.getLogger("foveation")
+        if mode not in ('fixed', 'gaze'):
+            raise ValueError(f"Unknown foveation mode '{mode}'")
+        if not 0 < fovea_size <= 1 or not 0 < periphery_scale <= 1:
+            raise ValueError("Invalid foveation sizes")
+        self.mode = mode
+        self.fovea_size = fovea_size
+        self.periphery_scale = periphery_scale
+        self.fovea_cams: list[NodePath] = []
+        self.fovea_regions: list[DisplayRegion] = []
+        self.gaze_anchor: NodePath = None
+        # Per view : cached projection key, periphery framebuffer and its size
+        self.projection_keys: list[tuple] = []
+        self.periphery_framebuffers: list[int] = []
+        self.periphery_sizes: list[tuple[int, int]] = []
+
+    def get_periphery_size(self, swapchain: Swapchain) -> tuple[int, int]:
+        return (max(1, round(swapchain.width * self.periphery_scale)),
+                max(1, round(swapchain.height * self.periphery_scale)))
+
+    def setup(
+            self, fovea_cams: Sequence[NodePath], fovea_regions: Sequence[DisplayRegion],
+            periphery_sizes: Sequence[tuple[int, int]], gaze_anchor: NodePath = None) -> None:
+        self.fovea_cams = list(fovea_cams)
+        self.fovea_regions = list(fovea_regions)
+        self.periphery_sizes = list(periphery_sizes)
+        self.gaze_anchor = gaze_anchor
+        self.projection_keys = [None] * len(fovea_cams)
+        self.periphery_framebuffers = [0] * len(fovea_cams)
+
+    def get_gaze_tangents(self, cam: NodePath) -> tuple[float, float]:
+        """
+        Return the tangents of the gaze direction in the view space of the camera, or the optical axis.
+        """
+
+        if self.gaze_anchor is None or self.gaze_anchor.is_stashed():
+            return 0.0, 0.0
+        direction = cam.get_relative_vector(self.gaze_anchor, LVector3.forward())
+        if direction.y <= 0:
+            return 0.0, 0.0
+        return direction.x / direction.y, direction.z / direction.y
+
+    def get_fovea_rect(
+            self, view: ProjectionView, center: tuple[float, float], width: int,
+            height: int) -> tuple[int, int, int, int, tuple[float, float, float, float]]:
+        """
+        Return the pixel rectangle (left, right, bottom, top) of the fovea in an image of the given size, and the
+        tangents of its frustum.
+
+        The rectangle is aligned on the pixel grid and its frustum is computed from the aligned rectangle, so the
+        fovea matches exactly the pixels of the periphery it replaces.
+        """
+
+        tan_left, tan_right, tan_up, tan_down = view.get_tangents()
+        tan_width = tan_right - tan_left
+        tan_height = tan_up - tan_down
+        fovea_width = max(1, round(width * self.fovea_size))
+        fovea_height = max(1, round(height * self.fovea_size))
+        # Keep the fovea inside the view
+        center_x = min(max(center[0], tan_left), tan_right)
+        center_y = min(max(center[1], tan_down), tan_up)
+        left = round((center_x - tan_left) / tan_width * width - fovea_width / 2)
+        left = min(max(left, 0), width - fovea_width)
+        bottom = round((center_y - tan_down) / tan_height * height - fovea_height / 2)
+        bottom = min(max(bottom, 0), height - fovea_height)
+        right = left + fovea_width
+        top = bottom + fovea_height
+        tangents = (
+            tan_left + left / width * tan_width,
+            tan_left + right / width * tan_width,
+            tan_down + top / height * tan_height,
+            tan_down + bottom / height * tan_height,
+        )
+        return left, right, bottom, top, tangents
+
+    def update(
+            self, views: Sequence[ProjectionView], cams: Sequence[NodePath], swapchains: Sequence[Swapchain],
+            near: float, far: float) -> None:
+        """
+        Place the fovea of each view and update the frustum of its camera and its display region.
+        """
+
+        for i, (view, cam, swapchain) in enumerate(zip(views, cams, swapchains)):
+            width = swapchain.image_rect_width
+            height = swapchain.image_rect_height
+            center = self.get_gaze_tangents(cam) if self.mode == 'gaze' else (0.0, 0.0)
+            left, right, bottom, top, tangents = self.get_fovea_rect(view, center, width, height)
+            self.fovea_regions[i].set_dimensions(
+                left / swapchain.width, right / swapchain.width, bottom / swapchain.height, top / swapchain.height)
+            key = tangents + (near, far)
+            if key != self.projection_keys[i]:
+                self.projection_keys[i] = key
+                self.fovea_cams[i].node().get_lens().set_user_mat(view.calc_sub_projection_matrix(*key))
+
+    def capture_periphery(self, index: int) -> None:
+        """
+        Remember the framebuffer in which the periphery of the view was rendered, must be called from its draw
+        callback.
+        """
+
+        self.periphery_framebuffers[index] = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+
+    def composite(self, index: int, width: int, height: int) -> None:
+        """
+        Upscale the periphery of the view into the bottom left width x height area of the currently bound draw
+        framebuffer, must be called from the draw callback of the fovea.
+        """
+
+        source = self.periphery_framebuffers[index]
+        if not source:
+            return
+        source_width, source_height = self.periphery_sizes[index]
+        previous_read = GL.glGetIntegerv(GL.GL_READ_FRAMEBUFFER_BINDING)
+        # The blit is clipped by the scissor box of the fovea display region
+        scissor = GL.glIsEnabled(GL.GL_SCISSOR_TEST)
+        if scissor:
+            GL.glDisable(GL.GL_SCISSOR_TEST)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, source)
+        GL.glBlitFramebuffer(
+            0, 0, source_width, source_height, 0, 0, width, height, GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, previous_read)
+        if scissor:
+            GL.glEnable(GL.GL_SCISSOR_TEST)
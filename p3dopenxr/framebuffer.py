@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import logging
+
+from typing import TYPE_CHECKING
+
+from .gl import GL
+
+if TYPE_CHECKING:
+    from .stereo import StereoRenderer
+    from .swapchain import Swapchain
+
+
+def attach_depth_image(depth_image: int, depth_attachment: int = None) -> None:
+    """
+    Attach the depth image, e.g. an image of a depth swapchain, to the currently bound draw framebuffer.
+
+    A depth only image replaces the depth and stencil attachment of the framebuffer, as most drivers do not
+    support separate depth and stencil buffers.
+    """
+
+    if depth_attachment is None:
+        depth_attachment = GL.GL_DEPTH_ATTACHMENT
+    GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, depth_attachment, depth_image, 0)
+    if depth_attachment == GL.GL_DEPTH_ATTACHMENT:
+        GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, GL.GL_STENCIL_ATTACHMENT, 0, 0)
+
+
+class SwapchainFramebuffers:
+    """
+    One persistent framebuffer object per image of a swapchain, all sharing the same depth attachment, which is
+    multisampled like the swapchain.
+
+    The attachments are configured once, the draw callback then only has to bind the framebuffer of the acquired
+    image instead of changing the attachment of the Panda3D buffer every frame, which would force the driver to
+    validate the framebuffer again.
+
+    For a texture array swapchain, the layers are attached by the given StereoRenderer.
+
+    The framebuffer of the Panda3D buffer, bound when the draw callback is called, is recorded when the framebuffers
+    are created and bound back after the draw, it does not change for the lifetime of the buffer.
+
+    If a depth swapchain is given, its images are used as depth attachment instead of the shared depth buffer.
+    The depth image is attached along the color image with the same index and is only attached again if the
+    runtime hands out the images of the two swapchains in a different order.
+
+    All the methods must be called from the draw callback, with the OpenGL context current.
+    """
+
+    def __init__(
+            self, swapchain: Swapchain, stereo: StereoRenderer = None, depth_swapchain: Swapchain = None,
+            depth_attachment: int = None):
+        self.logger = logging.getLogger("framebuffer")
+        self.swapchain = swapchain
+        self.stereo = stereo
+        self.depth_swapchain = depth_swapchain
+        self.depth_attachment = depth_attachment
+        self.framebuffers: list[int] = []
+        # Index of the depth swapchain image attached to each framebuffer
+        self.depth_indices: list[int] = []
+        self.depth_buffer = None
+        self.buffer_framebuffer = 0
+
+    def create(self) -> None:
+        swapchain = self.swapchain
+        self.buffer_framebuffer = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        if self.stereo is None and self.depth_swapchain is None:
+            previous_rb = GL.glGetIntegerv(GL.GL_RENDERBUFFER_BINDING)
+            self.depth_buffer = GL.glGenRenderbuffers(1)
+            GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.depth_buffer)
+            if swapchain.sample_count > 1:
+                GL.glRenderbufferStorageMultisample(
+                    GL.GL_RENDERBUFFER, swapchain.sample_count, GL.GL_DEPTH24_STENCIL8, swapchain.width,
+                    swapchain.height)
+            else:
+                GL.glRenderbufferStorage(
+                    GL.GL_RENDERBUFFER, GL.GL_DEPTH24_STENCIL8, swapchain.width, swapchain.height)
+            GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, previous_rb)
+        for i, image in enumerate(swapchain.images):
+            framebuffer = GL.glGenFramebuffers(1)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, framebuffer)
+            self.framebuffers.append(framebuffer)
+            self.depth_indices.append(None)
+            if self.depth_swapchain is not None:
+                self.attach_depth(i, i % len(self.depth_swapchain.images))
+            elif self.stereo is None:
+                GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image.image, 0)
+                GL.glFramebufferRenderbuffer(
+                    GL.GL_DRAW_FRAMEBUFFER, GL.GL_DEPTH_STENCIL_ATTACHMENT, GL.GL_RENDERBUFFER, self.depth_buffer)
+            else:
+                # The depth texture array is created by the first attach and then shared
+                self.stereo.attach(image.image, swapchain.width, swapchain.height)
+            status = GL.glCheckFramebufferStatus(GL.GL_DRAW_FRAMEBUFFER)
+            if status != GL.GL_FRAMEBUFFER_COMPLETE:
+                self.logger.error(f"Framebuffer of swapchain image {i} is incomplete: {status:#x}")
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.buffer_framebuffer)
+        self.logger.debug(f"Created {len(self.framebuffers)} framebuffers for view {swapchain.view.index}")
+
+    def attach_depth(self, image_index: int, depth_index: int) -> None:
+        """
+        Attach the color image and the given depth swapchain image to the bound framebuffer of the color image.
+        """
+
+        swapchain = self.swapchain
+        image = swapchain.images[image_index].image
+        depth_image = self.depth_swapchain.images[depth_index].image
+        if self.stereo is None:
+            GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image, 0)
+            attach_depth_image(depth_image, self.depth_attachment)
+        else:
+            self.stereo.attach(image, swapchain.width, swapchain.height, depth_image, self.depth_attachment)
+        self.depth_indices[image_index] = depth_index
+
+    def bind(self, image_index: int, depth_index: int = None) -> None:
+        """
+        Bind the framebuffer of the given swapchain image, and of the given depth swapchain image if there is a depth
+        swapchain. The framebuffers are created on first use.
+        """
+
+        if not self.framebuffers:
+            self.create()
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.framebuffers[image_index])
+        if depth_index is not None and depth_index != self.depth_indices[image_index]:
+            self.attach_depth(image_index, depth_index)
+
+    def unbind(self) -> None:
+        # Panda3D tracks the bound framebuffer, it must be restored once the draw is done
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.buffer_framebuffer)
+
+    def release(self) -> None:
+        if self.framebuffers:
+            GL.glDeleteFramebuffers(len(self.framebuffers), self.framebuffers)
+            self.framebuffers = []
+            self.depth_indices = []
+        if self.depth_buffer is not None:
+            GL.glDeleteRenderbuffers(1, [self.depth_buffer])
+            self.depth_buffer = None
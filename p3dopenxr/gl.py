@@ -0,0 +1,26 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Module imported on the first access to one of its attributes.
+
+    PyOpenGL is a large part of the import time of the library, while it is only needed once the rendering chain
+    is created. The attributes are cached on first access, so the next accesses cost the same as with the module.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, name)
+        setattr(self, name, value)
+        return value
+
+
+GL = LazyModule('OpenGL.GL')
+GLX = LazyModule('OpenGL.GLX')
+WGL = LazyModule('OpenGL.WGL')
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import ctypes
+import logging
+import numpy as np
+from panda3d.core import NodePath, PTA_LMatrix4f, PTA_LVecBase4f
+from typing import Sequence, TYPE_CHECKING
+import xr
+
+if TYPE_CHECKING:
+    from .session import Session
+    from .space import Space
+
+
+JOINT_COUNT = xr.HAND_JOINT_COUNT_EXT
+
+# Conversion from OpenXR, Y up with (x, y, z, w) quaternions, to Panda3D, Z up with (w, x, y, z) quaternions
+POSITION_ORDER = np.array([0, 2, 1])
+POSITION_SIGNS = np.array([1, -1, 1], dtype=np.float32)
+ORIENTATION_ORDER = np.array([3, 0, 2, 1])
+ORIENTATION_SIGNS = np.array([1, 1, -1, 1], dtype=np.float32)
+
+
+def poses_to_matrices(orientations: np.ndarray, positions: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    Write in out the Panda3D matrices, row vector convention with the translation in the last row, of the given
+    (w, x, y, z) orientations and positions.
+    """
+
+    w, x, y, z = orientations.T
+    out[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    out[:, 0, 1] = 2 * (x * y + w * z)
+    out[:, 0, 2] = 2 * (x * z - w * y)
+    out[:, 1, 0] = 2 * (x * y - w * z)
+    out[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    out[:, 1, 2] = 2 * (y * z + w * x)
+    out[:, 2, 0] = 2 * (x * z + w * y)
+    out[:, 2, 1] = 2 * (y * z - w * x)
+    out[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    out[:, :3, 3] = 0
+    out[:, 3, :3] = positions
+    out[:, 3, 3] = 1
+    return out
+
+
+class HandTracker:
+    """
+    Articulated tracking of one hand with XR_EXT_hand_tracking.
+
+    The 26 joints of the hand are located in one preallocated buffer and converted at once to the Panda3D
+    coordinate system, relative to the tracking space anchor, into the NumPy arrays positions, orientations
+    (LQuaternion order), radii and valid. is_active is False when the hand is not tracked.
+
+    The joints can be given to shaders, without any per joint call, with bind_shader_inputs() :
+
+        * xr_hand_joints, an array of 26 mat4, the transform of each joint, multiplied by its inverse bind matrix
+          if given, which can be used as the matrix palette of a skinned hand mesh.
+        * xr_hand_joint_spheres, an array of 26 vec4, the position and the radius of each joint.
+    """
+
+    def __init__(self, session: Session, hand: xr.HandEXT, base_space: Space):
+        self.logger = logging.getLogger("hand_tracking")
+        self.session = session
+        self.backend = session.backend
+        self.hand = hand
+        self.handle = self.backend.create_hand_tracker_ext(
+            session.handle,
+            xr.HandTrackerCreateInfoEXT(hand=hand, hand_joint_set=xr.HandJointSetEXT.DEFAULT))
+        # The structures used to locate the joints are allocated once and updated in place
+        self.joint_locations = (xr.HandJointLocationEXT * JOINT_COUNT)()
+        self.locations = xr.HandJointLocationsEXT(joint_locations=self.joint_locations)
+        self.locate_info = xr.HandJointsLocateInfoEXT(base_space=base_space.handle, time=0)
+        raw = (ctypes.c_char * ctypes.sizeof(self.joint_locations)).from_buffer(self.joint_locations)
+        stride = ctypes.sizeof(xr.HandJointLocationEXT)
+        self.raw_flags = np.frombuffer(raw, dtype=np.uint64).reshape(JOINT_COUNT, stride // 8)[:, 0]
+        floats = np.frombuffer(raw, dtype=np.float32).reshape(JOINT_COUNT, stride // 4)
+        offset = xr.HandJointLocationEXT.pose.offset // 4
+        self.raw_orientations = floats[:, offset:offset + 4]
+        self.raw_positions = floats[:, offset + 4:offset + 7]
+        self.raw_radii = floats[:, offset + 7]
+        self.positions = np.zeros((JOINT_COUNT, 3), dtype=np.float32)
+        self.orientations = np.zeros((JOINT_COUNT, 4), dtype=np.float32)
+        self.orientations[:, 0] = 1
+        self.radii = np.zeros(JOINT_COUNT, dtype=np.float32)
+        self.valid = np.zeros(JOINT_COUNT, dtype=bool)
+        self.is_active = False
+        self.valid_bits = xr.SPACE_LOCATION_POSITION_VALID_BIT | xr.SPACE_LOCATION_ORIENTATION_VALID_BIT
+        # Shader inputs, see bind_shader_inputs()
+        self.joint_matrices: PTA_LMatrix4f = None
+        self.joint_spheres: PTA_LVecBase4f = None
+        self.matrices: np.ndarray = None
+        self.spheres: np.ndarray = None
+        self.transforms: np.ndarray = None
+        self.inverse_bind_matrices: np.ndarray = None
+
+    def locate(self, time: int) -> bool:
+        """
+        Locate the joints at the given time and convert them, return True if the hand is tracked.
+        """
+
+        self.locate_info.time = time
+        self.backend.locate_hand_joints_into(self.handle, self.locate_info, self.locations)
+        self.is_active = bool(self.locations.is_active)
+        if not self.is_active:
+            return False
+        np.multiply(self.raw_positions[:, POSITION_ORDER], POSITION_SIGNS, out=self.positions)
+        np.multiply(self.raw_orientations[:, ORIENTATION_ORDER], ORIENTATION_SIGNS, out=self.orientations)
+        self.radii[:] = self.raw_radii
+        np.equal(self.raw_flags & self.valid_bits, self.valid_bits, out=self.valid)
+        if self.matrices is not None:
+            self.update_shader_inputs()
+        return True
+
+    def bind_shader_inputs(self, nodepath: NodePath, inverse_bind_matrices: Sequence = None) -> None:
+        """
+        Set the xr_hand_joints and xr_hand_joint_spheres shader inputs on the nodepath, they are updated in place
+        at each locate(). The transforms are relative to the tracking space anchor.
+
+        inverse_bind_matrices are the 26 inverse bind matrices of the joints of a skinned mesh, in the joint
+        order of XR_HAND_JOINT_SET_DEFAULT_EXT, given as LMatrix4 or as a (26, 4, 4) array.
+        """
+
+        if self.joint_matrices is None:
+            self.joint_matrices = PTA_LMatrix4f.empty_array(JOINT_COUNT)
+            self.joint_spheres = PTA_LVecBase4f.empty_array(JOINT_COUNT)
+            self.matrices = np.asarray(memoryview(self.joint_matrices))
+            self.spheres = np.asarray(memoryview(self.joint_spheres))
+            self.transforms = np.zeros((JOINT_COUNT, 4, 4), dtype=np.float32)
+        if inverse_bind_matrices is not None:
+            self.inverse_bind_matrices = np.array(
+                [np.asarray(matrix, dtype=np.float32).reshape(4, 4) for matrix in inverse_bind_matrices])
+        nodepath.set_shader_input('xr_hand_joints', self.joint_matrices)
+        nodepath.set_shader_input('xr_hand_joint_spheres', self.joint_spheres)
+        self.update_shader_inputs()
+
+    def update_shader_inputs(self) -> None:
+        if self.inverse_bind_matrices is not None:
+            poses_to_matrices(self.orientations, self.positions, self.transforms)
+            # Row vectors : the bind inverse is applied first
+            np.matmul(self.inverse_bind_matrices, self.transforms, out=self.matrices)
+        else:
+            poses_to_matrices(self.orientations, self.positions, self.matrices)
+        self.spheres[:, :3] = self.positions
+        self.spheres[:, 3] = self.radii
+
+    def destroy(self) -> None:
+        if self.handle is not None:
+            try:
+                self.backend.destroy_hand_tracker_ext(self.handle)
+            finally:
+                self.handle = None
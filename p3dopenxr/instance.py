@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import ctypes
 import platform
 from typing import Sequence
@@ -5,6 +7,9 @@ from typing import Sequence
 import logging
 import xr
 
+from .backend import OpenXRBackend
+from .capabilities import RuntimeCapabilities
+
 
 ALL_SEVERITIES = (
     xr.DEBUG_UTILS_MESSAGE_SEVERITY_VERBOSE_BIT_EXT
@@ -42,21 +47,27 @@ class Instance:
             application_version: xr.Version = None,
             api_version: xr.Version = None,
             enable_debug: bool = True,
+            backend=None,
+            capabilities: RuntimeCapabilities = None,
     ) -> None:
-        self.logger = logging.getLogger("instance")
+        """
+        When a capability snapshot is given, the extensions are selected from it instead of being enumerated. The
+        snapshot is checked against the runtime once the instance is created and captured again if the runtime
+        changed, self.capabilities then always describes the current runtime.
+        """
 
-        self.log_extensions()
-        self.log_layers()
+        self.logger = logging.getLogger("instance")
+        if backend is None:
+            backend = OpenXRBackend()
+        self.backend = backend
+        self.capabilities = capabilities
 
         self.debug_callback = xr.PFN_xrDebugUtilsMessengerCallbackEXT(self.debug_callback_py)
 
-        if requested_extensions is None:
-            requested_extensions = []
-            discovered_extensions = xr.enumerate_instance_extension_properties()
-            if xr.KHR_OPENGL_ENABLE_EXTENSION_NAME in discovered_extensions:
-                requested_extensions.append(xr.KHR_OPENGL_ENABLE_EXTENSION_NAME)
-                if xr.EXT_DEBUG_UTILS_EXTENSION_NAME in discovered_extensions:
-                    requested_extensions.append(xr.EXT_DEBUG_UTILS_EXTENSION_NAME)
+        select_extensions = requested_extensions is None
+        if select_extensions:
+            requested_extensions = self.select_extensions(self.get_available_extensions())
+        self.enabled_extensions = list(requested_extensions)
 
         if application_name is None:
             application_name = "Unknown application"
@@ -70,6 +81,7 @@ class Instance:
         if api_version is None:
             api_version = xr.Version(xr.XR_VERSION_MAJOR, 0, 0)
         self.logger.info(f"Request API version {api_version}")
+        self.api_version = api_version
         application_info = xr.ApplicationInfo(
             application_name=application_name,
             application_version=application_version,
@@ -78,25 +90,107 @@ class Instance:
             api_version=api_version,
         )
 
+        self.application_info = application_info
+        self.enable_debug = enable_debug
+        if enable_debug:
+            self.logger.setLevel(logging.DEBUG)
+
+        self.handle = None
+        cached = self.capabilities is not None and self.capabilities.extensions is not None
+        try:
+            self.create_instance()
+        except xr.ExtensionNotPresentError:
+            if not (select_extensions and cached):
+                raise
+            # The snapshot is stale and listed extensions the runtime no longer has
+            self.logger.info("Extensions of the capability snapshot not supported, enumerating them")
+            self.capabilities.extensions = None
+            self.enabled_extensions = self.select_extensions(self.get_available_extensions())
+            self.create_instance()
+            cached = False
+        if self.capabilities is not None:
+            self.validate_capabilities(cached, select_extensions)
+
+    def get_available_extensions(self):
+        """
+        Return the names of the extensions of the runtime, from the capability snapshot if it has them.
+        """
+
+        if self.capabilities is not None and self.capabilities.extensions is not None:
+            return self.capabilities.extensions.keys()
+        discovered_extensions = self.backend.enumerate_instance_extension_properties()
+        if self.capabilities is not None:
+            self.capabilities.set_extensions(discovered_extensions)
+        return discovered_extensions
+
+    @staticmethod
+    def select_extensions(discovered_extensions) -> list[str]:
+        requested_extensions = []
+        if xr.KHR_OPENGL_ENABLE_EXTENSION_NAME in discovered_extensions:
+            requested_extensions.append(xr.KHR_OPENGL_ENABLE_EXTENSION_NAME)
+            if xr.EXT_DEBUG_UTILS_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.EXT_DEBUG_UTILS_EXTENSION_NAME)
+            if xr.KHR_LOCATE_SPACES_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.KHR_LOCATE_SPACES_EXTENSION_NAME)
+            if xr.EXT_EYE_GAZE_INTERACTION_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.EXT_EYE_GAZE_INTERACTION_EXTENSION_NAME)
+            if xr.KHR_COMPOSITION_LAYER_CYLINDER_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.KHR_COMPOSITION_LAYER_CYLINDER_EXTENSION_NAME)
+            if xr.KHR_COMPOSITION_LAYER_DEPTH_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.KHR_COMPOSITION_LAYER_DEPTH_EXTENSION_NAME)
+            if xr.VARJO_QUAD_VIEWS_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.VARJO_QUAD_VIEWS_EXTENSION_NAME)
+            if xr.EXT_HAND_TRACKING_EXTENSION_NAME in discovered_extensions:
+                requested_extensions.append(xr.EXT_HAND_TRACKING_EXTENSION_NAME)
+        return requested_extensions
+
+    def create_instance(self) -> None:
         instance_create_info = xr.InstanceCreateInfo(
             create_flags=xr.InstanceCreateFlags(),
-            application_info=application_info,
+            application_info=self.application_info,
             enabled_api_layer_names=[],
-            enabled_extension_names=requested_extensions,
+            enabled_extension_names=self.enabled_extensions,
         )
 
-        if enable_debug:
-            self.logger.setLevel(logging.DEBUG)
-            if xr.EXT_DEBUG_UTILS_EXTENSION_NAME in requested_extensions:
-                dumci = xr.DebugUtilsMessengerCreateInfoEXT()
-                dumci.message_severities = ALL_SEVERITIES
-                dumci.message_types = ALL_TYPES
-                dumci.user_data = None
-                dumci.user_callback = self.debug_callback
-                instance_create_info.next = ctypes.cast(ctypes.pointer(dumci), ctypes.c_void_p)
-
-        self.handle = xr.create_instance(instance_create_info)
-        self.log_instance_info()
+        if self.enable_debug and xr.EXT_DEBUG_UTILS_EXTENSION_NAME in self.enabled_extensions:
+            dumci = xr.DebugUtilsMessengerCreateInfoEXT()
+            dumci.message_severities = ALL_SEVERITIES
+            dumci.message_types = ALL_TYPES
+            dumci.user_data = None
+            dumci.user_callback = self.debug_callback
+            instance_create_info.next = ctypes.cast(ctypes.pointer(dumci), ctypes.c_void_p)
+
+        self.handle = self.backend.create_instance(instance_create_info)
+
+    def validate_capabilities(self, cached: bool, selected: bool) -> None:
+        """
+        Check that the capability snapshot was captured with the current runtime, otherwise start a new one and, if
+        the extensions were selected from the stale snapshot, select them again and recreate the instance.
+        """
+
+        instance_properties = self.backend.get_instance_properties(instance=self.handle)
+        runtime_name = instance_properties.runtime_name.decode()
+        runtime_version = instance_properties.runtime_version
+        if self.capabilities.matches_runtime(runtime_name, runtime_version):
+            return
+        if self.capabilities.runtime_name is not None:
+            self.logger.info(
+                f"Runtime changed from '{self.capabilities.runtime_name}' "
+                f"{xr.Version(self.capabilities.runtime_version)} to '{runtime_name}' {xr.Version(runtime_version)}, "
+                "capturing its capabilities again")
+        # Extensions enumerated while creating this instance are still valid
+        extensions = self.capabilities.extensions if not cached else None
+        self.capabilities.reset(runtime_name, runtime_version)
+        if extensions is not None:
+            self.capabilities.extensions = extensions
+            return
+        available_extensions = self.get_available_extensions()
+        if selected:
+            requested_extensions = self.select_extensions(available_extensions)
+            if requested_extensions != self.enabled_extensions:
+                self.destroy()
+                self.enabled_extensions = requested_extensions
+                self.create_instance()
 
     def debug_callback_py(
             self,
@@ -114,15 +208,24 @@ class Instance:
         if platform.system() != "Linux":
             if self.handle is not None:
                 try:
-                    xr.destroy_instance(self.handle)
+                    self.backend.destroy_instance(self.handle)
                 finally:
                     self.handle = None
         else:
             self.handle = None
 
+    def log_diagnostics(self):
+        """
+        Log the runtime, its extensions and its API layers, these queries are not needed to create the instance.
+        """
+
+        self.log_instance_info()
+        self.log_extensions()
+        self.log_layers()
+
     def _log_extensions(self, layer_name, indent: int = 0):
         """Write out extension properties for a given api_layer."""
-        extension_properties = xr.enumerate_instance_extension_properties(layer_name)
+        extension_properties = self.backend.enumerate_instance_extension_properties(layer_name)
         indent_str = " " * indent
         self.logger.debug(f"{indent_str}Available Extensions ({len(extension_properties)})")
         for extension in extension_properties:
@@ -133,14 +236,14 @@ class Instance:
         self._log_extensions(layer_name=None)
 
     def log_instance_info(self):
-        instance_properties = xr.get_instance_properties(instance=self.handle)
+        instance_properties = self.backend.get_instance_properties(instance=self.handle)
         self.logger.info(
             f"SpecVersion={xr.XR_CURRENT_API_VERSION} "
             f"Instance RuntimeName={instance_properties.runtime_name.decode()} "
             f"RuntimeVersion={xr.Version(instance_properties.runtime_version)}")
 
     def log_layers(self):
-        layers = xr.enumerate_api_layer_properties()
+        layers = self.backend.enumerate_api_layer_properties()
         self.logger.info(f"Available Layers: ({len(layers)})")
         for layer in layers:
             self.logger.debug(
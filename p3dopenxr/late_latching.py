@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import logging
+from panda3d.core import CS_default, CS_yup_right, LMatrix4, NodePath, PTA_LMatrix4f, ShaderAttrib
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .layer import ProjectionLayer
+
+
+class LateLatching:
+    """
+    Correct the view poses with the tracking state sampled just before the draw instead of before the cull.
+
+    The views are located again in the draw callback, the poses submitted with the projection layer are replaced
+    by the new ones and the cameras are corrected without a new cull :
+
+    * In multi pass mode, the change between the culled pose and the new pose of each camera is provided to
+      the shaders in the xr_late_latch input, which must be applied after the model-view matrix. It transforms
+      the OpenGL view space of the culled camera, the Y-up space produced by p3d_ModelViewMatrix, into the one of
+      the new camera :
+
+          gl_Position = p3d_ProjectionMatrix * (xr_late_latch * (p3d_ModelViewMatrix * p3d_Vertex));
+
+    * In single pass mode, the cameras are moved before the view-projection matrices are computed, so the
+      shaders do not need to be modified.
+    """
+
+    def __init__(self, layer: ProjectionLayer, cams: list[NodePath], move_cameras: bool = False):
+        self.logger = logging.getLogger("late-latching")
+        self.layer = layer
+        self.cams = cams
+        self.move_cameras = move_cameras
+        self.deltas: list[PTA_LMatrix4f] = []
+        self.mat = LMatrix4()
+        # Conversions between the view space of Panda3D and the Y-up view space of OpenGL
+        self.to_gl = LMatrix4.convert_mat(CS_default, CS_yup_right)
+        self.from_gl = LMatrix4.convert_mat(CS_yup_right, CS_default)
+        if not move_cameras:
+            for cam in cams:
+                delta = PTA_LMatrix4f([LMatrix4.ident_mat()])
+                self.deltas.append(delta)
+                # The input is set on the camera so each view gets its own correction
+                attrib = ShaderAttrib.make().set_shader_input('xr_late_latch', delta)
+                cam.node().set_initial_state(cam.node().get_initial_state().add_attrib(attrib))
+
+    def latch(self) -> bool:
+        """
+        Locate the views again and correct the cameras, return False if the new poses are not valid, in which
+        case the poses located before the cull are kept.
+        """
+
+        if not self.layer.latch_views():
+            self.reset()
+            return False
+        for i, (cam, view, latched_view) in enumerate(zip(self.cams, self.layer.views, self.layer.latched_views)):
+            position = view.get_position(latched_view.pose)
+            orientation = view.get_orientation(latched_view.pose)
+            if self.move_cameras:
+                cam.set_pos_quat(position, orientation)
+            else:
+                # Transform from the culled view space to the new view space, both cameras share the same parent,
+                # expressed in the OpenGL view space in which the shaders apply it
+                orientation.extract_to_matrix(self.mat)
+                self.mat.set_row(3, position)
+                self.mat.invert_in_place()
+                self.deltas[i][0] = self.from_gl * cam.get_mat() * self.mat * self.to_gl
+        return True
+
+    def reset(self) -> None:
+        for delta in self.deltas:
+            delta[0] = LMatrix4.ident_mat()
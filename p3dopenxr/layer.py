@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import ctypes
 import logging
-from typing import TYPE_CHECKING
+from panda3d.core import CS_default, CS_yup_right, GraphicsOutput, LMatrix4, LPoint3, LQuaternion
+from typing import Sequence, TYPE_CHECKING
 import xr
 
 from .projection_view import ProjectionView
@@ -16,6 +18,7 @@ class ProjectionLayer:
     def __init__(self, session: Session, space: Space, nb_views: int):
         self.logger = logging.getLogger("layer")
         self.session = session
+        self.backend = session.backend
         self.space = space
         layer_flags = 0
         self.views: list[ProjectionView] = []
@@ -25,30 +28,116 @@ class ProjectionLayer:
             views.append(view)
             self.views.append(ProjectionView(i, view))
         self.render_status: list[bool] = [False] * nb_views
+        # Views rendered in the current frame, the others submit again their last image, see update_views()
+        self.rendered: Sequence[bool] = [True] * nb_views
         self.pose_valid: bool = False
         self.handle = xr.CompositionLayerProjection(layer_flags, space.handle, views=views)
-
-    def update_views(self, swapchains: list[Swapchain]) -> None:
-        view_state, views = xr.locate_views(
-            session=self.session.handle,
-            view_locate_info=xr.ViewLocateInfo(
-                view_configuration_type=self.session.system.view_configuration_type,
-                display_time=self.session.frame_state.predicted_display_time,
-                space=self.space.handle,
-            ),
+        self.header = ctypes.cast(ctypes.pointer(self.handle), ctypes.POINTER(xr.CompositionLayerBaseHeader))
+        # The structures used to locate the views are allocated once and updated in place
+        self.layer_views = list(self.handle.views)
+        self.view_locate_info = xr.ViewLocateInfo(
+            view_configuration_type=self.session.system.view_configuration_type,
+            display_time=0,
+            space=self.space.handle,
         )
-        for i, (layer_view, view, swapchain) in enumerate(zip(self.handle.views, views, swapchains)):
-            self.views[i].set_view(view)
-            layer_view.pose = view.pose
-            layer_view.fov = view.fov
-            layer_view.sub_image.swapchain = swapchain.handle
-            layer_view.sub_image.image_rect.offset[:] = [0, 0]
-            layer_view.sub_image.image_rect.extent[:] = [swapchain.width, swapchain.height]
-        self.render_status = [False] * len(swapchains)
-        flags = view_state.view_state_flags
+        self.view_state = xr.ViewState()
+        self.located_views = (xr.View * nb_views)()
+        self.view_count = ctypes.c_uint32()
+        for view, located_view in zip(self.views, self.located_views):
+            view.set_view(located_view)
+        self.sub_images: list[tuple] = [None] * nb_views
+        # Views located again just before the draw, see latch_views()
+        self.latched_state = xr.ViewState()
+        self.latched_views = (xr.View * nb_views)()
+        # Depth of each view, chained to the projection views, see set_depth_swapchains()
+        self.depth_swapchains: list[Swapchain] = []
+        self.depth_infos: list[xr.CompositionLayerDepthInfoKHR] = []
+        self.depth_range: tuple[float, float] = None
+
+    def update_views(self, swapchains: list[Swapchain], rendered: Sequence[bool] = None) -> None:
+        """
+        Locate the views for the current frame. The views which are not rendered, according to rendered, keep the
+        pose, the field of view and the sub image of their last image, which is submitted again.
+        """
+
+        self.view_locate_info.display_time = self.session.frame_state.predicted_display_time
+        self.backend.locate_views_into(
+            self.session.handle, self.view_locate_info, self.view_state, self.located_views, self.view_count)
+        if rendered is not None:
+            self.rendered = rendered
+        for i, (layer_view, view, swapchain) in enumerate(zip(self.layer_views, self.views, swapchains)):
+            if not self.rendered[i] and self.sub_images[i] is not None:
+                self.render_status[i] = True
+                continue
+            layer_view.pose = view.view.pose
+            layer_view.fov = view.view.fov
+            sub_image = self.sub_images[i]
+            if (sub_image is None or sub_image[0] is not swapchain or
+                    sub_image[1] != swapchain.image_rect_width or sub_image[2] != swapchain.image_rect_height):
+                self.set_sub_image(i, swapchain)
+            self.render_status[i] = False
+        flags = self.view_state.view_state_flags
         self.pose_valid = (
             flags & xr.VIEW_STATE_POSITION_VALID_BIT != 0 and flags & xr.VIEW_STATE_ORIENTATION_VALID_BIT != 0)
 
+    def latch_views(self) -> bool:
+        """
+        Locate the views again for the same display time, the runtime can then use a more recent tracking sample.
+        If the new poses are valid they replace the poses submitted with the layer and True is returned.
+        """
+
+        self.backend.locate_views_into(
+            self.session.handle, self.view_locate_info, self.latched_state, self.latched_views, self.view_count)
+        flags = self.latched_state.view_state_flags
+        if flags & xr.VIEW_STATE_POSITION_VALID_BIT == 0 or flags & xr.VIEW_STATE_ORIENTATION_VALID_BIT == 0:
+            return False
+        for layer_view, latched_view, rendered in zip(self.layer_views, self.latched_views, self.rendered):
+            if rendered:
+                layer_view.pose = latched_view.pose
+        return True
+
+    def set_depth_swapchains(self, swapchains: list[Swapchain], near: float, far: float) -> None:
+        """
+        Submit the depth of each view with XR_KHR_composition_layer_depth, the runtime can then do a positional
+        reprojection of the frames instead of a rotation only one. The depth swapchains must have the same size as
+        the color ones and their content must use the [0, 1] depth range with the given near and far planes.
+        """
+
+        self.depth_swapchains = list(swapchains)
+        self.depth_infos = []
+        for layer_view in self.layer_views:
+            depth_info = xr.CompositionLayerDepthInfoKHR(min_depth=0.0, max_depth=1.0)
+            self.depth_infos.append(depth_info)
+            layer_view.next = ctypes.cast(ctypes.pointer(depth_info), ctypes.c_void_p)
+        self.depth_range = None
+        self.set_depth_range(near, far)
+        # The sub images of the depth are configured with the color ones
+        self.sub_images = [None] * len(self.sub_images)
+
+    def set_depth_range(self, near: float, far: float) -> None:
+        if (near, far) == self.depth_range:
+            return
+        for depth_info in self.depth_infos:
+            depth_info.near_z = near
+            depth_info.far_z = far
+        self.depth_range = (near, far)
+
+    def set_sub_image(self, index: int, swapchain: Swapchain) -> None:
+        layer_view = self.layer_views[index]
+        # With a texture array swapchain, each view is rendered in its own layer
+        image_array_index = index if swapchain.array_size > 1 else 0
+        width = swapchain.image_rect_width
+        height = swapchain.image_rect_height
+        sub_images = [(layer_view.sub_image, swapchain)]
+        if self.depth_infos:
+            sub_images.append((self.depth_infos[index].sub_image, self.depth_swapchains[index]))
+        for sub_image, sub_image_swapchain in sub_images:
+            sub_image.swapchain = sub_image_swapchain.handle
+            sub_image.image_array_index = image_array_index
+            sub_image.image_rect.offset[:] = [0, 0]
+            sub_image.image_rect.extent[:] = [width, height]
+        self.sub_images[index] = (swapchain, width, height)
+
     def render_swapchain(self, index: int) -> bool:
         self.render_status[index] = True
 
@@ -57,3 +146,164 @@ class ProjectionLayer:
 
     def destroy(self) -> None:
         self.handle = None
+        self.header = None
+        self.depth_infos = []
+        self.depth_swapchains = []
+
+
+class OverlayLayer:
+    """
+    Base class of the composition layers showing the content of their own swapchain, like a UI panel, which are
+    composited by the runtime over the projection layer at its native resolution.
+
+    The content is rendered in its own buffer according to the update policy :
+
+    * 'always' : the content is rendered every frame.
+    * 'interval' : the content is rendered every update_interval frames.
+    * 'dirty' : the content is only rendered when mark_dirty() has been called.
+
+    Between two updates the runtime keeps showing the last rendered image, at no cost for the application.
+    The pose is given in the Panda3D coordinate system, relative to the space of the layer.
+    """
+
+    def __init__(
+            self, session: Session, space: Space, swapchain: Swapchain, handle, update_policy: str = 'always',
+            update_interval: int = 1):
+        self.logger = logging.getLogger("layer")
+        if update_policy not in ('always', 'interval', 'dirty'):
+            raise ValueError(f"Unknown update policy '{update_policy}'")
+        self.session = session
+        self.space = space
+        self.swapchain = swapchain
+        self.handle = handle
+        self.header = ctypes.cast(ctypes.pointer(self.handle), ctypes.POINTER(xr.CompositionLayerBaseHeader))
+        self.update_policy = update_policy
+        self.update_interval = max(1, update_interval)
+        self.active = True
+        self.dirty = True
+        # The layer can only be submitted once an image of its swapchain has been released
+        self.rendered = False
+        self.last_update: int = None
+        self.buffer: GraphicsOutput = None
+        self.coord_mat_inv = LMatrix4.convert_mat(CS_default, CS_yup_right)
+        # Alpha blended over the layers below
+        self.handle.layer_flags = xr.COMPOSITION_LAYER_BLEND_TEXTURE_SOURCE_ALPHA_BIT
+        self.handle.space = space.handle
+        self.handle.sub_image.swapchain = swapchain.handle
+        self.handle.sub_image.image_array_index = 0
+        self.handle.sub_image.image_rect.offset[:] = [0, 0]
+        self.handle.sub_image.image_rect.extent[:] = [swapchain.width, swapchain.height]
+
+    def set_pose(self, position: LPoint3, orientation: LQuaternion = None) -> None:
+        position = self.coord_mat_inv.xform_point(position)
+        self.handle.pose.position[:] = [position.x, position.y, position.z]
+        if orientation is not None:
+            # Inverse of the conversion done in ProjectionView.orientation
+            self.handle.pose.orientation[:] = [orientation.get_i(), orientation.get_k(), -orientation.get_j(),
+                                               orientation.get_r()]
+
+    def mark_dirty(self) -> None:
+        self.dirty = True
+
+    def needs_update(self, frame: int) -> bool:
+        if self.update_policy == 'always' or not self.rendered:
+            return True
+        if self.update_policy == 'interval':
+            return frame - self.last_update >= self.update_interval
+        return self.dirty
+
+    def updated(self, frame: int) -> None:
+        self.rendered = True
+        self.dirty = False
+        self.last_update = frame
+
+    def layer_valid(self) -> bool:
+        return self.active and self.rendered
+
+    def destroy(self) -> None:
+        self.handle = None
+        self.header = None
+
+
+class QuadLayer(OverlayLayer):
+    """
+    Flat rectangle of the given size, in meters, facing the +Y axis of its pose.
+    """
+
+    def __init__(self, session: Session, space: Space, swapchain: Swapchain, size: tuple[float, float], **kwargs):
+        super().__init__(session, space, swapchain, xr.CompositionLayerQuad(), **kwargs)
+        self.set_size(size)
+
+    def set_size(self, size: tuple[float, float]) -> None:
+        self.handle.size.width, self.handle.size.height = size
+
+
+class CylinderLayer(OverlayLayer):
+    """
+    Part of a cylinder of the given radius, in meters, centered on its pose, requires
+    XR_KHR_composition_layer_cylinder. The central angle is in radians and the aspect ratio is the width of the
+    arc over its height.
+    """
+
+    def __init__(
+            self, session: Session, space: Space, swapchain: Swapchain, radius: float, central_angle: float,
+            aspect_ratio: float, **kwargs):
+        super().__init__(session, space, swapchain, xr.CompositionLayerCylinderKHR(), **kwargs)
+        self.set_shape(radius, central_angle, aspect_ratio)
+
+    def set_shape(self, radius: float, central_angle: float, aspect_ratio: float) -> None:
+        self.handle.radius = radius
+        self.handle.central_angle = central_angle
+        self.handle.aspect_ratio = aspect_ratio
+
+
+class LayerManager:
+    """
+    Ordered list of the composition layers of the application, submitted from bottom to top at the end of each
+    frame. The projection layer is usually the first one.
+    """
+
+    def __init__(self, max_layers: int):
+        self.max_layers = max_layers
+        self.layers: list = []
+        self.overlays: list[OverlayLayer] = []
+
+    def add_layer(self, layer, index: int = None) -> None:
+        if index is None:
+            self.layers.append(layer)
+        else:
+            self.layers.insert(index, layer)
+        if isinstance(layer, OverlayLayer):
+            self.overlays.append(layer)
+
+    def remove_layer(self, layer) -> None:
+        self.layers.remove(layer)
+        if isinstance(layer, OverlayLayer):
+            self.overlays.remove(layer)
+
+    def update(self, frame: int) -> None:
+        """
+        Only activate the buffers of the layers whose content must be rendered this frame.
+        """
+
+        for overlay in self.overlays:
+            if overlay.buffer is not None:
+                overlay.buffer.set_active(overlay.active and overlay.needs_update(frame))
+
+    def fill(self, frame_layers) -> int:
+        """
+        Store the headers of the valid layers in the frame layers array and return their count.
+        """
+
+        count = 0
+        for layer in self.layers:
+            if count < self.max_layers and layer.layer_valid():
+                frame_layers[count] = layer.header
+                count += 1
+        return count
+
+    def destroy(self) -> None:
+        for layer in self.layers:
+            layer.destroy()
+        self.layers = []
+        self.overlays = []
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from direct.task.TaskManagerGlobal import taskMgr
+import logging
+from panda3d.core import ClockObject, ConfigVariableDouble, GraphicsOutput
+from typing import Sequence, TYPE_CHECKING
+import xr
+
+if TYPE_CHECKING:
+    from direct.task.Task import Task
+    from .session import Session
+
+
+class LifecycleManager:
+    """
+    Adapt the work done by the application to the state of the session.
+
+    * The render buffers are only active when the runtime expects the frames to be rendered, i.e. when the
+      should_render flag of the frame state is set.
+    * While the session is not running (IDLE, STOPPING, ...) there is no xrWaitFrame to pace the main loop, its
+      frame rate is then limited to idle_frame_rate.
+    * The tasks which need the input focus, like the polling of the actions, are paused outside the FOCUSED state.
+    """
+
+    def __init__(
+            self, session: Session, buffers: Sequence[GraphicsOutput], focused_tasks: Sequence[Task] = (),
+            idle_frame_rate: float = 10.0):
+        self.logger = logging.getLogger("lifecycle")
+        self.session = session
+        self.buffers = list(buffers)
+        self.focused_tasks = list(focused_tasks)
+        self.idle_frame_rate = idle_frame_rate
+        self.clock = ClockObject.get_global_clock()
+        # Clock mode of the application, restored when the session is running
+        self.clock_mode = self.clock.get_mode()
+        self.throttled = False
+        self.buffers_active = True
+        self.tasks_paused = False
+        session.add_state_listener(self.on_state_changed)
+        self.on_state_changed(session.state, session.state)
+
+    def on_state_changed(self, old_state: xr.SessionState, new_state: xr.SessionState) -> None:
+        self.set_throttled(not self.session.session_active())
+        self.set_tasks_paused(new_state != xr.SessionState.FOCUSED)
+        if new_state not in (xr.SessionState.VISIBLE, xr.SessionState.FOCUSED):
+            self.set_buffers_active(False)
+
+    def update(self) -> None:
+        """
+        Activate or deactivate the render buffers according to the frame state of the current frame.
+        """
+
+        self.set_buffers_active(self.session.frame_begun and self.session.should_render())
+
+    def add_buffer(self, buffer: GraphicsOutput) -> None:
+        """
+        Manage a render buffer created after the manager, e.g. the buffer of an overlay layer.
+        """
+
+        self.buffers.append(buffer)
+        buffer.set_active(self.buffers_active)
+
+    def remove_buffer(self, buffer: GraphicsOutput) -> None:
+        if buffer in self.buffers:
+            self.buffers.remove(buffer)
+
+    def set_buffers_active(self, active: bool) -> None:
+        if active == self.buffers_active:
+            return
+        self.logger.debug(f"{'Activate' if active else 'Deactivate'} render buffers")
+        for buffer in self.buffers:
+            buffer.set_active(active)
+        self.buffers_active = active
+
+    def set_throttled(self, throttled: bool) -> None:
+        if throttled == self.throttled:
+            return
+        if throttled:
+            self.logger.info(f"Session not running, limiting the frame rate to {self.idle_frame_rate}")
+            self.clock_mode = self.clock.get_mode()
+            self.clock.set_mode(ClockObject.M_limited)
+            self.clock.set_frame_rate(self.idle_frame_rate)
+        else:
+            self.logger.info("Session running, frame rate no longer limited")
+            self.clock.set_mode(self.clock_mode)
+            # The frame rate can not be queried, the configured one is restored
+            self.clock.set_frame_rate(ConfigVariableDouble('clock-frame-rate', 1.0).get_value())
+        self.throttled = throttled
+
+    def set_tasks_paused(self, paused: bool) -> None:
+        if paused == self.tasks_paused:
+            return
+        for task in self.focused_tasks:
+            if paused:
+                taskMgr.remove(task)
+            else:
+                taskMgr.add(task)
+        self.tasks_paused = paused
+
+    def destroy(self) -> None:
+        self.session.remove_state_listener(self.on_state_changed)
+        self.set_throttled(False)
+        self.set_tasks_paused(False)
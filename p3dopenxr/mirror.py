@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import logging
+from panda3d.core import Camera, DisplayRegion, GraphicsOutput, NodePath, PythonCallbackObject
+from typing import Sequence, TYPE_CHECKING
+
+from .formats import get_color_format
+from .gl import GL
+
+if TYPE_CHECKING:
+    from .swapchain import Swapchain
+
+
+MIRROR_MODES = ('left', 'right', 'side-by-side', 'cropped')
+
+
+def blit_framebuffer(
+        read_framebuffer: int, draw_framebuffer: int, source: tuple[int, int, int, int],
+        destination: tuple[int, int, int, int], filtering: int) -> None:
+    """
+    Copy the source area of the read framebuffer into the destination area of the draw framebuffer, or of the
+    currently bound one if None. The scissor test and the sRGB conversion, which would alter the copy, are disabled
+    during the blit and all the state is restored.
+    """
+
+    previous_read = GL.glGetIntegerv(GL.GL_READ_FRAMEBUFFER_BINDING)
+    previous_draw = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+    scissor = GL.glIsEnabled(GL.GL_SCISSOR_TEST)
+    srgb = GL.glIsEnabled(GL.GL_FRAMEBUFFER_SRGB)
+    if scissor:
+        GL.glDisable(GL.GL_SCISSOR_TEST)
+    if srgb:
+        GL.glDisable(GL.GL_FRAMEBUFFER_SRGB)
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, read_framebuffer)
+    if draw_framebuffer is not None:
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, draw_framebuffer)
+    GL.glBlitFramebuffer(*source, *destination, GL.GL_COLOR_BUFFER_BIT, filtering)
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, previous_read)
+    GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, previous_draw)
+    if scissor:
+        GL.glEnable(GL.GL_SCISSOR_TEST)
+    if srgb:
+        GL.glEnable(GL.GL_FRAMEBUFFER_SRGB)
+
+
+def create_read_framebuffer(image: int, layer: int = None) -> int:
+    """
+    Create a framebuffer reading the given texture image, or the given layer of a texture array image.
+    """
+
+    previous = GL.glGetIntegerv(GL.GL_READ_FRAMEBUFFER_BINDING)
+    framebuffer = GL.glGenFramebuffers(1)
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, framebuffer)
+    if layer is None:
+        GL.glFramebufferTexture(GL.GL_READ_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image, 0)
+    else:
+        GL.glFramebufferTextureLayer(GL.GL_READ_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image, 0, layer)
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, previous)
+    return framebuffer
+
+
+class DesktopMirror:
+    """
+    Show in the main window what the user sees in the headset, without rendering the scene again.
+
+    The images of the mirrored views are copied on the GPU with glBlitFramebuffer, from the swapchain images while
+    they are still acquired, into a mirror framebuffer owned by the application. The mirror framebuffer is then
+    blitted into the main window, which is drawn after the render buffers of the views, once the frame has been
+    submitted. There is no readback to the CPU.
+
+    mode is :
+
+        * 'left' or 'right', the image of one eye.
+        * 'side-by-side', the images of both eyes next to each other.
+        * 'cropped', the center of the left eye, covering crop of its width or height and cropped to the aspect
+          ratio of the window, which hides the distorted edges of the wide field of view of the headset.
+
+    The images are downscaled by scale when they are copied, except for multisampled swapchains as a resolve can
+    not scale, and the mirror is fitted in the window keeping its aspect ratio.
+
+    If refresh_rate is given, the mirror is only updated refresh_rate times per second and the main window is not
+    drawn at all between two updates, by default it is updated at each frame.
+
+    capture() and present() must be called from the draw callbacks, with the OpenGL context current.
+    """
+
+    def __init__(self, mode: str = 'left', scale: float = 1.0, refresh_rate: float = None, crop: float = 0.75):
+        self.logger = logging.getLogger("mirror")
+        if mode not in MIRROR_MODES:
+            raise ValueError(f"Unknown mirror mode '{mode}'")
+        if not 0 < scale <= 1 or not 0 < crop <= 1:
+            raise ValueError("Invalid mirror scale or crop")
+        if refresh_rate is not None and refresh_rate <= 0:
+            raise ValueError("Invalid mirror refresh rate")
+        self.mode = mode
+        self.scale = scale
+        self.refresh_rate = refresh_rate
+        self.refresh_period = int(1e9 / refresh_rate) if refresh_rate is not None else None
+        self.crop = crop
+        self.window: GraphicsOutput = None
+        self.display_region: DisplayRegion = None
+        self.swapchains: list[Swapchain] = []
+        self.headless = False
+        # Index of the mirrored views
+        self.views: list[int] = []
+        self.multisampled = False
+        self.capture_scale = scale
+        self.color_format = None
+        # Size of the window, of the image of one view and of the whole mirror in the mirror framebuffer
+        self.window_size: tuple[int, int] = None
+        self.view_size: tuple[int, int] = None
+        self.size: tuple[int, int] = None
+        # Fraction of the width and height of the views which is mirrored
+        self.crop_size: tuple[float, float] = (1.0, 1.0)
+        # Area of each mirrored view in the mirror framebuffer, and area actually written by the last capture
+        self.destinations: dict[int, tuple[int, int, int, int]] = {}
+        self.captured: dict[int, tuple[int, int, int, int]] = {}
+        self.framebuffer = None
+        self.color_buffer = None
+        self.allocated_size: tuple[int, int] = None
+        # Framebuffer reading each swapchain image, keyed by image and array layer
+        self.read_framebuffers: dict[tuple[int, int], int] = {}
+        self.capture_pending = False
+        self.next_update: int = None
+        self.updates = 0
+
+    def setup(
+            self, window: GraphicsOutput, swapchains: Sequence[Swapchain], sc_format: int,
+            headless: bool = False) -> None:
+        """
+        Mirror the views rendered into the given swapchains, one per view, into the window.
+        """
+
+        self.window = window
+        self.swapchains = list(swapchains)
+        self.headless = headless
+        nb_views = len(self.swapchains)
+        # With more than two views, e.g. a quad view configuration, the first two are the left and right views
+        if self.mode == 'right':
+            self.views = [min(1, nb_views - 1)]
+        elif self.mode == 'side-by-side':
+            self.views = list(range(min(2, nb_views)))
+        else:
+            self.views = [0]
+        self.multisampled = any(self.swapchains[view].sample_count > 1 for view in self.views)
+        self.capture_scale = 1.0 if self.multisampled else self.scale
+        color_format = get_color_format(sc_format)
+        if self.multisampled:
+            # A resolve requires identical formats
+            self.color_format = sc_format
+        elif color_format is not None and color_format.float_color:
+            self.color_format = GL.GL_RGBA16F
+        elif color_format is not None and color_format.srgb:
+            self.color_format = GL.GL_SRGB8_ALPHA8
+        else:
+            self.color_format = GL.GL_RGBA8
+        # The mirror is drawn before the default display regions, so the 2D scene of the window stays on top
+        root = NodePath("mirror")
+        self.display_region = window.make_display_region(0, 1, 0, 1)
+        self.display_region.set_sort(-10)
+        self.display_region.set_camera(root.attach_new_node(Camera("mirror-cam")))
+        self.display_region.disable_clears()
+        self.display_region.set_draw_callback(PythonCallbackObject(self.present))
+        self.configure()
+
+    def configure(self) -> None:
+        """
+        Compute the layout of the mirror for the current size of the window.
+        """
+
+        self.window_size = (self.window.get_x_size(), self.window.get_y_size())
+        swapchain = self.swapchains[self.views[0]]
+        width = swapchain.width * self.capture_scale
+        height = swapchain.height * self.capture_scale
+        if self.mode == 'cropped':
+            window_width, window_height = self.window_size
+            aspect_ratio = window_width / window_height if window_width > 0 and window_height > 0 else 1.0
+            crop_width = width * self.crop
+            crop_height = height * self.crop
+            if crop_width / crop_height > aspect_ratio:
+                crop_width = crop_height * aspect_ratio
+            else:
+                crop_height = crop_width / aspect_ratio
+            self.crop_size = (crop_width / width, crop_height / height)
+            width, height = crop_width, crop_height
+        width = max(1, round(width))
+        height = max(1, round(height))
+        self.view_size = (width, height)
+        self.size = (width * len(self.views), height)
+        self.destinations = {view: (i * width, 0, (i + 1) * width, height) for i, view in enumerate(self.views)}
+        self.captured = {}
+        self.logger.debug(f"Mirror {self.mode} {self.size[0]}x{self.size[1]} in {self.window_size}")
+
+    def update(self, display_time: int, display_period: int) -> bool:
+        """
+        Decide if the mirror is updated in the frame displayed at the given time, must be called before the frame
+        is rendered. Return True if it is updated.
+        """
+
+        if (self.window.get_x_size(), self.window.get_y_size()) != self.window_size:
+            self.configure()
+            self.next_update = None
+        due = (self.refresh_period is None or self.next_update is None or
+               display_time + display_period // 2 >= self.next_update)
+        if due and self.refresh_period is not None:
+            self.next_update = display_time + self.refresh_period
+        if self.refresh_period is not None and due != self.capture_pending:
+            # The window is only drawn when the mirror is updated
+            self.window.set_active(due)
+        self.capture_pending = due
+        if due:
+            self.updates += 1
+        return due
+
+    def get_source(self, swapchain: Swapchain) -> tuple[int, int, int, int]:
+        width = swapchain.image_rect_width
+        height = swapchain.image_rect_height
+        crop_width = round(width * self.crop_size[0])
+        crop_height = round(height * self.crop_size[1])
+        x = (width - crop_width) // 2
+        y = (height - crop_height) // 2
+        return x, y, x + crop_width, y + crop_height
+
+    def capture(self, view: int, image: int, layer: int = None) -> None:
+        """
+        Copy the rendered image of the view, or the given layer of a texture array image, into the mirror
+        framebuffer if the mirror is updated in this frame. The image must still be acquired.
+        """
+
+        if not self.capture_pending or view not in self.destinations or self.headless:
+            return
+        if self.allocated_size != self.size:
+            self.release_target()
+            self.create_target()
+        x0, y0, x1, y1 = self.get_source(self.swapchains[view])
+        destination = self.destinations[view]
+        if self.multisampled:
+            # A resolve can not scale, only the part of the image fitting in the mirror is copied
+            dx0, dy0, dx1, dy1 = destination
+            width = min(x1 - x0, dx1 - dx0)
+            height = min(y1 - y0, dy1 - dy0)
+            x1, y1 = x0 + width, y0 + height
+            destination = (dx0, dy0, dx0 + width, dy0 + height)
+        scaled = x1 - x0 != destination[2] - destination[0] or y1 - y0 != destination[3] - destination[1]
+        blit_framebuffer(
+            self.get_read_framebuffer(image, layer), self.framebuffer, (x0, y0, x1, y1), destination,
+            GL.GL_LINEAR if scaled else GL.GL_NEAREST)
+        self.captured[view] = destination
+
+    def present(self, cbdata) -> None:
+        """
+        Draw callback of the display region of the window, blit the mirror fitted in the window.
+        """
+
+        cbdata.upcall()
+        if self.headless or not self.captured:
+            return
+        window_width = self.display_region.get_pixel_width()
+        window_height = self.display_region.get_pixel_height()
+        mirror_width, mirror_height = self.size
+        scale = min(window_width / mirror_width, window_height / mirror_height)
+        x = (window_width - mirror_width * scale) / 2
+        y = (window_height - mirror_height * scale) / 2
+        for view, source in self.captured.items():
+            dx0, dy0, dx1, dy1 = self.destinations[view]
+            destination = (round(x + dx0 * scale), round(y + dy0 * scale),
+                           round(x + dx1 * scale), round(y + dy1 * scale))
+            blit_framebuffer(self.framebuffer, None, source, destination, GL.GL_LINEAR)
+
+    def get_read_framebuffer(self, image: int, layer: int = None) -> int:
+        key = (image, layer)
+        framebuffer = self.read_framebuffers.get(key)
+        if framebuffer is None:
+            framebuffer = create_read_framebuffer(image, layer)
+            self.read_framebuffers[key] = framebuffer
+        return framebuffer
+
+    def create_target(self) -> None:
+        width, height = self.size
+        previous = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        previous_rb = GL.glGetIntegerv(GL.GL_RENDERBUFFER_BINDING)
+        self.framebuffer = GL.glGenFramebuffers(1)
+        self.color_buffer = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.color_buffer)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, self.color_format, width, height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, previous_rb)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.framebuffer)
+        GL.glFramebufferRenderbuffer(
+            GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, self.color_buffer)
+        status = GL.glCheckFramebufferStatus(GL.GL_DRAW_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            self.logger.error(f"Mirror framebuffer is incomplete: {status:#x}")
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, previous)
+        self.allocated_size = self.size
+        self.logger.debug(f"Created mirror framebuffer {width}x{height}")
+
+    def release_target(self) -> None:
+        if self.framebuffer is not None:
+            GL.glDeleteFramebuffers(1, [self.framebuffer])
+            GL.glDeleteRenderbuffers(1, [self.color_buffer])
+            self.framebuffer = None
+            self.color_buffer = None
+        self.allocated_size = None
+
+    def destroy(self) -> None:
+        """
+        Remove the mirror from the window, the OpenGL objects are released with the context.
+        """
+
+        if self.display_region is not None:
+            self.window.remove_display_region(self.display_region)
+            self.display_region = None
+        if self.window is not None:
+            self.window.set_active(True)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import logging
+
+from .dynamic_resolution import FrameTimeController
+from .gl import GL
+
+
+class MultisampleTarget:
+    """
+    Multisampled framebuffer in which a view is rendered before being resolved into the acquired swapchain image,
+    used when the runtime does not support multisampled swapchains or when the sample count changes at runtime.
+
+    The color buffer uses the format of the swapchain, as a resolve can not convert the format, and the depth buffer
+    the format of the depth swapchain, if any, so the depth can be resolved too.
+
+    The framebuffer of the Panda3D buffer, bound for reading and drawing when the draw callback is called, is
+    recorded when the target is created, it does not change for the lifetime of the buffer.
+
+    All the methods, except set_samples(), must be called from the draw callback, with the OpenGL context current.
+    """
+
+    def __init__(
+            self, width: int, height: int, samples: int, color_format: int,
+            depth_format: int = None, depth_attachment: int = None):
+        self.logger = logging.getLogger("multisample")
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.color_format = color_format
+        if depth_format is None:
+            depth_format = GL.GL_DEPTH24_STENCIL8
+            depth_attachment = GL.GL_DEPTH_STENCIL_ATTACHMENT
+        self.depth_format = depth_format
+        self.depth_attachment = depth_attachment
+        self.framebuffer = None
+        self.color_buffer = None
+        self.depth_buffer = None
+        # Sample count of the allocated buffers
+        self.allocated_samples = None
+        self.buffer_framebuffer = 0
+        # Framebuffer receiving the resolved image
+        self.resolve_framebuffer = 0
+
+    def set_samples(self, samples: int) -> None:
+        """
+        Change the sample count, the buffers are reallocated at the next bind.
+        """
+
+        self.samples = samples
+
+    def create(self) -> None:
+        self.buffer_framebuffer = GL.glGetIntegerv(GL.GL_READ_FRAMEBUFFER_BINDING)
+        previous = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        previous_rb = GL.glGetIntegerv(GL.GL_RENDERBUFFER_BINDING)
+        self.framebuffer = GL.glGenFramebuffers(1)
+        self.color_buffer, self.depth_buffer = GL.glGenRenderbuffers(2)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.color_buffer)
+        GL.glRenderbufferStorageMultisample(
+            GL.GL_RENDERBUFFER, self.samples, self.color_format, self.width, self.height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.depth_buffer)
+        GL.glRenderbufferStorageMultisample(
+            GL.GL_RENDERBUFFER, self.samples, self.depth_format, self.width, self.height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, previous_rb)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.framebuffer)
+        GL.glFramebufferRenderbuffer(
+            GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, self.color_buffer)
+        GL.glFramebufferRenderbuffer(
+            GL.GL_DRAW_FRAMEBUFFER, self.depth_attachment, GL.GL_RENDERBUFFER, self.depth_buffer)
+        status = GL.glCheckFramebufferStatus(GL.GL_DRAW_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            self.logger.error(f"Multisampled framebuffer is incomplete: {status:#x}")
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, previous)
+        self.allocated_samples = self.samples
+        self.logger.debug(f"Created {self.samples}x multisampled framebuffer {self.width}x{self.height}")
+
+    def bind(self, framebuffer: int = None) -> None:
+        """
+        Bind the multisampled framebuffer, the resolved image is written into the given framebuffer, by default the
+        framebuffer of the Panda3D buffer.
+        """
+
+        if self.allocated_samples != self.samples:
+            self.release()
+            self.create()
+        self.resolve_framebuffer = framebuffer if framebuffer is not None else self.buffer_framebuffer
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.framebuffer)
+
+    def resolve(self, x: int, y: int, width: int, height: int, depth: bool = False) -> None:
+        """
+        Resolve the given area into the framebuffer given to bind() and bind it again. The area must match the
+        scissor box, if the scissor test is enabled.
+        """
+
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.framebuffer)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.resolve_framebuffer)
+        mask = GL.GL_COLOR_BUFFER_BIT
+        if depth:
+            mask |= GL.GL_DEPTH_BUFFER_BIT
+        GL.glBlitFramebuffer(x, y, x + width, y + height, x, y, x + width, y + height, mask, GL.GL_NEAREST)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.buffer_framebuffer)
+
+    def release(self) -> None:
+        if self.framebuffer is not None:
+            GL.glDeleteFramebuffers(1, [self.framebuffer])
+            GL.glDeleteRenderbuffers(2, [self.color_buffer, self.depth_buffer])
+            self.framebuffer = None
+            self.color_buffer = None
+            self.depth_buffer = None
+        self.allocated_samples = None
+
+
+class AdaptiveMultisampling(FrameTimeController):
+    """
+    Pick the sample count of the multisampled rendering from the frame-time budget.
+
+    The sample count is halved, down to min_samples, when the frame time is over budget and doubled, up to
+    max_samples, when it is under budget, see FrameTimeController. The lower threshold is lower than for the
+    dynamic resolution as doubling the sample count costs more than a resolution step.
+    """
+
+    def __init__(
+            self,
+            max_samples: int = 4,
+            min_samples: int = 1,
+            target: float = 0.9,
+            upper_threshold: float = 1.0,
+            lower_threshold: float = 0.6,
+            hysteresis: int = 30):
+        super().__init__(target, upper_threshold, lower_threshold, hysteresis)
+        self.logger = logging.getLogger("multisample")
+        if not 1 <= min_samples <= max_samples:
+            raise ValueError("Invalid multisampling sample count bounds")
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.samples = max_samples
+
+    def update(self, display_period: float) -> bool:
+        """
+        Update the sample count from the last measures, the display period is in seconds. Return True if it
+        changed.
+        """
+
+        change = self.measure(display_period)
+        if change < 0:
+            samples = max(self.min_samples, self.samples // 2)
+        elif change > 0:
+            samples = min(self.max_samples, self.samples * 2)
+        else:
+            return False
+        if samples == self.samples:
+            return False
+        self.logger.debug(f"Sample count {self.samples} -> {samples} (load {self.load:.2f})")
+        self.samples = samples
+        return True
@@ -2,22 +2,35 @@ import atexit
 from direct.task.TaskManagerGlobal import taskMgr
 from functools import partial
 import logging
-from OpenGL import GL
 import os
+import time
 from panda3d.core import load_prc_file_data, NodePath, LMatrix4
 from panda3d.core import FrameBufferProperties, PythonCallbackObject
-from panda3d.core import Camera, MatrixLens
+from panda3d.core import Camera, MatrixLens, OrthographicLens
 import xr
 
 from .actionset import ActionSet
+from .capabilities import RuntimeCapabilities
+from .dynamic_resolution import DynamicResolution, FrameTimeController, GpuTimer
+from .formats import get_color_format, select_color_format
+from .foveation import FoveatedRenderer
+from .framebuffer import attach_depth_image, SwapchainFramebuffers
+from .gl import GL
 from .instance import Instance
-from .layer import ProjectionLayer
-from .session import Session
-from .space import Space
+from .late_latching import LateLatching
+from .layer import CylinderLayer, LayerManager, OverlayLayer, ProjectionLayer, QuadLayer
+from .lifecycle import LifecycleManager
+from .mirror import DesktopMirror
+from .multisample import AdaptiveMultisampling, MultisampleTarget
+from .pacing import FramePacer
+from .projection_view import update_projection_matrices
+from .profiler import FrameProfiler, NullProfiler
+from .session import get_format_names, MAX_LAYERS, Session
+from .space import Space, SpaceLocator
+from .stereo import StereoRenderer
 from .swapchain import Swapchain
 from .system import System
-
-logging.basicConfig(level=logging.DEBUG)
+from .view_policy import get_view_configuration_type, get_view_policies, ViewPolicy, ViewScheduler
 
 # Disable v-sync, it will be managed by waitGetPoses()
 load_prc_file_data("", "sync-video 0")
@@ -42,6 +55,7 @@ class P3DOpenXR():
         self.cams = []
         self.dr: list = []
         self.nextsort = self.base.win.getSort() - 1000
+        self.capabilities: RuntimeCapabilities = None
         self.instance: Instance = None
         self.system: System = None
         self.session: Session = None
@@ -50,10 +64,47 @@ class P3DOpenXR():
         self.tracking_space: Space = None
         self.view_space: Space = None
         self.swapchains: list[Swapchain] = []
+        self.view_swapchains: list[Swapchain] = []
+        self.depth_swapchains: list[Swapchain] = []
+        self.depth_format: int = None
+        self.depth_attachment: int = None
+        self.msaa_targets: list[MultisampleTarget] = []
+        self.multisampling: AdaptiveMultisampling = None
+        self.framebuffers: list[SwapchainFramebuffers] = []
+        # Release functions of OpenGL objects, called from the next draw callback
+        self.gl_releases: list = []
+        self.stereo: StereoRenderer = None
+        self.cull_cam: NodePath = None
         self.layer: ProjectionLayer = None
-        self.end_frame_called = False
+        self.layers = LayerManager(MAX_LAYERS)
+        self.frame_count = 0
+        self.overlay_sort = self.base.win.getSort() - 2000
+        self.late_latching: LateLatching = None
+        self.pacer: FramePacer = None
+        self.lifecycle: LifecycleManager = None
+        self.dynamic_resolution: DynamicResolution = None
+        self.foveation: FoveatedRenderer = None
+        self.mirror: DesktopMirror = None
+        self.swapchain_format: int = None
+        self.view_policies: list[ViewPolicy] = []
+        self.view_scheduler: ViewScheduler = None
+        # Views rendered in the current frame, the first one collects the GPU timings and the last one ends the frame
+        self.rendered_views: list[int] = []
+        self.frame_time_controllers: list[FrameTimeController] = []
+        self.gpu_timer: GpuTimer = None
+        self.periphery_buffers = []
+        self.frame_start: float = None
+        # Set when the main loop has acquired a begun frame, until it is ended. With the pacing thread the session may
+        # already have begun the next frame, whose state has not been copied yet
+        self.frame_acquired = False
         self.near: float = None
         self.far: float = None
+        self.profiler = NullProfiler()
+        self.pose_recorder = None
+        self.session_recorder = None
+        self.frame_capture = None
+        self.hand_trackers = []
+        self.render_stages: list[tuple[str, ...]] = []
         atexit.register(self.destroy)
 
     def create_default_fb_props(self):
@@ -94,6 +145,7 @@ class P3DOpenXR():
         if cc is not None:
             dr.set_clear_color_active(1)
             dr.set_clear_color(cc)
+        return dr
 
     def create_camera(self, name: str) -> Camera:
         """
@@ -106,6 +158,291 @@ class P3DOpenXR():
         cam_node.set_lens(lens)
         return cam_node
 
+    def log_diagnostics(self):
+        """
+        Log the properties of the runtime : extensions, API layers, system, view configurations, swapchain formats
+        and reference spaces.
+        """
+
+        self.instance.log_diagnostics()
+        self.system.log_diagnostics()
+        self.session.log_diagnostics()
+
+    def enable_profiler(self, size=1024, pstats=False) -> FrameProfiler:
+        """
+        Record the time spent in each stage of the frame loop, see FrameProfiler.
+        """
+
+        self.profiler = FrameProfiler(size, pstats)
+        if self.pacer is not None:
+            self.pacer.set_profiler(self.profiler)
+        return self.profiler
+
+    def disable_profiler(self):
+        self.profiler = NullProfiler()
+        if self.pacer is not None:
+            self.pacer.set_profiler(self.profiler)
+
+    def enable_pose_history(self, capacity=256):
+        """
+        Record the poses of the HMD ('hmd'), of each view ('view0', ...) and of each linked pose (by subaction path,
+        e.g. '/user/hand/left') at each frame into a PoseHistory holding the last capacity frames. Requires NumPy
+        and must be called after init().
+        """
+
+        from .pose_history import PoseHistory, PoseRecorder
+
+        names = ['hmd'] + [f'view{i}' for i in range(len(self.layer.views))]
+        names += [link.name for link in self.action_set.pose_links]
+        history = PoseHistory(names, capacity)
+        hmd_locator = SpaceLocator(self.session, self.app_space, [self.view_space.handle])
+        self.pose_recorder = PoseRecorder(history, hmd_locator, self.layer, self.action_set)
+        return history
+
+    def disable_pose_history(self):
+        self.pose_recorder = None
+
+    def start_recording(self, filename, batch_size=64):
+        """
+        Record the frame states, the located views, the linked poses and the session state changes into filename,
+        until stop_recording() is called, see SessionRecorder. The recording can be replayed with a ReplayBackend.
+        Requires NumPy and must be called after init().
+        """
+
+        from .recording import SessionRecorder
+
+        self.stop_recording()
+        self.session_recorder = SessionRecorder(filename, self.session, self.layer, self.action_set, batch_size)
+        return self.session_recorder
+
+    def stop_recording(self):
+        if self.session_recorder is not None:
+            self.session_recorder.close()
+            self.session_recorder = None
+
+    def start_capture(self, writer, views=(0,), interval=1, scale=1.0, ring_size=3, pool_size=4):
+        """
+        Capture the images of the given views and give them to writer, e.g. an ImageWriter or a VideoWriter, until
+        stop_capture() is called, see FrameCapture. The readback never stalls the rendering, the frames which can
+        not be captured in time are skipped. Requires NumPy and must be called after init().
+        """
+
+        from .capture import FrameCapture
+
+        self.close_capture()
+        self.frame_capture = FrameCapture(writer, views, interval, scale, ring_size, pool_size)
+        self.frame_capture.setup(self.view_swapchains, self.swapchain_format, self.session.backend.headless)
+        return self.frame_capture
+
+    def stop_capture(self):
+        """
+        Stop the capture, the images already read back are still written by the writer thread.
+        """
+
+        if self.frame_capture is not None:
+            self.frame_capture.stop()
+
+    def close_capture(self):
+        """
+        Close the current capture without waiting for the frames in flight, its OpenGL objects are released in the
+        next draw callback.
+        """
+
+        if self.frame_capture is not None:
+            self.frame_capture.close()
+            if not self.session.backend.headless:
+                self.gl_releases.append(self.frame_capture.release)
+            self.frame_capture = None
+
+    def create_hand_trackers(self):
+        """
+        Create the trackers of the left and right hands, if the runtime supports it.
+        """
+
+        if xr.EXT_HAND_TRACKING_EXTENSION_NAME not in self.instance.enabled_extensions:
+            self.logger.warning("Hand tracking is not supported by the runtime")
+            return
+        from .hand_tracking import HandTracker
+
+        try:
+            for hand in (xr.HandEXT.LEFT, xr.HandEXT.RIGHT):
+                self.hand_trackers.append(HandTracker(self.session, hand, self.app_space))
+        except xr.FeatureUnsupportedError:
+            self.logger.warning("Hand tracking is not supported by the system")
+            for hand_tracker in self.hand_trackers:
+                hand_tracker.destroy()
+            self.hand_trackers = []
+
+    def get_swapchain_size(self, view):
+        """
+        Return the size of the swapchain images for the given view, or None to use the recommended size.
+        """
+
+        if self.dynamic_resolution is None:
+            return None, None
+        return self.dynamic_resolution.get_swapchain_size(view)
+
+    def create_gaze_anchor(self):
+        """
+        Create a node following the eye gaze, using XR_EXT_eye_gaze_interaction, or None if not supported.
+        """
+
+        if xr.EXT_EYE_GAZE_INTERACTION_EXTENSION_NAME not in self.instance.enabled_extensions:
+            self.logger.warning("Eye gaze interaction not supported, using fixed foveation")
+            return None
+        self.action_set.add_action('eye_gaze', 'pose', "Eye Gaze")
+        self.action_set.suggest_binding(
+            "/interaction_profiles/ext/eye_gaze_interaction", 'eye_gaze', "/user/eyes_ext/input/gaze_ext/pose")
+        gaze_anchor = self.tracking_space_anchor.attach_new_node('gaze-anchor')
+        self.action_set.link_pose(None, gaze_anchor, 'eye_gaze')
+        return gaze_anchor
+
+    def create_overlay_buffer(self, layer: OverlayLayer, scene: NodePath, name: str):
+        """
+        Create the buffer rendering the scene into the swapchain of the layer, the scene is seen through an
+        orthographic camera covering -1 to 1 on both the X and Z axis, like render2d.
+        """
+
+        fb_props = self.create_default_fb_props()
+        fb_props.set_alpha_bits(1)
+        swapchain = layer.swapchain
+        buffer = self.base.win.make_texture_buffer(name, swapchain.width, swapchain.height, to_ram=False, fbp=fb_props)
+        if buffer is None:
+            self.logger.error("Could not create buffer")
+            return
+        buffer.disable_clears()
+        buffer.clear_render_textures()
+        # The layers are rendered before the views, as the frame is ended by the draw of the last view
+        buffer.set_sort(self.overlay_sort)
+        self.overlay_sort += 1
+        cam_node = Camera(f"{name}-cam")
+        lens = OrthographicLens()
+        lens.set_film_size(2, 2)
+        lens.set_near_far(-1000, 1000)
+        cam_node.set_lens(lens)
+        cam = scene.attach_new_node(cam_node)
+        self.create_display_region(buffer, cam, callback=partial(self.render_overlay, layer))
+        layer.buffer = buffer
+        # The buffer is only active when the runtime needs the frames to be rendered, like the render buffers
+        self.lifecycle.add_buffer(buffer)
+
+    def create_overlay_swapchain(self, width: int, height: int) -> Swapchain:
+        fb_props = self.create_default_fb_props()
+        fb_props.set_alpha_bits(1)
+        return Swapchain(
+            self.session, None, sc_format=self.select_swapchain_format(fb_props), width=width, height=height,
+            sample_count=1)
+
+    def add_quad_layer(
+            self, scene: NodePath, width: int, height: int, size=(1.0, 1.0), position=None, orientation=None,
+            head_locked=False, update_policy='always', update_interval=1, name="xr-quad-layer") -> QuadLayer:
+        """
+        Add a quad layer showing the given 2D scene, rendered into images of width x height pixels. The quad has
+        the given size, in meters, and pose, in the tracking space or in the view space if head_locked is True.
+
+        See OverlayLayer for the update policies.
+        """
+
+        layer = QuadLayer(
+            self.session, self.view_space if head_locked else self.app_space,
+            self.create_overlay_swapchain(width, height), size,
+            update_policy=update_policy, update_interval=update_interval)
+        if position is not None:
+            layer.set_pose(position, orientation)
+        self.create_overlay_buffer(layer, scene, name)
+        self.layers.add_layer(layer)
+        return layer
+
+    def add_cylinder_layer(
+            self, scene: NodePath, width: int, height: int, radius=1.0, central_angle=1.0, aspect_ratio=1.0,
+            position=None, orientation=None, head_locked=False, update_policy='always', update_interval=1,
+            name="xr-cylinder-layer") -> CylinderLayer:
+        """
+        Add a cylinder layer showing the given 2D scene, see add_quad_layer(). Return None if the runtime does not
+        support XR_KHR_composition_layer_cylinder.
+        """
+
+        if xr.KHR_COMPOSITION_LAYER_CYLINDER_EXTENSION_NAME not in self.instance.enabled_extensions:
+            self.logger.error("Cylinder layers are not supported by the runtime")
+            return None
+        layer = CylinderLayer(
+            self.session, self.view_space if head_locked else self.app_space,
+            self.create_overlay_swapchain(width, height), radius, central_angle, aspect_ratio,
+            update_policy=update_policy, update_interval=update_interval)
+        if position is not None:
+            layer.set_pose(position, orientation)
+        self.create_overlay_buffer(layer, scene, name)
+        self.layers.add_layer(layer)
+        return layer
+
+    def remove_layer(self, layer: OverlayLayer):
+        self.layers.remove_layer(layer)
+        if layer.buffer is not None:
+            self.lifecycle.remove_buffer(layer.buffer)
+            self.base.graphicsEngine.remove_window(layer.buffer)
+            layer.buffer = None
+        layer.swapchain.destroy()
+        layer.destroy()
+
+    def select_swapchain_format(self, fb_props: FrameBufferProperties) -> int:
+        """
+        Negotiate the color format of the swapchains with the runtime : the smallest supported format having the
+        components, alpha, sRGB encoding, floating point and bits requested by the framebuffer properties, see
+        select_color_format().
+        """
+
+        preferred = self.fb_props_to_gl_mode(fb_props)
+        sc_format = select_color_format(fb_props, preferred, self.session.get_supported_swapchain_formats())
+        format_names = get_format_names()
+        self.logger.info(
+            f"Swapchain format {format_names.get(sc_format, hex(sc_format))} "
+            f"({get_color_format(sc_format).size} bytes per pixel), "
+            f"requested {format_names.get(preferred, hex(preferred))}")
+        return sc_format
+
+    def get_depth_format(self, fb_props: FrameBufferProperties):
+        """
+        Return the first depth format supported by the runtime, with a stencil if the framebuffer properties request
+        one, or None.
+        """
+
+        depth_formats = [GL.GL_DEPTH_COMPONENT24, GL.GL_DEPTH_COMPONENT32F, GL.GL_DEPTH_COMPONENT16]
+        stencil_formats = [GL.GL_DEPTH24_STENCIL8, GL.GL_DEPTH32F_STENCIL8]
+        if fb_props.stencil_bits > 0:
+            candidates = stencil_formats
+        else:
+            candidates = depth_formats + stencil_formats
+        supported_formats = self.session.get_supported_swapchain_formats()
+        for depth_format in candidates:
+            if depth_format in supported_formats:
+                return depth_format
+        return None
+
+    def create_depth_swapchains(self, fb_props: FrameBufferProperties, single_pass: bool) -> None:
+        """
+        Create a depth swapchain for each color swapchain, if the runtime supports the submission of the depth.
+        """
+
+        if xr.KHR_COMPOSITION_LAYER_DEPTH_EXTENSION_NAME not in self.instance.enabled_extensions:
+            self.logger.warning("Depth submission is not supported by the runtime")
+            return
+        depth_format = self.get_depth_format(fb_props)
+        if depth_format is None:
+            self.logger.warning("No depth swapchain format supported by the runtime")
+            return
+        self.depth_format = depth_format
+        if depth_format in (GL.GL_DEPTH24_STENCIL8, GL.GL_DEPTH32F_STENCIL8):
+            self.depth_attachment = GL.GL_DEPTH_STENCIL_ATTACHMENT
+        else:
+            self.depth_attachment = GL.GL_DEPTH_ATTACHMENT
+        usage_flags = xr.SwapchainUsageFlags.SAMPLED_BIT | xr.SwapchainUsageFlags.DEPTH_STENCIL_ATTACHMENT_BIT
+        for i, swapchain in enumerate(self.swapchains):
+            self.depth_swapchains.append(
+                Swapchain(
+                    self.session, swapchain.view, sc_format=depth_format, width=swapchain.width,
+                    height=swapchain.height, sample_count=swapchain.sample_count, array_size=swapchain.array_size,
+                    usage_flags=usage_flags))
+
     def disable_main_cam(self):
         """
         Disable the default camera (but not remove it).
@@ -114,19 +451,180 @@ class P3DOpenXR():
         self.empty_world = NodePath()
         self.base.camera.reparent_to(self.empty_world)
 
-    def init(self, near=0.01, far=100.0, root=None, fb_props=None, mirroring=0):
+    def init(
+            self, near=0.01, far=100.0, root=None, fb_props=None, mirroring=None, single_pass=False, stereo_mode=None,
+            backend=None, action_manifest=None, persistent_fbo=False,
+            late_latching=False, pipelined=False, idle_frame_rate=10.0, dynamic_resolution=None,
+            foveation=None, depth_submission=False, msaa_mode='fixed', diagnostics=False, capabilities_cache=None,
+            hand_tracking=False, view_configuration='stereo', view_policies=None):
+        """
+        Initialize OpenXR and create the rendering chain.
+
+        mirroring shows the views in the main window, it is a DesktopMirror or one of its modes ('left', 'right',
+        'side-by-side' or 'cropped'). By default the main window is not used.
+
+        If single_pass is True, all the views are rendered in one pass into a texture array swapchain,
+        using stereo_mode ('multiview' or 'instanced') or the best mode supported by the driver if None.
+        The scene shaders must then use the declarations given by self.stereo.get_vertex_header().
+
+        backend is the OpenXR implementation to use, by default the actual OpenXR runtime. A SimulatedBackend
+        can be given to run the frame loop without headset.
+
+        action_manifest describes the actions to create and their bindings, see ActionSet.load_manifest().
+
+        If persistent_fbo is True, a framebuffer is created for each swapchain image and bound when the image is
+        acquired, instead of attaching the image to the Panda3D buffer at each frame.
+
+        If late_latching is True, the views are located again just before the draw, see LateLatching. In multi pass
+        mode the shaders of the scene must then apply the xr_late_latch matrix.
+
+        If pipelined is True, xrWaitFrame and xrBeginFrame are called on a pacing thread, see FramePacer, and the
+        main loop only picks up the frame state of the frame already begun.
+
+        While the session is not running, the frame rate of the main loop is limited to idle_frame_rate, see
+        LifecycleManager.
+
+        dynamic_resolution is a DynamicResolution controller adapting the rendered resolution to the frame time,
+        by default the recommended resolution is always used.
+
+        foveation is a FoveatedRenderer, rendering the periphery of the views at a lower resolution than their
+        center, it is only supported in multi pass mode.
+
+        If depth_submission is True and the runtime supports XR_KHR_composition_layer_depth, the depth buffer of
+        each view is rendered into a depth swapchain and submitted with the projection layer, so the runtime can
+        reproject the missed frames using the depth. It is not supported with foveated rendering.
+
+        Multisampling is enabled by the multisamples of fb_props, by default the sample count recommended by the
+        runtime is used. The views are rendered into multisampled swapchains when the runtime supports them, or else
+        into multisampled render targets resolved into the swapchain images. With msaa_mode 'auto' the sample count
+        is adapted to the frame time, between 1 and the requested sample count, see AdaptiveMultisampling.
+        Multisampling is not supported in single pass mode.
+
+        Only the runtime queries needed to create the rendering chain are done, if diagnostics is True the
+        properties of the runtime are also logged, see log_diagnostics().
+
+        capabilities_cache is the path of a JSON file in which the capabilities of the runtime are saved, so the
+        next launches can skip their enumeration. The file is captured again when the runtime or the system changes.
+        A RuntimeCapabilities can also be given directly, it is then filled but not saved.
+
+        If hand_tracking is True and the runtime supports XR_EXT_hand_tracking, the joints of both hands are located
+        at each frame, see self.hand_trackers and HandTracker. Requires NumPy.
+
+        view_configuration is the view configuration of the system, 'stereo', 'quad' for the context and inset
+        views of a headset with high resolution insets, or a xr.ViewConfigurationType. If the runtime does not
+        support it, the primary stereo configuration is used. view_policies gives a ViewPolicy per view, to render
+        it at its own scale, at a lower rate or with a reduced scene. In single pass mode all the views must have
+        the same size and the default policy.
+        """
+
+        recommended_samples = fb_props is None
         if fb_props is None:
             fb_props = self.create_default_fb_props()
-        sc_format = self.fb_props_to_gl_mode(fb_props)
-        self.instance = Instance()
-        self.system = System(self.instance)
+        if msaa_mode not in ('fixed', 'auto'):
+            raise ValueError(f"Unknown multisampling mode '{msaa_mode}'")
+        # The multisampling is done by the swapchains or by the resolve of our own render targets, never by Panda3D
+        buffer_props = FrameBufferProperties(fb_props)
+        buffer_props.set_multisamples(0)
+        if foveation is not None and single_pass:
+            raise ValueError("Foveated rendering is not supported in single pass mode")
+        if foveation is not None and depth_submission:
+            raise ValueError("Depth submission is not supported with foveated rendering")
+        self.dynamic_resolution = dynamic_resolution
+        self.foveation = foveation
+        if isinstance(capabilities_cache, RuntimeCapabilities):
+            self.capabilities = capabilities_cache
+        elif capabilities_cache is not None:
+            self.capabilities = RuntimeCapabilities.load(capabilities_cache) or RuntimeCapabilities()
+        self.instance = Instance(backend=backend, capabilities=self.capabilities)
+        view_configuration_type = get_view_configuration_type(view_configuration)
+        try:
+            self.system = System(self.instance, view_configuration_type=view_configuration_type)
+        except ValueError:
+            if view_configuration_type == xr.ViewConfigurationType.PRIMARY_STEREO:
+                raise
+            self.logger.warning(f"View configuration {view_configuration} not supported, using stereo")
+            self.system = System(self.instance)
+        self.view_policies = get_view_policies(view_policies, len(self.system.views))
+        for view, policy in zip(self.system.views, self.view_policies):
+            view.render_scale = policy.scale
+        if single_pass:
+            sizes = {(view.render_width, view.render_height) for view in self.system.views}
+            if len(sizes) > 1 or not all(policy.is_default() for policy in self.view_policies):
+                raise ValueError("Single pass mode requires views of the same size and the default view policy")
         self.session = Session(self.system, self.base)
+        if self.capabilities is not None:
+            # Complete the snapshot, these queries are answered by the snapshot when it is valid
+            self.session.get_supported_swapchain_formats()
+            self.session.get_supported_reference_spaces()
+            if self.capabilities.modified and not isinstance(capabilities_cache, RuntimeCapabilities):
+                try:
+                    self.capabilities.save(capabilities_cache)
+                except OSError as e:
+                    self.logger.warning(f"Could not save the capabilities of the runtime: {e}")
+        sc_format = self.select_swapchain_format(fb_props)
+        self.swapchain_format = sc_format
+        if diagnostics:
+            self.log_diagnostics()
         self.tracking_space = Space(self.session, reference_space_type='Stage')
         self.view_space = Space(self.session, reference_space_type='View')
         self.app_space = self.tracking_space
-        for view in self.system.views:
-            self.swapchains.append(Swapchain(self.session, view, sc_format=sc_format, sample_count=1))
+        samples = fb_props.multisamples
+        if recommended_samples:
+            samples = max(view.recommended_swapchain_sample_count for view in self.system.views)
+        if samples > 1 and single_pass:
+            raise ValueError("Multisampling is not supported in single pass mode")
+        swapchain_samples = 1
+        if samples > 1:
+            if msaa_mode == 'auto':
+                # The sample count of a swapchain can not be changed
+                self.multisampling = AdaptiveMultisampling(samples)
+                self.logger.info(f"Adaptive multisampling up to {samples} samples")
+            elif foveation is None and all(samples <= view.max_swapchain_sample_count for view in self.system.views):
+                swapchain_samples = samples
+                # The render buffer of Panda3D can not hold a multisampled image
+                persistent_fbo = True
+                self.logger.info(f"Multisampling with {samples} samples swapchains")
+            else:
+                self.logger.info(f"Multisampling with {samples} samples render targets")
+        if single_pass:
+            view = self.system.views[0]
+            width, height = self.get_swapchain_size(view)
+            swapchain = Swapchain(
+                self.session, view, sc_format=sc_format, width=width, height=height, sample_count=1,
+                array_size=len(self.system.views))
+            self.swapchains.append(swapchain)
+            self.view_swapchains = [swapchain] * len(self.system.views)
+        else:
+            for view in self.system.views:
+                width, height = self.get_swapchain_size(view)
+                self.swapchains.append(
+                    Swapchain(
+                        self.session, view, sc_format=sc_format, width=width, height=height,
+                        sample_count=swapchain_samples))
+            self.view_swapchains = self.swapchains
         self.layer = ProjectionLayer(self.session, self.app_space, len(self.system.views))
+        self.layers.add_layer(self.layer)
+        if depth_submission:
+            self.create_depth_swapchains(fb_props, single_pass)
+            if self.depth_swapchains:
+                if single_pass:
+                    view_depth_swapchains = self.depth_swapchains * len(self.system.views)
+                else:
+                    view_depth_swapchains = self.depth_swapchains
+                self.layer.set_depth_swapchains(view_depth_swapchains, near, far)
+        if samples > 1 and swapchain_samples == 1:
+            for swapchain in self.swapchains:
+                if self.depth_format is not None:
+                    # The depth is resolved into the depth swapchain
+                    target = MultisampleTarget(
+                        swapchain.width, swapchain.height, samples, sc_format, self.depth_format,
+                        self.depth_attachment)
+                else:
+                    target = MultisampleTarget(swapchain.width, swapchain.height, samples, sc_format)
+                self.msaa_targets.append(target)
+            if self.multisampling is not None:
+                for target in self.msaa_targets:
+                    target.set_samples(self.multisampling.samples)
         self.action_set = ActionSet(self.session, self.app_space, "default", "Default action set", priority=0)
 
         # Create the tracking space anchors
@@ -142,41 +640,147 @@ class P3DOpenXR():
         self.near = near
         self.far = far
 
-        for i, swapchain in enumerate(self.swapchains):
-            last = (i == len(self.swapchains) - 1)
-            cam_node = self.create_camera(f'cam-{i}')
-            cam = self.tracking_space_anchor.attach_new_node(cam_node)
-            self.cams.append(cam)
-            buffer = self.create_buffer(
-                f"xr-render-buffer-{i}", swapchain.width, swapchain.height, fb_props)
-            self.dr.append(self.create_display_region(buffer, self.cams[i], callback=partial(self.render, i, last)))
+        if single_pass:
+            if stereo_mode is None and self.instance.backend.headless:
+                # There is no OpenGL context to query
+                stereo_mode = 'multiview'
+            self.stereo = StereoRenderer(len(self.system.views), stereo_mode)
+            self.stereo.setup_scene(root)
+            for i in range(len(self.system.views)):
+                cam_node = self.create_camera(f'cam-{i}')
+                self.cams.append(self.tracking_space_anchor.attach_new_node(cam_node))
+            # The scene is culled and drawn once using a camera enclosing all the views
+            self.cull_cam = self.tracking_space_anchor.attach_new_node(self.create_camera('cull-cam'))
+            swapchain = self.swapchains[0]
+            buffer = self.create_buffer("xr-render-buffer", swapchain.width, swapchain.height, buffer_props)
+            self.dr.append(self.create_display_region(buffer, self.cull_cam, callback=self.render_single_pass))
             self.buffers.append(buffer)
+        else:
+            for i in range(len(self.swapchains)):
+                cam_node = self.create_camera(f'cam-{i}')
+                self.cams.append(self.tracking_space_anchor.attach_new_node(cam_node))
+            fovea_cams = []
+            periphery_sizes = []
+            if self.foveation is not None:
+                # The periphery buffers are rendered first, the whole FOV of each view at a reduced resolution
+                for i, swapchain in enumerate(self.swapchains):
+                    width, height = self.foveation.get_periphery_size(swapchain)
+                    buffer = self.create_buffer(f"xr-periphery-buffer-{i}", width, height, buffer_props)
+                    self.create_display_region(buffer, self.cams[i], callback=partial(self.render_periphery, i))
+                    self.periphery_buffers.append(buffer)
+                    periphery_sizes.append((width, height))
+                    # The fovea camera shares the pose of the view, only its frustum differs
+                    fovea_cams.append(self.cams[i].attach_new_node(self.create_camera(f'cam-{i}-fovea')))
+            for i, swapchain in enumerate(self.swapchains):
+                cam = fovea_cams[i] if fovea_cams else self.cams[i]
+                buffer = self.create_buffer(
+                    f"xr-render-buffer-{i}", swapchain.width, swapchain.height, buffer_props)
+                self.dr.append(self.create_display_region(buffer, cam, callback=partial(self.render, i)))
+                self.buffers.append(buffer)
+            for i, policy in enumerate(self.view_policies):
+                if policy.camera_mask is not None:
+                    self.cams[i].node().set_camera_mask(policy.camera_mask)
+                    if fovea_cams:
+                        fovea_cams[i].node().set_camera_mask(policy.camera_mask)
+            if any(policy.interval > 1 for policy in self.view_policies):
+                view_buffers = [[buffer] for buffer in self.buffers]
+                for buffers, periphery_buffer in zip(view_buffers, self.periphery_buffers):
+                    buffers.append(periphery_buffer)
+                self.view_scheduler = ViewScheduler(self.view_policies, view_buffers)
+            if self.foveation is not None:
+                gaze_anchor = None
+                if self.foveation.mode == 'gaze':
+                    gaze_anchor = self.create_gaze_anchor()
+                self.foveation.setup(fovea_cams, self.dr, periphery_sizes, gaze_anchor)
+
+        if self.dynamic_resolution is not None:
+            self.dynamic_resolution.setup(self.swapchains, self.dr)
+        self.frame_time_controllers = [
+            controller for controller in (self.dynamic_resolution, self.multisampling) if controller is not None]
+        if self.frame_time_controllers:
+            self.gpu_timer = GpuTimer()
+        if late_latching:
+            self.late_latching = LateLatching(self.layer, self.cams, move_cameras=single_pass)
+            if self.foveation is not None:
+                # The fovea is in the same view space and is corrected like the periphery
+                for cam, fovea_cam in zip(self.cams, self.foveation.fovea_cams):
+                    fovea_cam.node().set_initial_state(cam.node().get_initial_state())
+        if persistent_fbo:
+            self.framebuffers = [
+                SwapchainFramebuffers(
+                    swapchain, self.stereo, self.depth_swapchains[i] if self.depth_swapchains else None,
+                    self.depth_attachment)
+                for i, swapchain in enumerate(self.swapchains)]
 
+        self.rendered_views = list(range(len(self.dr)))
+        # Name of the profiler stages of each render callback
+        self.render_stages = [
+            tuple(f"view{i}.{stage}" for stage in ('acquire', 'wait_image', 'clear', 'draw', 'release'))
+            for i in range(len(self.dr))]
+
+        if action_manifest is not None:
+            self.action_set.load_manifest(action_manifest)
         self.action_set.link_pose('/user/hand/left', self.left_hand_anchor)
         self.action_set.link_pose('/user/hand/right', self.right_hand_anchor)
 
         self.action_set.attach()
+        if hand_tracking:
+            self.create_hand_trackers()
 
         # The main camera is useless, so we disable it
         self.disable_main_cam()
 
-        self.logger.info("Eye mirroring disabled")
+        if mirroring:
+            if not isinstance(mirroring, DesktopMirror):
+                mirroring = DesktopMirror(mirroring)
+            self.mirror = mirroring
+            self.mirror.setup(self.base.win, self.view_swapchains, sc_format, self.session.backend.headless)
+            self.logger.info(f"Eye mirroring {self.mirror.mode}")
+        else:
+            self.logger.info("Eye mirroring disabled")
 
         # Launch the main task that will synchronize Panda3D with OpenXR
         # TODO: The sort number should be configurable.
         self.task = taskMgr.add(self.poll_events_task, "openXRPollEvents", sort=-1000)
         self.task = taskMgr.add(self.wait_frame_task, "openXRWaitFrame", sort=-999)
         self.task = taskMgr.add(self.update_views_task, "openXRUpdateViews", sort=-100)
-        self.task = taskMgr.add(self.poll_actions_task, "openXRPollActions", sort=-40)
+        self.actions_task = taskMgr.add(self.poll_actions_task, "openXRPollActions", sort=-40)
         self.task = taskMgr.add(self.end_frame_task, "openXREndFrame", sort=1000)
 
+        # Only render and poll the actions when the runtime needs it
+        self.lifecycle = LifecycleManager(
+            self.session, self.periphery_buffers + self.buffers, [self.actions_task], idle_frame_rate)
+
+        if pipelined:
+            self.pacer = FramePacer(self.session, self.profiler)
+            self.pacer.start()
+
     def destroy(self):
-        if self.layer is not None:
-            self.logger.debug("Destroy layer")
-            self.layer.destroy()
-        for swapchain in self.swapchains:
+        self.stop_recording()
+        self.close_capture()
+        if self.mirror is not None:
+            self.mirror.destroy()
+            self.mirror = None
+        if self.pacer is not None:
+            self.logger.debug("Stop pacing thread")
+            self.pacer.stop()
+            self.pacer = None
+        if self.lifecycle is not None:
+            self.lifecycle.destroy()
+            self.lifecycle = None
+        self.release_rendering_objects()
+        for overlay in self.layers.overlays:
+            self.logger.debug("Destroy overlay swapchain")
+            overlay.swapchain.destroy()
+        self.logger.debug("Destroy layers")
+        self.layers.destroy()
+        for swapchain in self.swapchains + self.depth_swapchains:
             self.logger.debug("Destroy swapchains")
             swapchain.destroy()
+        for hand_tracker in self.hand_trackers:
+            self.logger.debug("Destroy hand tracker")
+            hand_tracker.destroy()
+        self.hand_trackers = []
         if self.tracking_space is not None:
             self.logger.debug("Destroy tracking space")
             self.tracking_space.destroy()
@@ -194,67 +798,389 @@ class P3DOpenXR():
             self.instance.destroy()
         self.logger.debug("All object destroyed")
 
+    def release_rendering_objects(self):
+        """
+        Release the OpenGL objects referencing the swapchain images, before the swapchains are destroyed. The OpenGL
+        context is only current in the draw callbacks, so a last frame is rendered in which the draw callback of the
+        first render buffer only does the release. The other render buffers are deactivated.
+        """
+
+        if self.session is None or self.session.backend.headless or not self.buffers:
+            return
+        for framebuffers in self.framebuffers:
+            self.gl_releases.append(framebuffers.release)
+        self.framebuffers = []
+        for target in self.msaa_targets:
+            self.gl_releases.append(target.release)
+        self.msaa_targets = []
+        if self.stereo is not None:
+            self.gl_releases.append(self.stereo.release_depth_texture)
+        if self.gpu_timer is not None:
+            self.gl_releases.append(self.gpu_timer.release)
+            self.gpu_timer = None
+        buffer = self.buffers[0]
+        if self.gl_releases and buffer.is_valid():
+            for other in self.periphery_buffers + self.buffers[1:] + [layer.buffer for layer in self.layers.overlays]:
+                if other is not None:
+                    other.set_active(False)
+            self.dr[0].set_draw_callback(PythonCallbackObject(self.release_callback))
+            buffer.set_active(True)
+            engine = self.base.graphicsEngine
+            # With a threaded pipeline, the draw of the frame can lag behind
+            for i in range(3):
+                engine.render_frame()
+                engine.sync_frame()
+                if not self.gl_releases:
+                    break
+            buffer.set_active(False)
+        if self.gl_releases:
+            self.logger.debug("Render buffer closed, the OpenGL objects are released with the context")
+            self.gl_releases = []
+
+    def release_callback(self, cbdata):
+        self.release_gl_objects()
+
+    def release_gl_objects(self):
+        """
+        Call the release functions added to gl_releases, must be called from a draw callback.
+        """
+
+        releases = self.gl_releases
+        self.gl_releases = []
+        for release in releases:
+            release()
+
     def poll_events_task(self, task):
         self.session.poll_xr_events()
         return task.cont
 
     def wait_frame_task(self, task):
+        self.frame_acquired = False
         if not self.session.session_active():
             return task.cont
+        profiler = self.profiler
+        if self.pacer is not None:
+            # The frame has already been waited for and begun by the pacing thread
+            profiler.start('wait_frame')
+            acquired = self.pacer.acquire_frame()
+            profiler.stop('wait_frame')
+            if acquired:
+                self.frame_acquired = True
+                self.frame_count += 1
+                self.frame_start = time.perf_counter()
+                self.lifecycle.update()
+            return task.cont
+        profiler.start('wait_frame')
         self.session.wait_frame()
+        profiler.stop('wait_frame')
+        profiler.start('begin_frame')
         self.session.begin_frame()
-        self.end_frame_called = False
+        profiler.stop('begin_frame')
+        self.frame_acquired = self.session.frame_begun
+        self.frame_count += 1
+        self.frame_start = time.perf_counter()
+        self.lifecycle.update()
         return task.cont
 
     def update_views_task(self, task):
-        if not self.session.session_active() or not self.session.should_render():
-            return task.cont
-        self.layer.update_views(self.swapchains)
-        if not self.layer.pose_valid:
+        if not self.frame_acquired or not self.session.should_render():
             return task.cont
-        for cam, view in zip(self.cams, self.layer.views):
-            cam.node().get_lens().set_user_mat(view.calc_projection_matrix(self.near, self.far))
-            cam.set_pos(view.position)
-            cam.set_quat(view.orientation)
+        self.profiler.start('update_views')
+        display_period = self.session.frame_state.predicted_display_period / 1e9
+        if self.dynamic_resolution is not None:
+            # The new resolution is applied before the views are submitted and the display regions are drawn
+            self.dynamic_resolution.update(display_period)
+        if self.multisampling is not None and self.multisampling.update(display_period):
+            for target in self.msaa_targets:
+                target.set_samples(self.multisampling.samples)
+        self.layer.set_depth_range(self.near, self.far)
+        if self.view_scheduler is not None:
+            self.rendered_views = self.view_scheduler.update(self.frame_count)
+            self.layer.update_views(self.view_swapchains, self.view_scheduler.rendered)
+        else:
+            self.layer.update_views(self.view_swapchains)
+        if self.pose_recorder is not None:
+            self.pose_recorder.record_views(self.session.frame_state.predicted_display_time)
+        if self.session_recorder is not None:
+            self.session_recorder.record_views()
+        self.layers.update(self.frame_count)
+        if self.mirror is not None:
+            frame_state = self.session.frame_state
+            self.mirror.update(frame_state.predicted_display_time, frame_state.predicted_display_period)
+        if self.frame_capture is not None:
+            if self.frame_capture.finished:
+                self.frame_capture.close()
+                self.frame_capture = None
+            else:
+                self.frame_capture.update(self.frame_count, self.session.frame_state.predicted_display_time)
+        if self.layer.pose_valid:
+            # The lens is only invalidated when the FOV or the clip planes change
+            for view in update_projection_matrices(self.layer.views, self.near, self.far):
+                self.cams[view.index].node().get_lens().set_user_mat(view.projection_mat)
+            for cam, view in zip(self.cams, self.layer.views):
+                cam.set_pos(view.position)
+                cam.set_quat(view.orientation)
+            if self.stereo is not None:
+                self.stereo.update_cull_camera(self.cull_cam, self.layer.views, self.cams, self.near, self.far)
+            if self.foveation is not None:
+                self.foveation.update(self.layer.views, self.cams, self.view_swapchains, self.near, self.far)
+        self.profiler.stop('update_views')
         return task.cont
 
     def poll_actions_task(self, task):
+        self.profiler.start('poll_actions')
         try:
             self.action_set.poll_actions()
+            if self.pose_recorder is not None and self.session.session_active():
+                self.pose_recorder.record_links(self.session.frame_state.predicted_display_time)
+            if self.session_recorder is not None and self.session.session_active():
+                self.session_recorder.record_poses()
         except xr.exception.SessionNotFocused:
             pass
+        self.profiler.stop('poll_actions')
+        if self.hand_trackers and self.session.session_active():
+            self.profiler.start('hand_tracking')
+            display_time = self.session.frame_state.predicted_display_time
+            for hand_tracker in self.hand_trackers:
+                hand_tracker.locate(display_time)
+            self.profiler.stop('hand_tracking')
         return task.cont
 
-    def render(self, index, last, cbdata):
-        if not self.session.session_active() or not self.session.should_render() or not self.layer.pose_valid:
+    def render(self, index, cbdata):
+        if self.gl_releases:
+            self.release_gl_objects()
+        if not self.frame_acquired or not self.session.should_render() or not self.layer.pose_valid:
             return
+        profiler = self.profiler
+        acquire_stage, wait_stage, clear_stage, draw_stage, release_stage = self.render_stages[index]
         swapchain = self.swapchains[index]
-        image_info = swapchain.acquire_image_info()
+        depth_swapchain = self.depth_swapchains[index] if self.depth_swapchains else None
+        profiler.start(acquire_stage)
+        image_index = swapchain.acquire_image()
+        depth_index = depth_swapchain.acquire_image() if depth_swapchain is not None else None
+        profiler.stop(acquire_stage)
+        profiler.start(wait_stage)
+        swapchain.wait_image()
+        if depth_swapchain is not None:
+            depth_swapchain.wait_image()
+        profiler.stop(wait_stage)
         self.layer.render_swapchain(index)
-        GL.glFramebufferTexture(
-            GL.GL_DRAW_FRAMEBUFFER,
-            GL.GL_COLOR_ATTACHMENT0,
-            image_info.image,
-            0
-        )
-        GL.glClearDepth(1.0)
-        GL.glClearColor(0, 0, 0, 0)
-        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT | GL.GL_STENCIL_BUFFER_BIT)
+        first = index == self.rendered_views[0]
+        if first and self.late_latching is not None and self.foveation is None:
+            # All the views are corrected using the same tracking sample, with foveation it is located before the
+            # periphery, which is drawn first
+            profiler.start('late_latch')
+            self.late_latching.latch()
+            profiler.stop('late_latch')
+        profiler.start(clear_stage)
+        headless = self.session.backend.headless
+        framebuffers = self.framebuffers[index] if self.framebuffers else None
+        msaa_target = self.msaa_targets[index] if self.msaa_targets else None
+        if msaa_target is not None and msaa_target.samples < 2:
+            msaa_target = None
+        if not headless:
+            if framebuffers is not None:
+                framebuffers.bind(image_index, depth_index)
+            else:
+                GL.glFramebufferTexture(
+                    GL.GL_DRAW_FRAMEBUFFER,
+                    GL.GL_COLOR_ATTACHMENT0,
+                    swapchain.images[image_index].image,
+                    0
+                )
+                if depth_swapchain is not None:
+                    attach_depth_image(depth_swapchain.images[depth_index].image, self.depth_attachment)
+            if self.foveation is not None:
+                # The fovea is then cleared and drawn over the upscaled periphery
+                self.foveation.composite(index, swapchain.image_rect_width, swapchain.image_rect_height)
+            if msaa_target is not None:
+                msaa_target.bind(framebuffers.framebuffers[image_index] if framebuffers is not None else None)
+            GL.glClearDepth(1.0)
+            GL.glClearColor(0, 0, 0, 0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT | GL.GL_STENCIL_BUFFER_BIT)
+        profiler.stop(clear_stage)
         # Perform the actual Draw jobs
+        profiler.start(draw_stage)
+        gpu_timer = self.get_gpu_timer(first)
+        if gpu_timer is not None:
+            gpu_timer.begin(self.session.frame_state.predicted_display_time)
+        cbdata.upcall()
+        if msaa_target is not None and not headless:
+            self.resolve_multisample(index, msaa_target, depth_swapchain is not None)
+        if gpu_timer is not None:
+            gpu_timer.end()
+        if framebuffers is not None and not headless:
+            framebuffers.unbind()
+        profiler.stop(draw_stage)
+        if self.mirror is not None:
+            profiler.start('mirror')
+            self.mirror.capture(index, swapchain.images[image_index].image)
+            profiler.stop('mirror')
+        if self.frame_capture is not None:
+            profiler.start('capture')
+            self.frame_capture.capture(index, swapchain.images[image_index].image)
+            profiler.stop('capture')
+        profiler.start(release_stage)
+        swapchain.release_image_info()
+        if depth_swapchain is not None:
+            depth_swapchain.release_image_info()
+        profiler.stop(release_stage)
+        if index == self.rendered_views[-1]:
+            self.end_frame()
+
+    def resolve_multisample(self, index: int, msaa_target: MultisampleTarget, depth: bool) -> None:
+        """
+        Resolve the area of the display region of the view into the swapchain image.
+        """
+
+        swapchain = self.swapchains[index]
+        left, right, bottom, top = self.dr[index].get_dimensions()
+        x = round(left * swapchain.width)
+        y = round(bottom * swapchain.height)
+        width = round(right * swapchain.width) - x
+        height = round(top * swapchain.height) - y
+        msaa_target.resolve(x, y, width, height, depth)
+
+    def render_periphery(self, index, cbdata):
+        if not self.frame_acquired or not self.session.should_render() or not self.layer.pose_valid:
+            return
+        if index == self.rendered_views[0] and self.late_latching is not None:
+            # The periphery and the fovea drawn over it must be corrected with the same delta
+            self.profiler.start('late_latch')
+            self.late_latching.latch()
+            self.profiler.stop('late_latch')
+        if not self.session.backend.headless:
+            GL.glClearDepth(1.0)
+            GL.glClearColor(0, 0, 0, 0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT | GL.GL_STENCIL_BUFFER_BIT)
+        cbdata.upcall()
+        if not self.session.backend.headless:
+            self.foveation.capture_periphery(index)
+
+    def render_overlay(self, layer, cbdata):
+        if not self.frame_acquired or not self.session.should_render():
+            return
+        swapchain = layer.swapchain
+        image_index = swapchain.acquire_image()
+        swapchain.wait_image()
+        if not self.session.backend.headless:
+            GL.glFramebufferTexture(
+                GL.GL_DRAW_FRAMEBUFFER,
+                GL.GL_COLOR_ATTACHMENT0,
+                swapchain.images[image_index].image,
+                0
+            )
+            GL.glClearDepth(1.0)
+            GL.glClearColor(0, 0, 0, 0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
         cbdata.upcall()
         swapchain.release_image_info()
-        if last:
-            self.session.end_frame(self.layer)
-            self.end_frame_called = True
+        layer.updated(self.frame_count)
+
+    def get_gpu_timer(self, first: bool):
+        """
+        Return the GPU timer if a controller needs the frame time, the results of the previous frames are
+        collected during the first draw callback of the frame.
+        """
+
+        if self.gpu_timer is None or self.session.backend.headless:
+            return None
+        if first:
+            for frame_time in self.gpu_timer.collect():
+                for controller in self.frame_time_controllers:
+                    controller.add_gpu_time(frame_time)
+        return self.gpu_timer
+
+    def render_single_pass(self, cbdata):
+        if self.gl_releases:
+            self.release_gl_objects()
+        if not self.frame_acquired or not self.session.should_render() or not self.layer.pose_valid:
+            return
+        profiler = self.profiler
+        acquire_stage, wait_stage, clear_stage, draw_stage, release_stage = self.render_stages[0]
+        swapchain = self.swapchains[0]
+        depth_swapchain = self.depth_swapchains[0] if self.depth_swapchains else None
+        profiler.start(acquire_stage)
+        image_index = swapchain.acquire_image()
+        depth_index = depth_swapchain.acquire_image() if depth_swapchain is not None else None
+        profiler.stop(acquire_stage)
+        profiler.start(wait_stage)
+        swapchain.wait_image()
+        if depth_swapchain is not None:
+            depth_swapchain.wait_image()
+        profiler.stop(wait_stage)
+        if self.late_latching is not None:
+            profiler.start('late_latch')
+            self.late_latching.latch()
+            profiler.stop('late_latch')
+        # The scene graph is final at draw time, the view matrices account for any change done by the app
+        self.stereo.update_view_projections(self.cams)
+        profiler.start(clear_stage)
+        headless = self.session.backend.headless
+        framebuffers = self.framebuffers[0] if self.framebuffers else None
+        if not headless:
+            if framebuffers is not None:
+                framebuffers.bind(image_index, depth_index)
+            elif depth_swapchain is not None:
+                self.stereo.attach(
+                    swapchain.images[image_index].image, swapchain.width, swapchain.height,
+                    depth_swapchain.images[depth_index].image, self.depth_attachment)
+            else:
+                self.stereo.attach(swapchain.images[image_index].image, swapchain.width, swapchain.height)
+            GL.glClearDepth(1.0)
+            GL.glClearColor(0, 0, 0, 0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        profiler.stop(clear_stage)
+        # Perform the actual Draw jobs, once for all the views
+        profiler.start(draw_stage)
+        gpu_timer = self.get_gpu_timer(True)
+        if gpu_timer is not None:
+            gpu_timer.begin(self.session.frame_state.predicted_display_time)
+        cbdata.upcall()
+        if gpu_timer is not None:
+            gpu_timer.end()
+        if framebuffers is not None and not headless:
+            framebuffers.unbind()
+        profiler.stop(draw_stage)
+        if self.mirror is not None:
+            profiler.start('mirror')
+            for i in self.mirror.views:
+                self.mirror.capture(i, swapchain.images[image_index].image, layer=i)
+            profiler.stop('mirror')
+        if self.frame_capture is not None:
+            profiler.start('capture')
+            for i in range(len(self.layer.views)):
+                self.frame_capture.capture(i, swapchain.images[image_index].image, layer=i)
+            profiler.stop('capture')
+        profiler.start(release_stage)
+        swapchain.release_image_info()
+        if depth_swapchain is not None:
+            depth_swapchain.release_image_info()
+        profiler.stop(release_stage)
+        for i in range(len(self.layer.views)):
+            self.layer.render_swapchain(i)
+        self.end_frame()
 
     def end_frame_task(self, task):
         if not self.session.session_active():
             return task.cont
-        if not self.end_frame_called:
-            self.session.end_frame(self.layer)
-            self.end_frame_called = True
+        if self.frame_acquired:
+            self.end_frame()
         return task.cont
 
+    def end_frame(self):
+        self.profiler.start('end_frame')
+        frame_begun = self.session.frame_begun
+        self.session.end_frame(self.layers)
+        self.profiler.stop('end_frame')
+        self.frame_acquired = False
+        if self.session_recorder is not None and frame_begun:
+            self.session_recorder.record_frame()
+        if self.frame_time_controllers and self.frame_start is not None:
+            cpu_time = time.perf_counter() - self.frame_start
+            for controller in self.frame_time_controllers:
+                controller.add_cpu_time(cpu_time)
+
     def fb_props_to_gl_mode(self, fb_props: FrameBufferProperties):
         """
         Convert a frame buffer configuration into an OpenGL format
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from collections import deque
+import ctypes
+import logging
+import threading
+import time
+import xr
+
+from typing import TYPE_CHECKING
+
+from .profiler import NullProfiler
+
+if TYPE_CHECKING:
+    from .session import Session
+
+
+class FramePacer:
+    """
+    Call xrWaitFrame and xrBeginFrame on a dedicated thread, so the main loop can keep working while the runtime
+    throttles the application.
+
+    The thread waits for the next frame while the main loop is still processing the current one, then begins the
+    new frame as soon as the current one is ended, and publishes its frame state. The frame states are written in
+    two preallocated structures used alternately and handed to the main loop through a single slot deque, whose
+    operations are atomic, the events are only used to sleep until there is something to do.
+    """
+
+    # Stages recorded by the pacing thread
+    STAGES = ('pacer.wait_frame', 'pacer.begin_frame')
+
+    def __init__(self, session: Session, profiler=None):
+        self.logger = logging.getLogger("pacer")
+        self.session = session
+        self.profiler = NullProfiler()
+        if profiler is not None:
+            self.set_profiler(profiler)
+        self.frame_states = (xr.FrameState(), xr.FrameState())
+        self.next_state = 0
+        self.slot: deque = deque(maxlen=1)
+        # Set when a frame state is published
+        self.ready = threading.Event()
+        # Set when the last begun frame has been ended, the next one can then be begun
+        self.ended = threading.Event()
+        self.ended.set()
+        self.running = False
+        self.thread: threading.Thread = None
+
+    def set_profiler(self, profiler) -> None:
+        """
+        Record the stages of the pacing thread in profiler, must be called from the main thread.
+        """
+
+        if profiler.enabled:
+            for stage in self.STAGES:
+                profiler.add_stage(stage, main_thread=False)
+        self.profiler = profiler
+
+    def start(self) -> None:
+        self.session.pacer = self
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="openxr-pacer", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self.ended.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.session.pacer = None
+
+    def run(self) -> None:
+        session = self.session
+        while self.running:
+            # The profiler can be replaced while the thread runs
+            profiler = self.profiler
+            if not session.session_active():
+                time.sleep(0.01)
+                continue
+            frame_state = self.frame_states[self.next_state]
+            try:
+                profiler.start('pacer.wait_frame')
+                session.wait_frame(frame_state)
+                profiler.stop('pacer.wait_frame')
+                # A frame can only be begun once the previous one has been ended
+                self.ended.wait()
+                self.ended.clear()
+                if not self.running or not session.session_active():
+                    session.cancel_frame()
+                    self.ended.set()
+                    continue
+                profiler.start('pacer.begin_frame')
+                session.begin_frame()
+                profiler.stop('pacer.begin_frame')
+            except xr.XrException as e:
+                self.logger.error(f"Frame pacing failed: {e}")
+                session.cancel_frame()
+                self.ended.set()
+                continue
+            self.slot.append(self.next_state)
+            self.next_state = 1 - self.next_state
+            self.ready.set()
+
+    def acquire_frame(self, timeout: float = 0.1) -> bool:
+        """
+        Wait for the next begun frame and copy its state into the session frame state.
+
+        Return False if no frame was begun within the timeout, the frame must then be skipped.
+        """
+
+        if not self.ready.wait(timeout):
+            return False
+        self.ready.clear()
+        frame_state = self.frame_states[self.slot.popleft()]
+        ctypes.memmove(ctypes.addressof(self.session.frame_state), ctypes.addressof(frame_state),
+                       ctypes.sizeof(xr.FrameState))
+        return True
+
+    def frame_ended(self) -> None:
+        self.ended.set()
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import ctypes
+import numpy as np
+from typing import Sequence, Union
+import xr
+
+
+def get_pose_arrays(array: ctypes.Array, struct_type) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return NumPy views, sharing the memory of the given ctypes array of structures holding a pose field, on the
+    orientations (x, y, z, w) and the positions of the poses.
+    """
+
+    raw = (ctypes.c_char * ctypes.sizeof(array)).from_buffer(array)
+    stride = ctypes.sizeof(struct_type) // 4
+    floats = np.frombuffer(raw, dtype=np.float32).reshape(len(array), stride)
+    offset = struct_type.pose.offset // 4
+    return floats[:, offset:offset + 4], floats[:, offset + 4:offset + 7]
+
+
+def multiply_quaternions(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Hamilton product of arrays of quaternions in Panda3D order (w, x, y, z).
+    """
+
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ), axis=-1)
+
+
+def slerp(a: np.ndarray, b: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """
+    Spherical interpolation between arrays of unit quaternions, t has one factor per quaternion.
+    """
+
+    dot = np.sum(a * b, axis=-1)
+    # Take the shortest path
+    b = np.where((dot < 0)[..., np.newaxis], -b, b)
+    dot = np.abs(dot)
+    angle = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_angle = np.sin(angle)
+    # Fall back to a normalized linear interpolation for close quaternions
+    close = sin_angle < 1e-6
+    safe_sin = np.where(close, 1.0, sin_angle)
+    wa = np.where(close, 1.0 - t, np.sin((1.0 - t) * angle) / safe_sin)
+    wb = np.where(close, t, np.sin(t * angle) / safe_sin)
+    result = a * wa[..., np.newaxis] + b * wb[..., np.newaxis]
+    return result / np.linalg.norm(result, axis=-1, keepdims=True)
+
+
+class PoseHistory:
+    """
+    Ring buffer of the timestamped poses of a set of tracked devices, e.g. the HMD, each view and each hand.
+
+    Each sample holds, for one XrTime, the position, the orientation and the validity of every device. The poses
+    are stored in the Panda3D coordinate system, relative to the tracking space anchor, the orientations in
+    LQuaternion order (w, x, y, z). The arrays are preallocated and recording a frame does not allocate memory.
+
+    The samples are recorded with record() and can be read at once with get_samples() or queried with
+    interpolate() and get_velocity().
+    """
+
+    def __init__(self, names: Sequence[str], capacity: int = 256):
+        if capacity < 2:
+            raise ValueError("The pose history must hold at least two samples")
+        self.names = list(names)
+        self.indices = {name: i for i, name in enumerate(self.names)}
+        self.capacity = capacity
+        nb_devices = len(self.names)
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.positions = np.zeros((capacity, nb_devices, 3), dtype=np.float64)
+        self.orientations = np.zeros((capacity, nb_devices, 4), dtype=np.float64)
+        self.orientations[..., 0] = 1.0
+        self.valid = np.zeros((capacity, nb_devices), dtype=bool)
+        # Index of the last sample and number of samples recorded
+        self.last = -1
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get_index(self, device: Union[int, str]) -> int:
+        if isinstance(device, str):
+            return self.indices[device]
+        return device
+
+    def get_row(self, time: int) -> int:
+        """
+        Return the sample of the given time, a new sample is started if the time differs from the last one.
+        """
+
+        if self.size > 0 and self.times[self.last] == time:
+            return self.last
+        self.last = (self.last + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.times[self.last] = time
+        self.valid[self.last] = False
+        return self.last
+
+    def record(
+            self, time: int, first: int, orientations: np.ndarray, positions: np.ndarray,
+            valid: Union[bool, np.ndarray]) -> None:
+        """
+        Record the poses of the consecutive devices starting at index first, given in the OpenXR coordinate system
+        with the orientations as (x, y, z, w), like the arrays of get_pose_arrays().
+        """
+
+        row = self.get_row(time)
+        count = len(positions)
+        end = first + count
+        # OpenXR is Y up right handed, Panda3D is Z up right handed
+        target = self.positions[row, first:end]
+        target[:, 0] = positions[:, 0]
+        target[:, 1] = positions[:, 2]
+        target[:, 1] *= -1
+        target[:, 2] = positions[:, 1]
+        target = self.orientations[row, first:end]
+        target[:, 0] = orientations[:, 3]
+        target[:, 1] = orientations[:, 0]
+        target[:, 2] = orientations[:, 2]
+        target[:, 2] *= -1
+        target[:, 3] = orientations[:, 1]
+        self.valid[row, first:end] = valid
+
+    def clear(self) -> None:
+        self.last = -1
+        self.size = 0
+
+    def get_order(self) -> np.ndarray:
+        """
+        Return the indices of the samples from the oldest to the newest.
+        """
+
+        return (np.arange(self.size) + (self.last - self.size + 1)) % self.capacity
+
+    def get_samples(self, device: Union[int, str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return copies of the times, positions, orientations and validity of the samples of the device, from the
+        oldest to the newest.
+        """
+
+        index = self.get_index(device)
+        order = self.get_order()
+        return (self.times[order], self.positions[order, index], self.orientations[order, index],
+                self.valid[order, index])
+
+    def interpolate(
+            self, device: Union[int, str],
+            times: Union[int, Sequence[int], np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the positions, orientations and validity of the device at the given XrTimes, interpolated between
+        the two surrounding samples. A pose is only valid if both samples are valid and the time is inside the
+        recorded range, outside of it the oldest or newest pose is returned.
+        """
+
+        sample_times, positions, orientations, valid = self.get_samples(device)
+        times = np.atleast_1d(np.asarray(times, dtype=np.int64))
+        if self.size == 0:
+            return (np.zeros((len(times), 3)), np.tile([1.0, 0.0, 0.0, 0.0], (len(times), 1)),
+                    np.zeros(len(times), dtype=bool))
+        after = np.clip(np.searchsorted(sample_times, times), 1, max(self.size - 1, 1))
+        before = after - 1
+        if self.size == 1:
+            after = before
+        span = (sample_times[after] - sample_times[before]).astype(np.float64)
+        t = np.where(span > 0, (times - sample_times[before]) / np.where(span > 0, span, 1.0), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        result_positions = positions[before] + (positions[after] - positions[before]) * t[:, np.newaxis]
+        result_orientations = slerp(orientations[before], orientations[after], t)
+        in_range = (times >= sample_times[0]) & (times <= sample_times[-1])
+        return result_positions, result_orientations, valid[before] & valid[after] & in_range
+
+    def get_velocity(
+            self, device: Union[int, str], window: int = 100_000_000,
+            time: int = None) -> tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Estimate the linear velocity, in units per second, and the angular velocity, as a rotation vector in
+        radians per second, of the device over the valid samples of the last window nanoseconds before time, by
+        default the newest sample.
+
+        The linear velocity is the least squares slope of the positions, the angular velocity the rotation between
+        the oldest and the newest sample of the window. The last value is False when less than two valid samples
+        are available.
+        """
+
+        sample_times, positions, orientations, valid = self.get_samples(device)
+        if time is None:
+            time = sample_times[-1] if self.size > 0 else 0
+        selected = valid & (sample_times <= time) & (sample_times >= time - window)
+        if np.count_nonzero(selected) < 2:
+            return np.zeros(3), np.zeros(3), False
+        seconds = (sample_times[selected] - sample_times[selected][0]) / 1e9
+        positions = positions[selected]
+        centered = seconds - seconds.mean()
+        linear = (centered[:, np.newaxis] * (positions - positions.mean(axis=0))).sum(axis=0) / np.sum(centered ** 2)
+        first = orientations[selected][0]
+        last = orientations[selected][-1]
+        conjugate = first * np.array([1.0, -1.0, -1.0, -1.0])
+        delta = multiply_quaternions(last, conjugate)
+        if delta[0] < 0:
+            delta = -delta
+        sin_half = np.linalg.norm(delta[1:])
+        angle = 2 * np.arctan2(sin_half, delta[0])
+        axis = delta[1:] / sin_half if sin_half > 1e-12 else np.zeros(3)
+        angular = axis * angle / (seconds[-1] - seconds[0])
+        return linear, angular, True
+
+
+class PoseRecorder:
+    """
+    Feed a PoseHistory with the HMD, the views and the linked poses located by the frame loop.
+
+    The HMD is the view space located in the application space, the views are the poses located for the projection
+    layer and the linked poses those located by the action set, all at the predicted display time of the frame.
+    """
+
+    def __init__(self, history: PoseHistory, hmd_locator, layer, action_set):
+        self.history = history
+        self.hmd_locator = hmd_locator
+        self.layer = layer
+        self.action_set = action_set
+        self.hmd_flags, self.hmd_orientations, self.hmd_positions = hmd_locator.as_arrays()
+        self.view_orientations, self.view_positions = get_pose_arrays(layer.located_views, xr.View)
+        self.nb_views = len(layer.views)
+        if action_set.pose_links:
+            self.link_flags, self.link_orientations, self.link_positions = action_set.pose_locator.as_arrays()
+        self.link_active = np.zeros(len(action_set.pose_links), dtype=bool)
+        self.valid_bits = xr.SPACE_LOCATION_POSITION_VALID_BIT | xr.SPACE_LOCATION_ORIENTATION_VALID_BIT
+
+    def record_views(self, time: int) -> None:
+        """
+        Record the HMD and the views, must be called after the views are located.
+        """
+
+        self.hmd_locator.locate(time)
+        self.history.record(
+            time, 0, self.hmd_orientations, self.hmd_positions,
+            self.hmd_flags & self.valid_bits == self.valid_bits)
+        self.history.record(time, 1, self.view_orientations, self.view_positions, self.layer.pose_valid)
+
+    def record_links(self, time: int) -> None:
+        """
+        Record the linked poses, must be called after the actions are polled.
+        """
+
+        if not self.action_set.pose_links:
+            return
+        for i, link in enumerate(self.action_set.pose_links):
+            self.link_active[i] = link.state.is_active
+        valid = self.link_flags & self.valid_bits == self.valid_bits
+        valid &= self.link_active
+        self.history.record(time, 1 + self.nb_views, self.link_orientations, self.link_positions, valid)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from array import array
+import logging
+from panda3d.core import PStatCollector
+import sys
+import threading
+import time
+from typing import Sequence, TextIO
+
+
+class StageSamples:
+    """
+    Fixed-size ring buffer holding the last durations, in seconds, recorded for a stage.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.samples = array('d', bytes(8 * size))
+        self.count = 0
+
+    def add(self, duration: float) -> None:
+        self.samples[self.count % self.size] = duration
+        self.count += 1
+
+    def get_samples(self) -> list[float]:
+        """
+        Return the recorded samples, oldest first.
+        """
+
+        if self.count <= self.size:
+            return self.samples[:self.count].tolist()
+        start = self.count % self.size
+        return self.samples[start:].tolist() + self.samples[:start].tolist()
+
+    def reset(self) -> None:
+        self.count = 0
+
+
+class NullProfiler:
+    """
+    Profiler used when profiling is disabled, all the methods do nothing.
+    """
+
+    enabled = False
+
+    def start(self, stage: str) -> None:
+        pass
+
+    def stop(self, stage: str) -> None:
+        pass
+
+
+class FrameProfiler:
+    """
+    Record the wall-clock time spent in each stage of the frame loop.
+
+    The samples of each stage are kept in a ring buffer of the given size. If pstats is True, each stage is also
+    reported to PStats under the OpenXR collector, except the stages recorded outside the main thread.
+    """
+
+    enabled = True
+
+    def __init__(self, size: int = 1024, pstats: bool = False):
+        self.logger = logging.getLogger("profiler")
+        self.size = size
+        self.pstats = pstats
+        self.stages: dict[str, StageSamples] = {}
+        self.starts: dict[str, float] = {}
+        self.collectors: dict[str, PStatCollector] = {}
+
+    def add_stage(self, stage: str, main_thread: bool = True) -> None:
+        """
+        Register a stage, the stages recorded by another thread must be registered beforehand from the main thread,
+        as the stages are iterated by summary() and dump().
+        """
+
+        if stage not in self.stages:
+            self.stages[stage] = StageSamples(self.size)
+            if self.pstats and main_thread:
+                self.collectors[stage] = PStatCollector("OpenXR:" + stage.replace('.', ':'))
+
+    def start(self, stage: str) -> None:
+        if stage not in self.stages:
+            self.add_stage(stage, threading.current_thread() is threading.main_thread())
+        collector = self.collectors.get(stage)
+        if collector is not None:
+            collector.start()
+        self.starts[stage] = time.perf_counter()
+
+    def stop(self, stage: str) -> None:
+        end = time.perf_counter()
+        collector = self.collectors.get(stage)
+        if collector is not None:
+            collector.stop()
+        self.stages[stage].add(end - self.starts[stage])
+
+    def reset(self) -> None:
+        for samples in self.stages.values():
+            samples.reset()
+
+    def get_samples(self, stage: str) -> list[float]:
+        return self.stages[stage].get_samples()
+
+    @staticmethod
+    def percentile(sorted_samples: Sequence[float], percent: float) -> float:
+        if not sorted_samples:
+            return 0.0
+        rank = min(int(round(percent / 100.0 * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+        return sorted_samples[rank]
+
+    def summary(self, percentiles: Sequence[float] = (50, 90, 99)) -> dict[str, dict[str, float]]:
+        """
+        Return for each stage the number of samples, the mean, the max and the requested percentiles,
+        the durations are given in milliseconds.
+        """
+
+        result = {}
+        for stage, stage_samples in self.stages.items():
+            samples = sorted(stage_samples.get_samples())
+            stats = {'count': len(samples)}
+            if samples:
+                stats['mean'] = sum(samples) / len(samples) * 1000
+                stats['max'] = samples[-1] * 1000
+            else:
+                stats['mean'] = 0.0
+                stats['max'] = 0.0
+            for percent in percentiles:
+                stats[f'p{percent}'] = self.percentile(samples, percent) * 1000
+            result[stage] = stats
+        return result
+
+    def dump(self, output: TextIO = None, percentiles: Sequence[float] = (50, 90, 99)) -> None:
+        """
+        Write the summary of all the stages as a table, by default on stdout.
+        """
+
+        if output is None:
+            output = sys.stdout
+        columns = ['mean'] + [f'p{percent}' for percent in percentiles] + ['max']
+        output.write(f"{'Stage':<20} {'Count':>7} " + " ".join(f"{column:>8}" for column in columns) + "\n")
+        for stage, stats in self.summary(percentiles).items():
+            output.write(
+                f"{stage:<20} {stats['count']:>7} " + " ".join(f"{stats[column]:>8.3f}" for column in columns) + "\n")
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import functools
+import importlib.util
 import math
 from panda3d.core import LMatrix4, LPoint3, LQuaternion
 from panda3d.core import CS_default, CS_yup_right
+from typing import Sequence
 import xr
 
 
@@ -13,6 +16,8 @@ class ProjectionView:
         self.view = view
         self.coord_mat = LMatrix4.convert_mat(CS_yup_right, CS_default)
         self.coord_mat_inv = LMatrix4.convert_mat(CS_default, CS_yup_right)
+        self.projection_key: tuple = None
+        self.projection_mat: LMatrix4 = None
 
     def set_view(self, view):
         self.view = view
@@ -23,11 +28,17 @@ class ProjectionView:
 
     @property
     def position(self):
-        return self.coord_mat.xform_point(LPoint3(*self.view.pose.position))
+        return self.get_position(self.view.pose)
 
     @property
     def orientation(self):
-        quat = self.view.pose.orientation
+        return self.get_orientation(self.view.pose)
+
+    def get_position(self, pose: xr.Posef) -> LPoint3:
+        return self.coord_mat.xform_point(LPoint3(*pose.position))
+
+    def get_orientation(self, pose: xr.Posef) -> LQuaternion:
+        quat = pose.orientation
         # TODO: Check why we can't use coord_mat here
         return LQuaternion(quat.w, quat.x, -quat.z, quat.y)
 
@@ -35,11 +46,28 @@ class ProjectionView:
     def fov(self):
         return self.view.fov
 
+    def get_projection_key(self, near_z: float, far_z: float) -> tuple:
+        fov = self.view.fov
+        return (fov.angle_left, fov.angle_right, fov.angle_up, fov.angle_down, near_z, far_z)
+
+    def get_tangents(self) -> tuple[float, float, float, float]:
+        """
+        Return the tangents of the left, right, up and down angles of the FOV.
+        """
+
+        fov = self.view.fov
+        return (math.tan(fov.angle_left), math.tan(fov.angle_right), math.tan(fov.angle_up), math.tan(fov.angle_down))
+
     def calc_projection_matrix(self, near_z: float, far_z: float) -> LMatrix4:
-        tan_left = math.tan(self.fov.angle_left)
-        tan_right = math.tan(self.fov.angle_right)
-        tan_down = math.tan(self.fov.angle_down)
-        tan_up = math.tan(self.fov.angle_up)
+        return self.calc_sub_projection_matrix(*self.get_tangents(), near_z, far_z)
+
+    def calc_sub_projection_matrix(
+            self, tan_left: float, tan_right: float, tan_up: float, tan_down: float,
+            near_z: float, far_z: float) -> LMatrix4:
+        """
+        Return the projection matrix of a frustum given by the tangents of its angles, in the view space.
+        """
+
         mat = self._create_projection(tan_left, tan_right, tan_up, tan_down, near_z, far_z)
         return self.coord_mat_inv * mat
 
@@ -106,3 +134,59 @@ class ProjectionView:
             m[11] = -1.0
             m[15] = 0.0
         return LMatrix4(*m)
+
+
+@functools.lru_cache(maxsize=None)
+def has_numpy() -> bool:
+    return importlib.util.find_spec('numpy') is not None
+
+
+def calc_projection_matrices(views: Sequence[ProjectionView], near_z: float, far_z: float) -> list[LMatrix4]:
+    """
+    Compute the projection matrices of all the given views at once, using NumPy.
+
+    The result is identical to calling calc_projection_matrix() on each view.
+    """
+
+    import numpy as np
+
+    angles = np.array(
+        [(view.fov.angle_left, view.fov.angle_right, view.fov.angle_up, view.fov.angle_down) for view in views],
+        dtype=np.float64)
+    tan_left, tan_right, tan_up, tan_down = np.tan(angles).T
+    tan_width = tan_right - tan_left
+    tan_height = tan_up - tan_down
+    offset_z = near_z
+    m = np.zeros((len(views), 4, 4))
+    m[:, 0, 0] = 2.0 / tan_width
+    m[:, 2, 0] = (tan_right + tan_left) / tan_width
+    m[:, 1, 1] = 2.0 / tan_height
+    m[:, 2, 1] = (tan_up + tan_down) / tan_height
+    m[:, 2, 3] = -1.0
+    if far_z <= near_z:
+        # place the far plane at infinity
+        m[:, 2, 2] = -1.0
+        m[:, 3, 2] = -(near_z + offset_z)
+    else:
+        m[:, 2, 2] = -(far_z + offset_z) / (far_z - near_z)
+        m[:, 3, 2] = -(far_z * (near_z + offset_z)) / (far_z - near_z)
+    coord_mat_inv = np.array(views[0].coord_mat_inv, dtype=np.float64)
+    return [LMatrix4(*mat.ravel().tolist()) for mat in coord_mat_inv @ m]
+
+
+def update_projection_matrices(views: Sequence[ProjectionView], near_z: float, far_z: float) -> list[ProjectionView]:
+    """
+    Update the cached projection matrix of the views whose FOV or clip planes changed and return them.
+
+    When several views changed, their matrices are computed in one batch if NumPy is available.
+    """
+
+    changed = [view for view in views if view.get_projection_key(near_z, far_z) != view.projection_key]
+    if len(changed) > 1 and has_numpy():
+        matrices = calc_projection_matrices(changed, near_z, far_z)
+    else:
+        matrices = [view.calc_projection_matrix(near_z, far_z) for view in changed]
+    for view, mat in zip(changed, matrices):
+        view.projection_key = view.get_projection_key(near_z, far_z)
+        view.projection_mat = mat
+    return changed
@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import ctypes
+import json
+import logging
+import os
+import numpy as np
+import struct
+import time
+from typing import Optional, TYPE_CHECKING, Union
+import xr
+
+from .action import get_pose_name
+from .simulated import QUAD_VIEWS, SimulatedBackend
+
+if TYPE_CHECKING:
+    from .actionset import ActionSet
+    from .layer import ProjectionLayer
+    from .session import Session
+
+
+MAGIC = b"P3DXREC\0"
+# Version of the recording file format, a recording with another version can not be replayed
+FORMAT_VERSION = 1
+# The records start on a multiple of the alignment, so the memory map is aligned
+HEADER_ALIGNMENT = 64
+HEADER_PREFIX = struct.Struct("<8sII")
+
+RECORD_FRAME = 0
+RECORD_EVENT = 1
+
+# Floats of a located view : orientation (x, y, z, w), position and field of view (left, right, up, down)
+VIEW_FLOATS = 11
+# Floats of a pose : orientation (x, y, z, w) and position
+POSE_FLOATS = 7
+
+HAND_PATHS = ("/user/hand/left", "/user/hand/right")
+RUNNING_STATES = (xr.SessionState.SYNCHRONIZED, xr.SessionState.VISIBLE, xr.SessionState.FOCUSED)
+
+
+def get_record_dtype(nb_views: int, nb_poses: int) -> np.dtype:
+    """
+    Return the layout of a record, a frame or a session state change, for the given number of views and linked
+    poses. All the records have the same size, the fields not used by a session state change are zero.
+    """
+
+    return np.dtype([
+        ('kind', np.uint32),
+        ('session_state', np.int32),
+        ('predicted_display_time', np.int64),
+        ('predicted_display_period', np.int64),
+        ('should_render', np.uint32),
+        ('view_state_flags', np.uint64),
+        ('views', np.float32, (nb_views, VIEW_FLOATS)),
+        ('pose_flags', np.uint64, (nb_poses,)),
+        ('poses', np.float32, (nb_poses, POSE_FLOATS)),
+    ], align=True)
+
+
+def get_view_arrays(views: ctypes.Array) -> np.ndarray:
+    """
+    Return a NumPy view, sharing the memory of the given ctypes array of xr.View, on the pose and the field of
+    view of each view, see VIEW_FLOATS.
+    """
+
+    raw = (ctypes.c_char * ctypes.sizeof(views)).from_buffer(views)
+    stride = ctypes.sizeof(xr.View) // 4
+    floats = np.frombuffer(raw, dtype=np.float32).reshape(len(views), stride)
+    offset = xr.View.pose.offset // 4
+    return floats[:, offset:offset + VIEW_FLOATS]
+
+
+class SessionRecorder:
+    """
+    Record a tracking session into a file of fixed-width records which can be memory-mapped, see SessionRecording.
+
+    A frame record holds the frame state, the session state, the views located for the projection layer, with their
+    pose, field of view and validity flags, and the linked poses located by the action set. The session state
+    changes are recorded in their own records, in order with the frames.
+
+    The records are written by batches of batch_size frames, recording a frame does not allocate memory. The file
+    is always valid, a recording interrupted by a crash only loses its last batch.
+    """
+
+    def __init__(
+            self, filename: str, session: Session, layer: ProjectionLayer, action_set: ActionSet,
+            batch_size: int = 64):
+        self.logger = logging.getLogger("recording")
+        self.filename = filename
+        self.session = session
+        self.layer = layer
+        self.action_set = action_set
+        self.pose_names = [link.name for link in action_set.pose_links]
+        self.nb_views = len(layer.views)
+        self.nb_poses = len(self.pose_names)
+        self.dtype = get_record_dtype(self.nb_views, self.nb_poses)
+        self.buffer = np.zeros(batch_size, dtype=self.dtype)
+        self.count = 0
+        self.nb_records = 0
+        # Content of the current frame, copied into the buffer when the frame ends
+        self.pending = np.zeros(1, dtype=self.dtype)
+        self.empty = np.zeros(1, dtype=self.dtype)
+        self.pending_views = self.pending['views'][0]
+        self.pending_pose_flags = self.pending['pose_flags'][0]
+        self.pending_poses = self.pending['poses'][0]
+        self.views_located = False
+        self.poses_located = False
+        self.view_arrays = get_view_arrays(layer.located_views)
+        if self.nb_poses > 0:
+            self.pose_flags, orientations, positions = action_set.pose_locator.as_arrays()
+            self.pose_orientations = self.pending_poses[:, :4]
+            self.pose_positions = self.pending_poses[:, 4:]
+            self.source_orientations = orientations
+            self.source_positions = positions
+        self.pose_active = np.zeros(self.nb_poses, dtype=np.uint64)
+        self.file = open(filename, 'wb', buffering=0)
+        self.write_header()
+        session.add_state_listener(self.record_event)
+
+    def write_header(self) -> None:
+        metadata = json.dumps({
+            'views': self.nb_views,
+            'poses': self.pose_names,
+            'view_configuration_type': int(self.session.system.view_configuration_type),
+        }).encode()
+        size = HEADER_PREFIX.size + len(metadata)
+        header_size = (size + HEADER_ALIGNMENT - 1) // HEADER_ALIGNMENT * HEADER_ALIGNMENT
+        self.file.write(HEADER_PREFIX.pack(MAGIC, FORMAT_VERSION, header_size))
+        self.file.write(metadata.ljust(header_size - HEADER_PREFIX.size, b'\0'))
+
+    def record_views(self) -> None:
+        """
+        Record the views of the current frame, must be called after the views are located.
+        """
+
+        self.pending_views[:] = self.view_arrays
+        self.pending['view_state_flags'] = self.layer.view_state.view_state_flags
+        self.views_located = True
+
+    def record_poses(self) -> None:
+        """
+        Record the linked poses of the current frame, must be called after the actions are polled. The flags of
+        an inactive pose are recorded as zero.
+        """
+
+        if self.nb_poses == 0:
+            return
+        for i, link in enumerate(self.action_set.pose_links):
+            self.pose_active[i] = link.state.is_active
+        np.multiply(self.pose_flags, self.pose_active, out=self.pending_pose_flags)
+        self.pose_orientations[:] = self.source_orientations
+        self.pose_positions[:] = self.source_positions
+        self.poses_located = True
+
+    def record_frame(self) -> None:
+        """
+        Write the record of the current frame, must be called when the frame is ended.
+        """
+
+        frame_state = self.session.frame_state
+        pending = self.pending
+        pending['kind'] = RECORD_FRAME
+        pending['session_state'] = self.session.state
+        pending['predicted_display_time'] = frame_state.predicted_display_time
+        pending['predicted_display_period'] = frame_state.predicted_display_period
+        pending['should_render'] = frame_state.should_render
+        if not self.views_located:
+            pending['view_state_flags'] = 0
+        if not self.poses_located:
+            self.pending_pose_flags[:] = 0
+        self.buffer[self.count] = pending[0]
+        self.views_located = False
+        self.poses_located = False
+        self.add_record()
+
+    def record_event(self, old_state: xr.SessionState, new_state: xr.SessionState) -> None:
+        """
+        Write the record of a session state change, stamped with the display time of the last frame.
+        """
+
+        self.buffer[self.count] = self.empty[0]
+        record = self.buffer[self.count]
+        record['kind'] = RECORD_EVENT
+        record['session_state'] = new_state
+        record['predicted_display_time'] = self.session.frame_state.predicted_display_time
+        self.add_record()
+
+    def add_record(self) -> None:
+        self.count += 1
+        self.nb_records += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.count > 0:
+            self.file.write(self.buffer[:self.count])
+            self.count = 0
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.session.remove_state_listener(self.record_event)
+        self.flush()
+        self.file.close()
+        self.file = None
+        self.logger.info(f"Recorded {self.nb_records} records in {self.filename}")
+
+
+class SessionRecording:
+    """
+    Memory-mapped recording written by SessionRecorder.
+
+    The records are only read from the file when they are accessed, records holds all of them in order,
+    frame_indices the index of the frame records and frame_times their predicted display time.
+    """
+
+    def __init__(self, filename: str):
+        self.logger = logging.getLogger("recording")
+        self.filename = filename
+        with open(filename, 'rb') as recording_file:
+            magic, version, header_size = HEADER_PREFIX.unpack(recording_file.read(HEADER_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a session recording")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"Unsupported session recording version {version}")
+            metadata = json.loads(recording_file.read(header_size - HEADER_PREFIX.size).rstrip(b'\0'))
+        self.nb_views: int = metadata['views']
+        self.pose_names: list[str] = metadata['poses']
+        self.pose_indices = {name: i for i, name in enumerate(self.pose_names)}
+        self.view_configuration_type = xr.ViewConfigurationType(metadata['view_configuration_type'])
+        self.dtype = get_record_dtype(self.nb_views, len(self.pose_names))
+        # The last record is incomplete if the recording was interrupted
+        count = (os.path.getsize(filename) - header_size) // self.dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(filename, dtype=self.dtype, mode='r', offset=header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+        self.frame_indices = np.flatnonzero(self.records['kind'] == RECORD_FRAME)
+        self.frame_times = self.records['predicted_display_time'][self.frame_indices]
+
+    def __len__(self) -> int:
+        return len(self.frame_indices)
+
+    def get_frame(self, index: int) -> np.void:
+        return self.records[self.frame_indices[index]]
+
+    def find_frame(self, display_time: int) -> int:
+        """
+        Return the index of the last frame displayed at or before the given time, or the first frame.
+        """
+
+        index = int(np.searchsorted(self.frame_times, display_time, side='right')) - 1
+        return max(index, 0)
+
+    def get_events(self) -> list[tuple[int, xr.SessionState]]:
+        """
+        Return the session state changes, each with the index of the frame they follow, -1 for the changes
+        recorded before the first frame.
+        """
+
+        indices = np.flatnonzero(self.records['kind'] == RECORD_EVENT)
+        frames = np.searchsorted(self.frame_indices, indices) - 1
+        states = self.records['session_state'][indices]
+        return [(int(frame), xr.SessionState(int(state))) for frame, state in zip(frames, states)]
+
+
+class ReplayBackend(SimulatedBackend):
+    """
+    Simulated runtime replaying a session recording, see SessionRecorder.
+
+    Each xrWaitFrame returns the next recorded frame, with its display time and should_render flag, and the views,
+    the linked poses and the HMD are located from the recorded frame displayed at the requested time. The session
+    state changes recorded while the session was running are replayed after the frame they followed.
+
+    If realtime is True the frames are paced like they were recorded, a late frame is not dropped so the replay
+    always goes through the same frames, otherwise they are replayed as fast as possible. At the end of the recording
+    the session is exited, or the recording is replayed again from its first frame if loop is True.
+
+    The other arguments are given to SimulatedBackend.
+    """
+
+    def __init__(
+            self, recording: Union[str, SessionRecording], realtime: bool = True, loop: bool = False, **kwargs):
+        if not isinstance(recording, SessionRecording):
+            recording = SessionRecording(recording)
+        if len(recording) == 0:
+            raise ValueError(f"The recording {recording.filename} holds no frame")
+        first = recording.get_frame(0)
+        nb_views = recording.nb_views
+        if recording.view_configuration_type == QUAD_VIEWS and nb_views == 4:
+            # The insets are replayed as the quad view configuration, the size of the views is not recorded
+            nb_views = 2
+            kwargs.setdefault('inset_size', kwargs.get('view_size', (1440, 1600)))
+        super().__init__(
+            display_rate=1e9 / int(first['predicted_display_period']), realtime=realtime,
+            nb_views=nb_views, head_pose=self.recorded_head_pose, hand_pose=self.recorded_hand_pose, **kwargs)
+        self.logger = logging.getLogger("replay")
+        self.recording = recording
+        self.loop = loop
+        self.first_time = int(recording.frame_times[0])
+        last_time = int(recording.frame_times[-1])
+        self.loop_duration = last_time - self.first_time + int(recording.get_frame(-1)['predicted_display_period'])
+        self.start_time = self.first_time
+        self.display_time = self.first_time - self.display_period
+        # Index of the last frame returned by wait_frame(), counting the loops
+        self.frame = -1
+        self.replay_start: float = None
+        self.events_by_frame: dict[int, list[xr.SessionState]] = {}
+        for frame, state in recording.get_events():
+            # The startup states are produced by the session creation
+            if frame >= 0 and state in RUNNING_STATES:
+                self.events_by_frame.setdefault(frame, []).append(state)
+        # Index in the recording of the linked pose of each action space
+        self.pose_spaces: dict[int, int] = {}
+        self.view_arrays: dict[int, np.ndarray] = {}
+        self.valid_bits = xr.SPACE_LOCATION_POSITION_VALID_BIT | xr.SPACE_LOCATION_ORIENTATION_VALID_BIT
+        self.logger.info(f"Replaying {len(recording)} frames from {recording.filename}")
+
+    def get_recorded_frame(self, display_time: int) -> np.void:
+        """
+        Return the recorded frame displayed at the given time.
+        """
+
+        if self.loop:
+            display_time = self.first_time + (display_time - self.first_time) % self.loop_duration
+        return self.recording.get_frame(self.recording.find_frame(display_time))
+
+    def get_time(self, t: float) -> int:
+        return self.start_time + round(t * 1e9)
+
+    def get_recorded_pose(self, record: np.void, index: int) -> Optional[tuple]:
+        if int(record['pose_flags'][index]) & self.valid_bits != self.valid_bits:
+            return None
+        pose = record['poses'][index].tolist()
+        return tuple(pose[4:]), tuple(pose[:4])
+
+    def recorded_head_pose(self, t: float):
+        """
+        The HMD is between the views, with the orientation of the first one.
+        """
+
+        views = self.get_recorded_frame(self.get_time(t))['views']
+        position = views[:, 4:7].mean(axis=0).tolist()
+        return tuple(position), tuple(views[0, :4].tolist())
+
+    def recorded_hand_pose(self, hand: int, t: float):
+        index = self.recording.pose_indices.get(get_pose_name('hand_pose', HAND_PATHS[hand]))
+        if index is None:
+            return None
+        return self.get_recorded_pose(self.get_recorded_frame(self.get_time(t)), index)
+
+    def wait_frame_into(self, session, frame_wait_info, frame_state):
+        self.frame += 1
+        nb_frames = len(self.recording)
+        if self.loop or self.frame < nb_frames:
+            index = self.frame % nb_frames
+            record = self.recording.get_frame(index)
+            display_time = int(record['predicted_display_time']) + self.frame // nb_frames * self.loop_duration
+            should_render = bool(record['should_render'])
+            for state in self.events_by_frame.get(index, ()):
+                self.queue_state(state)
+            if not self.loop and self.frame == nb_frames - 1:
+                self.logger.info("End of the recording")
+                self.user_exit()
+        else:
+            # The frame loop goes on until the session is stopped
+            display_time = self.display_time + self.display_period
+            should_render = False
+        if self.realtime:
+            now = time.perf_counter()
+            if self.replay_start is None:
+                self.replay_start = now
+            deadline = self.replay_start + (display_time - self.first_time) / 1e9
+            if deadline > now:
+                time.sleep(deadline - now)
+        self.display_time = display_time
+        frame_state.predicted_display_time = display_time
+        frame_state.predicted_display_period = self.display_period
+        frame_state.should_render = should_render and self.session_state in (
+            xr.SessionState.VISIBLE, xr.SessionState.FOCUSED)
+
+    def locate_views_into(self, session, view_locate_info, view_state, views, view_count):
+        record = self.get_recorded_frame(view_locate_info.display_time)
+        key = ctypes.addressof(views)
+        view_arrays = self.view_arrays.get(key)
+        if view_arrays is None:
+            view_arrays = self.view_arrays[key] = get_view_arrays(views)
+        nb_views = self.get_view_count(view_locate_info.view_configuration_type)
+        count = min(nb_views, len(views), self.recording.nb_views)
+        view_arrays[:count] = record['views'][:count]
+        view_state.view_state_flags = int(record['view_state_flags'])
+        view_count.value = nb_views
+        return nb_views
+
+    def create_action_space(self, session, create_info):
+        handle = super().create_action_space(session, create_info)
+        action_name = self.action_names[self.handle_value(create_info.action)]
+        name = get_pose_name(action_name, self.subaction_string(create_info.subaction_path))
+        if name in self.recording.pose_indices:
+            self.pose_spaces[self.handle_value(handle)] = self.recording.pose_indices[name]
+        return handle
+
+    def destroy_space(self, space):
+        super().destroy_space(space)
+        self.pose_spaces.pop(self.handle_value(space), None)
+
+    def locate_space_into(self, space, base_space, display_time, location):
+        index = self.pose_spaces.get(self.handle_value(space))
+        if index is None:
+            super().locate_space_into(space, base_space, display_time, location)
+            return
+        record = self.get_recorded_frame(display_time)
+        location.location_flags = int(record['pose_flags'][index])
+        pose = record['poses'][index].tolist()
+        location.pose = xr.Posef(orientation=xr.Quaternionf(*pose[:4]), position=xr.Vector3f(*pose[4:]))
@@ -2,96 +2,102 @@ from __future__ import annotations
 
 import ctypes
 from direct.showbase.ShowBase import ShowBase
+import functools
 import logging
-from OpenGL import GL
 import platform
-from typing import TYPE_CHECKING
+from typing import Callable, TYPE_CHECKING
 import xr
 
+from .gl import GL, GLX, WGL
+
 if TYPE_CHECKING:
-    from .layer import ProjectionLayer
+    from .layer import LayerManager
+    from .pacing import FramePacer
     from .system import System
 
 
-# TODO: separate package for opengl stuff
-if platform.system() == "Windows":
-    from OpenGL import WGL
-elif platform.system() == "Linux":
-    from OpenGL import GLX
-
-
 def handle_key(handle):
     return hex(ctypes.cast(handle, ctypes.c_void_p).value)
 
 
-stringForFormat = {
-    GL.GL_COMPRESSED_R11_EAC: "COMPRESSED_R11_EAC",
-    GL.GL_COMPRESSED_RED_RGTC1: "COMPRESSED_RED_RGTC1",
-    GL.GL_COMPRESSED_RG_RGTC2: "COMPRESSED_RG_RGTC2",
-    GL.GL_COMPRESSED_RG11_EAC: "COMPRESSED_RG11_EAC",
-    GL.GL_COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT: "COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT",
-    GL.GL_COMPRESSED_RGB8_ETC2: "COMPRESSED_RGB8_ETC2",
-    GL.GL_COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2: "COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2",
-    GL.GL_COMPRESSED_RGBA8_ETC2_EAC: "COMPRESSED_RGBA8_ETC2_EAC",
-    GL.GL_COMPRESSED_SIGNED_R11_EAC: "COMPRESSED_SIGNED_R11_EAC",
-    GL.GL_COMPRESSED_SIGNED_RG11_EAC: "COMPRESSED_SIGNED_RG11_EAC",
-    GL.GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM: "COMPRESSED_SRGB_ALPHA_BPTC_UNORM",
-    GL.GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC: "COMPRESSED_SRGB8_ALPHA8_ETC2_EAC",
-    GL.GL_COMPRESSED_SRGB8_ETC2: "COMPRESSED_SRGB8_ETC2",
-    GL.GL_COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2: "COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2",
-    GL.GL_DEPTH_COMPONENT16: "DEPTH_COMPONENT16",
-    GL.GL_DEPTH_COMPONENT24: "DEPTH_COMPONENT24",
-    GL.GL_DEPTH_COMPONENT32: "DEPTH_COMPONENT32",
-    GL.GL_DEPTH_COMPONENT32F: "DEPTH_COMPONENT32F",
-    GL.GL_DEPTH24_STENCIL8: "DEPTH24_STENCIL8",
-    GL.GL_R11F_G11F_B10F: "R11F_G11F_B10F",
-    GL.GL_R16_SNORM: "R16_SNORM",
-    GL.GL_R16: "R16",
-    GL.GL_R16F: "R16F",
-    GL.GL_R16I: "R16I",
-    GL.GL_R16UI: "R16UI",
-    GL.GL_R32F: "R32F",
-    GL.GL_R32I: "R32I",
-    GL.GL_R32UI: "R32UI",
-    GL.GL_R8_SNORM: "R8_SNORM",
-    GL.GL_R8: "R8",
-    GL.GL_R8I: "R8I",
-    GL.GL_R8UI: "R8UI",
-    GL.GL_RG16_SNORM: "RG16_SNORM",
-    GL.GL_RG16: "RG16",
-    GL.GL_RG16F: "RG16F",
-    GL.GL_RG16I: "RG16I",
-    GL.GL_RG16UI: "RG16UI",
-    GL.GL_RG32F: "RG32F",
-    GL.GL_RG32I: "RG32I",
-    GL.GL_RG32UI: "RG32UI",
-    GL.GL_RG8_SNORM: "RG8_SNORM",
-    GL.GL_RG8: "RG8",
-    GL.GL_RG8I: "RG8I",
-    GL.GL_RG8UI: "RG8UI",
-    GL.GL_RGB10_A2: "RGB10_A2",
-    GL.GL_RGB8: "RGB8",
-    GL.GL_RGB9_E5: "RGB9_E5",
-    GL.GL_RGBA16_SNORM: "RGBA16_SNORM",
-    GL.GL_RGBA16: "RGBA16",
-    GL.GL_RGBA16F: "RGBA16F",
-    GL.GL_RGBA16I: "RGBA16I",
-    GL.GL_RGBA16UI: "RGBA16UI",
-    GL.GL_RGBA2: "RGBA2",
-    GL.GL_RGBA32F: "RGBA32F",
-    GL.GL_RGBA32I: "RGBA32I",
-    GL.GL_RGBA32UI: "RGBA32UI",
-    GL.GL_RGBA8_SNORM: "RGBA8_SNORM",
-    GL.GL_RGBA8: "RGBA8",
-    GL.GL_RGBA8I: "RGBA8I",
-    GL.GL_RGBA8UI: "RGBA8UI",
-    GL.GL_SRGB8_ALPHA8: "SRGB8_ALPHA8",
-    GL.GL_SRGB8: "SRGB8",
-    GL.GL_RGB16F: "RGB16F",
-    GL.GL_DEPTH32F_STENCIL8: "DEPTH32F_STENCIL8",
-    GL.GL_BGR: "BGR (Out of spec)",
-    GL.GL_BGRA: "BGRA (Out of spec)",
-}
+@functools.lru_cache(maxsize=None)
+def get_format_names() -> dict[int, str]:
+    """
+    Return the names of the OpenGL swapchain formats, the table is only built when needed as it requires PyOpenGL.
+    """
+
+    return {
+        GL.GL_COMPRESSED_R11_EAC: "COMPRESSED_R11_EAC",
+        GL.GL_COMPRESSED_RED_RGTC1: "COMPRESSED_RED_RGTC1",
+        GL.GL_COMPRESSED_RG_RGTC2: "COMPRESSED_RG_RGTC2",
+        GL.GL_COMPRESSED_RG11_EAC: "COMPRESSED_RG11_EAC",
+        GL.GL_COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT: "COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT",
+        GL.GL_COMPRESSED_RGB8_ETC2: "COMPRESSED_RGB8_ETC2",
+        GL.GL_COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2: "COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2",
+        GL.GL_COMPRESSED_RGBA8_ETC2_EAC: "COMPRESSED_RGBA8_ETC2_EAC",
+        GL.GL_COMPRESSED_SIGNED_R11_EAC: "COMPRESSED_SIGNED_R11_EAC",
+        GL.GL_COMPRESSED_SIGNED_RG11_EAC: "COMPRESSED_SIGNED_RG11_EAC",
+        GL.GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM: "COMPRESSED_SRGB_ALPHA_BPTC_UNORM",
+        GL.GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC: "COMPRESSED_SRGB8_ALPHA8_ETC2_EAC",
+        GL.GL_COMPRESSED_SRGB8_ETC2: "COMPRESSED_SRGB8_ETC2",
+        GL.GL_COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2: "COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2",
+        GL.GL_DEPTH_COMPONENT16: "DEPTH_COMPONENT16",
+        GL.GL_DEPTH_COMPONENT24: "DEPTH_COMPONENT24",
+        GL.GL_DEPTH_COMPONENT32: "DEPTH_COMPONENT32",
+        GL.GL_DEPTH_COMPONENT32F: "DEPTH_COMPONENT32F",
+        GL.GL_DEPTH24_STENCIL8: "DEPTH24_STENCIL8",
+        GL.GL_R11F_G11F_B10F: "R11F_G11F_B10F",
+        GL.GL_R16_SNORM: "R16_SNORM",
+        GL.GL_R16: "R16",
+        GL.GL_R16F: "R16F",
+        GL.GL_R16I: "R16I",
+        GL.GL_R16UI: "R16UI",
+        GL.GL_R32F: "R32F",
+        GL.GL_R32I: "R32I",
+        GL.GL_R32UI: "R32UI",
+        GL.GL_R8_SNORM: "R8_SNORM",
+        GL.GL_R8: "R8",
+        GL.GL_R8I: "R8I",
+        GL.GL_R8UI: "R8UI",
+        GL.GL_RG16_SNORM: "RG16_SNORM",
+        GL.GL_RG16: "RG16",
+        GL.GL_RG16F: "RG16F",
+        GL.GL_RG16I: "RG16I",
+        GL.GL_RG16UI: "RG16UI",
+        GL.GL_RG32F: "RG32F",
+        GL.GL_RG32I: "RG32I",
+        GL.GL_RG32UI: "RG32UI",
+        GL.GL_RG8_SNORM: "RG8_SNORM",
+        GL.GL_RG8: "RG8",
+        GL.GL_RG8I: "RG8I",
+        GL.GL_RG8UI: "RG8UI",
+        GL.GL_RGB10_A2: "RGB10_A2",
+        GL.GL_RGB8: "RGB8",
+        GL.GL_RGB9_E5: "RGB9_E5",
+        GL.GL_RGBA16_SNORM: "RGBA16_SNORM",
+        GL.GL_RGBA16: "RGBA16",
+        GL.GL_RGBA16F: "RGBA16F",
+        GL.GL_RGBA16I: "RGBA16I",
+        GL.GL_RGBA16UI: "RGBA16UI",
+        GL.GL_RGBA2: "RGBA2",
+        GL.GL_RGBA32F: "RGBA32F",
+        GL.GL_RGBA32I: "RGBA32I",
+        GL.GL_RGBA32UI: "RGBA32UI",
+        GL.GL_RGBA8_SNORM: "RGBA8_SNORM",
+        GL.GL_RGBA8: "RGBA8",
+        GL.GL_RGBA8I: "RGBA8I",
+        GL.GL_RGBA8UI: "RGBA8UI",
+        GL.GL_SRGB8_ALPHA8: "SRGB8_ALPHA8",
+        GL.GL_SRGB8: "SRGB8",
+        GL.GL_RGB16F: "RGB16F",
+        GL.GL_DEPTH32F_STENCIL8: "DEPTH32F_STENCIL8",
+        GL.GL_BGR: "BGR (Out of spec)",
+        GL.GL_BGRA: "BGRA (Out of spec)",
+    }
+
+
+# Maximum number of composition layers submitted in a frame
+MAX_LAYERS = 16
 
 
 class Session:
@@ -100,11 +106,27 @@ class Session:
         self.logger = logging.getLogger("session")
         self.handle = None
         self.system = system
+        self.backend = system.backend
         self.base = base
         self.state = xr.SessionState.IDLE
         self.frame_state = xr.FrameState()
+        # OpenXR allows only one frame between xrWaitFrame and xrBeginFrame, and a frame must be ended before the
+        # next one is begun
+        self.frame_waited = False
+        self.frame_begun = False
+        self.pacer: FramePacer = None
+        self.state_listeners: list[Callable[[xr.SessionState, xr.SessionState], None]] = []
+        # The structures used in the frame loop are allocated once and updated in place
+        self.frame_wait_info = xr.FrameWaitInfo()
+        self.frame_begin_info = xr.FrameBeginInfo()
+        self.frame_layers = (ctypes.POINTER(xr.CompositionLayerBaseHeader) * MAX_LAYERS)()
+        self.frame_end_info = xr.FrameEndInfo(environment_blend_mode=xr.EnvironmentBlendMode.OPAQUE,
+                                              layers=self.frame_layers)
         self.graphics_binding = None
-        if platform.system() == "Windows":
+        if self.backend.headless:
+            # The simulated runtimes do not use the OpenGL context
+            pass
+        elif platform.system() == "Windows":
             self.graphics_binding = xr.GraphicsBindingOpenGLWin32KHR()
             self.graphics_binding.h_dc = WGL.wglGetCurrentDC()
             self.graphics_binding.h_glrc = WGL.wglGetCurrentContext()
@@ -119,31 +141,45 @@ class Session:
             )
         else:
             raise NotImplementedError(f"Unsupported platform {platform.system()}")
-        graphics_binding_pointer = ctypes.cast(
-            ctypes.pointer(self.graphics_binding),
-            ctypes.c_void_p)
+        if self.graphics_binding is not None:
+            graphics_binding_pointer = ctypes.cast(
+                ctypes.pointer(self.graphics_binding),
+                ctypes.c_void_p)
+        else:
+            graphics_binding_pointer = None
         session_create_info = xr.SessionCreateInfo(
             next=graphics_binding_pointer,
             create_flags=xr.SessionCreateFlags(),
             system_id=system.handle,
         )
-        self.handle = xr.create_session(
+        self.handle = self.backend.create_session(
             system.instance.handle,
             session_create_info
         )
-        self.log_swapchain_formats()
-        self.log_reference_spaces()
 
     def destroy(self):
         if self.handle is not None:
             try:
-                xr.destroy_session(self.handle)
+                self.backend.destroy_session(self.handle)
             finally:
                 self.handle = None
                 self.system = None
 
     def get_supported_swapchain_formats(self):
-        return xr.enumerate_swapchain_formats(self.handle)
+        capabilities = self.system.instance.capabilities
+        if capabilities is None:
+            return self.backend.enumerate_swapchain_formats(self.handle)
+        if capabilities.swapchain_formats is None:
+            capabilities.set_swapchain_formats(self.backend.enumerate_swapchain_formats(self.handle))
+        return capabilities.swapchain_formats
+
+    def get_supported_reference_spaces(self):
+        capabilities = self.system.instance.capabilities
+        if capabilities is None:
+            return self.backend.enumerate_reference_spaces(self.handle)
+        if capabilities.reference_spaces is None:
+            capabilities.set_reference_spaces(self.backend.enumerate_reference_spaces(self.handle))
+        return capabilities.reference_spaces
 
     def session_active(self):
         return self.state in (
@@ -156,6 +192,16 @@ class Session:
     def should_render(self):
         return self.frame_state.should_render
 
+    def add_state_listener(self, listener: Callable[[xr.SessionState, xr.SessionState], None]) -> None:
+        """
+        Register a callable invoked with the old and new state each time the session state changes.
+        """
+
+        self.state_listeners.append(listener)
+
+    def remove_state_listener(self, listener: Callable[[xr.SessionState, xr.SessionState], None]) -> None:
+        self.state_listeners.remove(listener)
+
     def on_state_changed(self, session_state_changed_event):
         event = ctypes.cast(
             ctypes.byref(session_state_changed_event), ctypes.POINTER(xr.EventDataSessionStateChanged)).contents
@@ -172,18 +218,25 @@ class Session:
         if self.state == xr.SessionState.READY:
             if self.handle is not None:
                 sbi = xr.SessionBeginInfo(self.system.view_configuration_type)
-                xr.begin_session(self.handle, sbi)
+                self.backend.begin_session(self.handle, sbi)
         elif self.state == xr.SessionState.STOPPING:
-            xr.end_session(self.session)
+            self.frame_waited = False
+            self.frame_begun = False
+            if self.pacer is not None:
+                # Release the pacing thread if it is waiting for the end of the current frame
+                self.pacer.frame_ended()
+            self.backend.end_session(self.handle)
         elif self.state == xr.SessionState.EXITING:
             self.base.userExit()
         elif self.state == xr.SessionState.LOSS_PENDING:
             self.base.userExit()
+        for listener in self.state_listeners:
+            listener(old_state, self.state)
 
     def poll_xr_events(self):
         while True:
             try:
-                event_buffer = xr.poll_event(self.system.instance.handle)
+                event_buffer = self.backend.poll_event(self.system.instance.handle)
                 event_type = xr.StructureType(event_buffer.type)
                 if event_type == xr.StructureType.EVENT_DATA_EVENTS_LOST:
                     events_lost = ctypes.cast(event_buffer, ctypes.POINTER(xr.EventDataEventsLost))
@@ -202,34 +255,67 @@ class Session:
             except xr.EventUnavailable:
                 break
 
-    def wait_frame(self):
+    def wait_frame(self, frame_state: xr.FrameState = None):
+        """
+        Wait for the next frame, by default the result is written in self.frame_state.
+        """
+
         if not self.session_active():
             return
-        frame_wait_info = xr.FrameWaitInfo(None)
-        self.frame_state = xr.wait_frame(self.handle, frame_wait_info)
+        if self.frame_waited:
+            raise RuntimeError("xrWaitFrame called again before xrBeginFrame")
+        if frame_state is None:
+            frame_state = self.frame_state
+        self.backend.wait_frame_into(self.handle, self.frame_wait_info, frame_state)
+        self.frame_waited = True
 
     def begin_frame(self):
         if not self.session_active():
             return
-        frame_begin_info = xr.FrameBeginInfo()
-        xr.begin_frame(self.handle, frame_begin_info)
+        if not self.frame_waited:
+            raise RuntimeError("xrBeginFrame called without xrWaitFrame")
+        if self.frame_begun:
+            raise RuntimeError("xrBeginFrame called before the previous frame was ended")
+        self.backend.begin_frame(self.handle, self.frame_begin_info)
+        self.frame_waited = False
+        self.frame_begun = True
 
-    def end_frame(self, layer: ProjectionLayer):
-        if not self.session_active():
+    def cancel_frame(self):
+        """
+        Forget a frame that was waited for but will not be begun.
+        """
+
+        self.frame_waited = False
+
+    def end_frame(self, layers: LayerManager):
+        """
+        End the current frame and submit all the valid layers, in order.
+        """
+
+        if not self.session_active() or not self.frame_begun:
             return
-        layers = []
-        if self.should_render() and layer.layer_valid():
-            layers.append(ctypes.byref(layer.handle))
-        blend_mode = xr.EnvironmentBlendMode.OPAQUE
-        frame_end_info = xr.FrameEndInfo(
-            self.frame_state.predicted_display_time,
-            blend_mode,
-            layers=layers
-        )
-        xr.end_frame(self.handle, frame_end_info)
+        layer_count = 0
+        if self.should_render():
+            layer_count = layers.fill(self.frame_layers)
+        self.frame_end_info.display_time = self.frame_state.predicted_display_time
+        self.frame_end_info.layer_count = layer_count
+        try:
+            self.backend.end_frame(self.handle, self.frame_end_info)
+        finally:
+            self.frame_begun = False
+            if self.pacer is not None:
+                self.pacer.frame_ended()
+
+    def log_diagnostics(self):
+        """
+        Log the swapchain formats and the reference spaces supported by the runtime.
+        """
+
+        self.log_swapchain_formats()
+        self.log_reference_spaces()
 
     def log_reference_spaces(self):
-        spaces = xr.enumerate_reference_spaces(self.handle)
+        spaces = self.get_supported_reference_spaces()
         self.logger.info(f"Available reference spaces: {len(spaces)}")
         for space in spaces:
             self.logger.debug(f"  Name: {str(xr.ReferenceSpaceType(space))}")
@@ -237,4 +323,4 @@ class Session:
     def log_swapchain_formats(self) -> None:
         self.logger.debug("Swapchain Formats:")
         for sc_format in self.get_supported_swapchain_formats():
-            self.logger.debug(stringForFormat[sc_format])
+            self.logger.debug(get_format_names().get(sc_format, f"Unknown format {sc_format:#x}"))
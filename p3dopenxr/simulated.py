@@ -0,0 +1,665 @@
+from __future__ import annotations
+
+from collections import deque
+import ctypes
+import logging
+import math
+import time
+from typing import Callable, Optional, Tuple, TYPE_CHECKING
+import xr
+
+from .gl import GL
+
+if TYPE_CHECKING:
+    from .capabilities import RuntimeCapabilities
+
+
+Pose = Tuple[Tuple[float, float, float], Tuple[float, float, float, float]]
+
+QUAD_VIEWS = xr.ViewConfigurationType.PRIMARY_STEREO_WITH_FOVEATED_INSET
+
+
+def yaw_quaternion(angle: float) -> tuple[float, float, float, float]:
+    """
+    Return the quaternion (x, y, z, w) of a rotation around the OpenXR vertical axis.
+    """
+
+    return (0.0, math.sin(angle / 2), 0.0, math.cos(angle / 2))
+
+
+def rotate_vector(quat: tuple[float, float, float, float], vector: tuple[float, float, float]):
+    qx, qy, qz, qw = quat
+    vx, vy, vz = vector
+    # t = 2 * cross(q.xyz, v)
+    tx = 2 * (qy * vz - qz * vy)
+    ty = 2 * (qz * vx - qx * vz)
+    tz = 2 * (qx * vy - qy * vx)
+    # v + w * t + cross(q.xyz, t)
+    return (
+        vx + qw * tx + (qy * tz - qz * ty),
+        vy + qw * ty + (qz * tx - qx * tz),
+        vz + qw * tz + (qx * ty - qy * tx),
+    )
+
+
+def default_hand_joints() -> list[tuple[float, float, float]]:
+    """
+    Offsets of the 26 joints of a flat right hand relative to its grip pose, in the order of
+    XR_HAND_JOINT_SET_DEFAULT_EXT, the fingers point toward -Z.
+    """
+
+    joints = [(0.0, 0.0, -0.05), (0.0, 0.0, 0.0)]
+    joints += [(-0.02, 0.0, -0.02), (-0.035, 0.0, -0.04), (-0.045, 0.0, -0.06), (-0.05, 0.0, -0.075)]
+    for finger in range(4):
+        x = -0.02 + 0.013 * finger
+        joints += [(x, 0.0, z) for z in (-0.03, -0.08, -0.115, -0.14, -0.16)]
+    return joints
+
+
+def multiply_quaternions(a: tuple[float, float, float, float], b: tuple[float, float, float, float]):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz,
+    )
+
+
+def default_head_pose(t: float) -> Pose:
+    """
+    Standing user slowly looking around.
+    """
+
+    position = (0.05 * math.sin(t), 1.6 + 0.02 * math.sin(2 * t), 0.0)
+    return position, yaw_quaternion(0.3 * math.sin(0.5 * t))
+
+
+def default_hand_pose(hand: int, t: float) -> Optional[Pose]:
+    """
+    Hands held in front of the user, slightly moving.
+    """
+
+    side = -1 if hand == 0 else 1
+    position = (side * 0.2, 1.2 + 0.05 * math.sin(t + hand), -0.4)
+    return position, (0.0, 0.0, 0.0, 1.0)
+
+
+class SimulatedBackend:
+    """
+    Pure Python stand-in for an OpenXR runtime.
+
+    It implements the subset of the pyopenxr API used by the wrapper classes and produces scripted view poses,
+    field of views, display time pacing, session state transitions and controller poses. It does not use the
+    OpenGL context, the swapchain images are not actual textures and the rendering is skipped.
+
+    The head and hand poses are given by callables taking the elapsed display time in seconds and returning
+    the position and orientation (x, y, z, w) in the OpenXR coordinate system. A hand is not tracked when its
+    callable returns None. If eye_gaze is given, XR_EXT_eye_gaze_interaction is supported and the callable returns
+    the orientation of the gaze relative to the head, or None when the gaze is not tracked.
+
+    If inset_size is given, the system also supports the quad view configuration of XR_VARJO_quad_views : the left
+    and right views, then a left and a right inset view of inset_size pixels, with the pose of the eye and the
+    narrower inset_fov.
+
+    If realtime is True, wait_frame() blocks until the next vsync of the simulated display, a late frame has to
+    wait for the following one. If realtime is False, wait_frame() returns immediately and the display time
+    advances by one display period each frame, which gives a deterministic frame loop running as fast as possible.
+
+    If capabilities is given, the runtime reproduces the runtime and the headset captured in the snapshot : its
+    names and version, extensions, views, swapchain formats and reference spaces.
+    """
+
+    headless = True
+
+    def __init__(
+            self,
+            display_rate: float = 90.0,
+            realtime: bool = True,
+            nb_views: int = 2,
+            view_size: tuple[int, int] = (1440, 1600),
+            max_view_size: tuple[int, int] = (2880, 3200),
+            ipd: float = 0.064,
+            fov: tuple[float, float, float, float] = (-0.785, 0.698, 0.785, -0.785),
+            head_pose: Callable[[float], Pose] = default_head_pose,
+            hand_pose: Callable[[int, float], Optional[Pose]] = default_hand_pose,
+            eye_gaze: Optional[Callable[[float], Optional[tuple[float, float, float, float]]]] = None,
+            inset_size: Optional[tuple[int, int]] = None,
+            inset_fov: tuple[float, float, float, float] = (-0.35, 0.35, 0.35, -0.35),
+            runtime_name: str = "p3dopenxr simulated runtime",
+            runtime_version: xr.Version = xr.Version(1, 0, 0),
+            capabilities: RuntimeCapabilities = None,
+    ) -> None:
+        self.logger = logging.getLogger("simulated")
+        self.display_period = int(1e9 / display_rate)
+        self.realtime = realtime
+        self.nb_views = nb_views
+        self.view_size = view_size
+        self.max_view_size = max_view_size
+        self.ipd = ipd
+        # Angles left, right, up, down
+        self.fov = fov
+        self.head_pose = head_pose
+        self.hand_pose = hand_pose
+        self.eye_gaze = eye_gaze
+        self.inset_size = inset_size
+        self.inset_fov = inset_fov
+        self.runtime_name = runtime_name
+        self.runtime_version = runtime_version
+        self.system_name = runtime_name
+        self.max_layer_count = 16
+        # Recommended and maximum sample counts of the views
+        self.sample_counts = (1, 4)
+        self.extensions = [
+            xr.KHR_OPENGL_ENABLE_EXTENSION_NAME,
+            xr.KHR_LOCATE_SPACES_EXTENSION_NAME,
+            xr.KHR_COMPOSITION_LAYER_CYLINDER_EXTENSION_NAME,
+            xr.KHR_COMPOSITION_LAYER_DEPTH_EXTENSION_NAME,
+        ]
+        if eye_gaze is not None:
+            self.extensions.append(xr.EXT_EYE_GAZE_INTERACTION_EXTENSION_NAME)
+        self.extensions.append(xr.EXT_HAND_TRACKING_EXTENSION_NAME)
+        if inset_size is not None:
+            self.extensions.append(xr.VARJO_QUAD_VIEWS_EXTENSION_NAME)
+        # Hand index of each hand tracker
+        self.hand_trackers: dict[int, int] = {}
+        self.hand_joints = default_hand_joints()
+        self.swapchain_formats = [GL.GL_SRGB8_ALPHA8, GL.GL_SRGB8, GL.GL_RGBA8, GL.GL_RGBA16F, GL.GL_RGB16F,
+                                  GL.GL_R11F_G11F_B10F, GL.GL_DEPTH_COMPONENT24, GL.GL_DEPTH_COMPONENT32F]
+        self.reference_space_types = [
+            xr.ReferenceSpaceType.VIEW.value,
+            xr.ReferenceSpaceType.LOCAL.value,
+            xr.ReferenceSpaceType.STAGE.value,
+        ]
+        self.nb_swapchain_images = 3
+        if capabilities is not None:
+            self.replay(capabilities)
+
+        self.next_handle = 1
+        self.paths: dict[str, int] = {}
+        self.session = None
+        self.session_state = xr.SessionState.UNKNOWN
+        self.exit_requested = False
+        self.events: deque = deque()
+        self.swapchains: dict[int, list[int]] = {}
+        self.reference_spaces: dict[int, xr.ReferenceSpaceType] = {}
+        # Action and hand index of each action space
+        self.action_spaces: dict[int, tuple[int, int]] = {}
+        self.action_names: dict[int, str] = {}
+        # Actions bound to the eye gaze pose
+        self.gaze_actions: set[int] = set()
+        # Scripted input values and values seen at the last sync, keyed by action name and subaction path
+        self.input_values: dict[tuple[str, str], object] = {}
+        self.synced_values: dict[tuple[str, str], tuple[object, bool, int]] = {}
+        self.haptic_feedbacks: list[tuple[str, str, float, int, float]] = []
+
+        self.start_time = time.monotonic_ns()
+        self.display_time = self.start_time
+        self.next_deadline = None
+        self.frame_count = 0
+        self.submitted_layers = 0
+        self.submitted_depth_views = 0
+
+    def replay(self, capabilities: RuntimeCapabilities) -> None:
+        """
+        Reproduce the runtime and the system described by the snapshot, only the primary stereo and the quad view
+        configurations are supported and all the views of a kind are supposed to have the size of the first one.
+        """
+
+        self.runtime_name = capabilities.runtime_name
+        self.runtime_version = xr.Version(capabilities.runtime_version)
+        if capabilities.extensions is not None:
+            self.extensions = list(capabilities.extensions)
+        if capabilities.system_name is not None:
+            self.system_name = capabilities.system_name
+            self.max_layer_count = capabilities.max_layer_count
+        views = capabilities.get_views(xr.ViewConfigurationType.PRIMARY_STEREO.value)
+        if views:
+            self.nb_views = len(views)
+            self.view_size = (views[0].recommended_image_rect_width, views[0].recommended_image_rect_height)
+            self.max_view_size = (views[0].max_image_rect_width, views[0].max_image_rect_height)
+            self.sample_counts = (views[0].recommended_swapchain_sample_count, views[0].max_swapchain_sample_count)
+        quad_views = capabilities.get_views(QUAD_VIEWS.value)
+        if quad_views and len(quad_views) == 4:
+            self.inset_size = (quad_views[2].recommended_image_rect_width, quad_views[2].recommended_image_rect_height)
+        if capabilities.swapchain_formats is not None:
+            self.swapchain_formats = list(capabilities.swapchain_formats)
+        if capabilities.reference_spaces is not None:
+            self.reference_space_types = list(capabilities.reference_spaces)
+
+    def __getattr__(self, name):
+        raise AttributeError(f"{name}() is not supported by the simulated runtime")
+
+    def create_handle(self, handle_type):
+        handle = ctypes.cast(ctypes.c_void_p(self.next_handle), handle_type)
+        self.next_handle += 1
+        return handle
+
+    @staticmethod
+    def handle_value(handle) -> int:
+        return ctypes.cast(handle, ctypes.c_void_p).value
+
+    def elapsed(self, display_time: int) -> float:
+        return (display_time - self.start_time) / 1e9
+
+    @staticmethod
+    def make_pose(pose: Pose) -> xr.Posef:
+        position, orientation = pose
+        return xr.Posef(orientation=xr.Quaternionf(*orientation), position=xr.Vector3f(*position))
+
+    # Scripting
+
+    def queue_state(self, state: xr.SessionState) -> None:
+        """
+        Queue a session state transition, it will be reported by the next poll_event().
+        """
+
+        self.events.append(state)
+
+    def set_input(self, action_name: str, subaction_path: str, value) -> None:
+        """
+        Set the current value of an input action, a bool, a float or a (x, y) tuple according to its type.
+        The change is reported at the next sync_actions().
+        """
+
+        self.input_values[(action_name, subaction_path)] = value
+
+    def user_exit(self) -> None:
+        """
+        Simulate the user quitting the application from the runtime.
+        """
+
+        self.request_exit_session(self.session)
+
+    # Instance
+
+    def enumerate_instance_extension_properties(self, layer_name=None):
+        if layer_name is not None:
+            return []
+        return [xr.ExtensionProperties(extension_name=name, extension_version=1) for name in self.extensions]
+
+    def enumerate_api_layer_properties(self):
+        return []
+
+    def create_instance(self, create_info):
+        return self.create_handle(xr.Instance)
+
+    def destroy_instance(self, instance):
+        pass
+
+    def get_instance_properties(self, instance):
+        return xr.InstanceProperties(runtime_version=self.runtime_version, runtime_name=self.runtime_name)
+
+    # System
+
+    def get_system(self, instance, get_info):
+        return xr.SystemId(1)
+
+    def get_system_properties(self, instance, system_id):
+        properties = xr.SystemProperties()
+        properties.system_id = system_id
+        properties.system_name = self.system_name.encode()
+        properties.graphics_properties.max_swapchain_image_width = self.max_view_size[0]
+        properties.graphics_properties.max_swapchain_image_height = self.max_view_size[1]
+        properties.graphics_properties.max_layer_count = self.max_layer_count
+        properties.tracking_properties.orientation_tracking = True
+        properties.tracking_properties.position_tracking = True
+        return properties
+
+    def is_quad_views(self, view_configuration_type) -> bool:
+        return self.inset_size is not None and int(view_configuration_type) == QUAD_VIEWS.value
+
+    def get_view_count(self, view_configuration_type) -> int:
+        return 4 if self.is_quad_views(view_configuration_type) else self.nb_views
+
+    def enumerate_view_configurations(self, instance, system_id):
+        if self.inset_size is not None:
+            return [xr.ViewConfigurationType.PRIMARY_STEREO.value, QUAD_VIEWS.value]
+        return [xr.ViewConfigurationType.PRIMARY_STEREO.value]
+
+    def get_view_configuration_properties(self, instance, system_id, view_configuration_type):
+        return xr.ViewConfigurationProperties(view_configuration_type=view_configuration_type, fov_mutable=True)
+
+    def enumerate_view_configuration_views(self, instance, system_id, view_configuration_type):
+        views = []
+        for i in range(self.get_view_count(view_configuration_type)):
+            size = self.inset_size if i >= 2 else self.view_size
+            views.append(xr.ViewConfigurationView(
+                recommended_image_rect_width=size[0],
+                max_image_rect_width=max(size[0], self.max_view_size[0]),
+                recommended_image_rect_height=size[1],
+                max_image_rect_height=max(size[1], self.max_view_size[1]),
+                recommended_swapchain_sample_count=self.sample_counts[0],
+                max_swapchain_sample_count=self.sample_counts[1],
+            ))
+        return views
+
+    def enumerate_environment_blend_modes(self, instance, system_id, view_configuration_type):
+        return [xr.EnvironmentBlendMode.OPAQUE.value]
+
+    def get_opengl_graphics_requirements(self, instance, system_id):
+        return xr.GraphicsRequirementsOpenGLKHR()
+
+    # Session
+
+    def create_session(self, instance, create_info):
+        self.session = self.create_handle(xr.Session)
+        self.session_state = xr.SessionState.IDLE
+        self.queue_state(xr.SessionState.IDLE)
+        self.queue_state(xr.SessionState.READY)
+        return self.session
+
+    def destroy_session(self, session):
+        self.session = None
+
+    def begin_session(self, session, begin_info):
+        self.queue_state(xr.SessionState.SYNCHRONIZED)
+        self.queue_state(xr.SessionState.VISIBLE)
+        self.queue_state(xr.SessionState.FOCUSED)
+
+    def request_exit_session(self, session):
+        self.exit_requested = True
+        if self.session_state == xr.SessionState.FOCUSED:
+            self.queue_state(xr.SessionState.VISIBLE)
+        self.queue_state(xr.SessionState.SYNCHRONIZED)
+        self.queue_state(xr.SessionState.STOPPING)
+
+    def end_session(self, session):
+        self.queue_state(xr.SessionState.IDLE)
+        if self.exit_requested:
+            self.queue_state(xr.SessionState.EXITING)
+
+    def poll_event(self, instance):
+        if not self.events:
+            raise xr.EventUnavailable()
+        self.session_state = self.events.popleft()
+        event = xr.EventDataSessionStateChanged(
+            session=self.session,
+            state=self.session_state,
+            time=self.display_time,
+        )
+        event_buffer = xr.EventDataBuffer()
+        ctypes.memmove(ctypes.byref(event_buffer), ctypes.byref(event), ctypes.sizeof(event))
+        return event_buffer
+
+    def enumerate_swapchain_formats(self, session):
+        return list(self.swapchain_formats)
+
+    def enumerate_reference_spaces(self, session):
+        return list(self.reference_space_types)
+
+    # Frame loop
+
+    def wait_frame(self, session, frame_wait_info=None):
+        frame_state = xr.FrameState()
+        self.wait_frame_into(session, frame_wait_info, frame_state)
+        return frame_state
+
+    def wait_frame_into(self, session, frame_wait_info, frame_state):
+        if self.realtime:
+            now = time.perf_counter()
+            period = self.display_period / 1e9
+            if self.next_deadline is None:
+                self.next_deadline = now
+            elif self.next_deadline < now:
+                # Like an actual compositor, a late frame has to wait for the next vsync
+                self.next_deadline += math.ceil((now - self.next_deadline) / period) * period
+            if self.next_deadline > now:
+                time.sleep(self.next_deadline - now)
+            self.next_deadline += period
+        self.display_time += self.display_period
+        frame_state.predicted_display_time = self.display_time
+        frame_state.predicted_display_period = self.display_period
+        frame_state.should_render = self.session_state in (xr.SessionState.VISIBLE, xr.SessionState.FOCUSED)
+
+    def begin_frame(self, session, frame_begin_info=None):
+        pass
+
+    def end_frame(self, session, frame_end_info):
+        self.frame_count += 1
+        self.submitted_layers += frame_end_info.layer_count
+        for i in range(frame_end_info.layer_count):
+            header = frame_end_info.layers[i].contents
+            if header.type != xr.StructureType.COMPOSITION_LAYER_PROJECTION:
+                continue
+            layer = ctypes.cast(frame_end_info.layers[i], ctypes.POINTER(xr.CompositionLayerProjection)).contents
+            for view in layer.views:
+                if view.next is None:
+                    continue
+                depth_info = ctypes.cast(view.next, ctypes.POINTER(xr.CompositionLayerDepthInfoKHR)).contents
+                if (depth_info.type == xr.StructureType.COMPOSITION_LAYER_DEPTH_INFO_KHR and
+                        depth_info.sub_image.swapchain and depth_info.near_z < depth_info.far_z):
+                    self.submitted_depth_views += 1
+
+    def locate_views(self, session, view_locate_info):
+        view_state = xr.ViewState()
+        views = (xr.View * self.get_view_count(view_locate_info.view_configuration_type))()
+        self.locate_views_into(session, view_locate_info, view_state, views, ctypes.c_uint32())
+        return view_state, views
+
+    def locate_views_into(self, session, view_locate_info, view_state, views, view_count):
+        position, orientation = self.head_pose(self.elapsed(view_locate_info.display_time))
+        nb_views = self.get_view_count(view_locate_info.view_configuration_type)
+        for i in range(min(nb_views, len(views))):
+            # The inset views share the pose of the left and right views
+            eye = i % self.nb_views
+            offset = (eye - (self.nb_views - 1) / 2) * self.ipd
+            eye_offset = rotate_vector(orientation, (offset, 0.0, 0.0))
+            eye_position = tuple(p + o for p, o in zip(position, eye_offset))
+            left, right, up, down = self.inset_fov if i >= self.nb_views else self.fov
+            views[i].pose = self.make_pose((eye_position, orientation))
+            views[i].fov = xr.Fovf(angle_left=left, angle_right=right, angle_up=up, angle_down=down)
+        view_state.view_state_flags = xr.VIEW_STATE_POSITION_VALID_BIT | xr.VIEW_STATE_ORIENTATION_VALID_BIT
+        view_count.value = nb_views
+        return nb_views
+
+    # Swapchains
+
+    def create_swapchain(self, session, create_info):
+        handle = self.create_handle(xr.Swapchain)
+        self.swapchains[self.handle_value(handle)] = [0, -1]
+        return handle
+
+    def destroy_swapchain(self, swapchain):
+        self.swapchains.pop(self.handle_value(swapchain), None)
+
+    def enumerate_swapchain_images(self, swapchain, element_type):
+        return (element_type * self.nb_swapchain_images)()
+
+    def acquire_swapchain_image(self, swapchain, acquire_info=None):
+        return self.acquire_swapchain_image_into(swapchain, acquire_info, ctypes.c_uint32())
+
+    def acquire_swapchain_image_into(self, swapchain, acquire_info, index):
+        state = self.swapchains[self.handle_value(swapchain)]
+        index.value = state[0]
+        state[0] = (index.value + 1) % self.nb_swapchain_images
+        state[1] = index.value
+        return index.value
+
+    def wait_swapchain_image(self, swapchain, wait_info):
+        pass
+
+    def release_swapchain_image(self, swapchain, release_info=None):
+        pass
+
+    # Spaces
+
+    def create_reference_space(self, session, create_info):
+        handle = self.create_handle(xr.Space)
+        self.reference_spaces[self.handle_value(handle)] = xr.ReferenceSpaceType(create_info.reference_space_type)
+        return handle
+
+    def destroy_space(self, space):
+        self.reference_spaces.pop(self.handle_value(space), None)
+        self.action_spaces.pop(self.handle_value(space), None)
+
+    def locate_space(self, space, base_space, time):
+        location = xr.SpaceLocation()
+        self.locate_space_into(space, base_space, time, location)
+        return location
+
+    def locate_space_into(self, space, base_space, time, location):
+        key = self.handle_value(space)
+        pose = None
+        if key in self.action_spaces:
+            action, hand = self.action_spaces[key]
+            # The bindings are only known once the action set is attached
+            if action in self.gaze_actions:
+                pose = self.gaze_pose(self.elapsed(time))
+            else:
+                pose = self.hand_pose(hand, self.elapsed(time))
+        elif self.reference_spaces.get(key) == xr.ReferenceSpaceType.VIEW:
+            pose = self.head_pose(self.elapsed(time))
+        else:
+            pose = ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))
+        if pose is None:
+            location.location_flags = 0
+            return
+        location.location_flags = (
+            xr.SPACE_LOCATION_POSITION_VALID_BIT | xr.SPACE_LOCATION_ORIENTATION_VALID_BIT |
+            xr.SPACE_LOCATION_POSITION_TRACKED_BIT | xr.SPACE_LOCATION_ORIENTATION_TRACKED_BIT)
+        location.pose = self.make_pose(pose)
+
+    def locate_spaces_into(self, instance, session, locate_info, space_locations):
+        location = xr.SpaceLocation()
+        for i in range(locate_info.space_count):
+            self.locate_space_into(locate_info.spaces[i], locate_info.base_space, locate_info.time, location)
+            space_locations.locations[i].location_flags = location.location_flags
+            space_locations.locations[i].pose = location.pose
+
+    # Actions
+
+    def string_to_path(self, instance, path_string):
+        if path_string not in self.paths:
+            self.paths[path_string] = len(self.paths) + 1
+        return xr.Path(self.paths[path_string])
+
+    def path_to_string(self, instance, path):
+        value = path.value if isinstance(path, xr.Path) else path
+        for path_string, path_value in self.paths.items():
+            if path_value == value:
+                return path_string
+        raise xr.PathInvalidError()
+
+    def create_action_set(self, instance, create_info):
+        return self.create_handle(xr.ActionSet)
+
+    def destroy_action_set(self, action_set):
+        pass
+
+    def create_action(self, action_set, create_info):
+        handle = self.create_handle(xr.Action)
+        self.action_names[self.handle_value(handle)] = create_info.action_name.decode()
+        return handle
+
+    def suggest_interaction_profile_bindings(self, instance, suggested_bindings):
+        for i in range(suggested_bindings.count_suggested_bindings):
+            binding = suggested_bindings.suggested_bindings[i]
+            if self.path_to_string(instance, binding.binding).startswith("/user/eyes_ext/"):
+                self.gaze_actions.add(self.handle_value(binding.action))
+
+    def gaze_pose(self, t: float) -> Optional[Pose]:
+        if self.eye_gaze is None:
+            return None
+        gaze = self.eye_gaze(t)
+        if gaze is None:
+            return None
+        position, orientation = self.head_pose(t)
+        return position, multiply_quaternions(orientation, gaze)
+
+    def subaction_string(self, path) -> Optional[str]:
+        return self.path_to_string(None, path) if path else None
+
+    def hand_index(self, path) -> int:
+        subaction_path = self.subaction_string(path)
+        return 1 if subaction_path is not None and subaction_path.endswith('right') else 0
+
+    def create_hand_tracker_ext(self, session, create_info):
+        handle = self.create_handle(xr.HandTrackerEXT)
+        self.hand_trackers[self.handle_value(handle)] = 1 if create_info.hand == xr.HandEXT.RIGHT else 0
+        return handle
+
+    def destroy_hand_tracker_ext(self, hand_tracker):
+        self.hand_trackers.pop(self.handle_value(hand_tracker), None)
+
+    def locate_hand_joints_into(self, hand_tracker, locate_info, locations):
+        """
+        The joints of a flat hand follow the hand pose, the left hand is the mirror of the right one.
+        """
+
+        hand = self.hand_trackers[self.handle_value(hand_tracker)]
+        pose = self.hand_pose(hand, self.elapsed(locate_info.time))
+        locations.is_active = pose is not None
+        if pose is None:
+            return
+        position, orientation = pose
+        side = 1 if hand == 1 else -1
+        flags = (
+            xr.SPACE_LOCATION_POSITION_VALID_BIT | xr.SPACE_LOCATION_ORIENTATION_VALID_BIT |
+            xr.SPACE_LOCATION_POSITION_TRACKED_BIT | xr.SPACE_LOCATION_ORIENTATION_TRACKED_BIT)
+        for i, (x, y, z) in enumerate(self.hand_joints):
+            offset = rotate_vector(orientation, (side * x, y, z))
+            location = locations._joint_locations[i]
+            location.location_flags = flags
+            location.pose = xr.Posef(
+                orientation=xr.Quaternionf(*orientation),
+                position=xr.Vector3f(*(p + o for p, o in zip(position, offset))))
+            location.radius = 0.01
+
+    def create_action_space(self, session, create_info):
+        handle = self.create_handle(xr.Space)
+        self.action_spaces[self.handle_value(handle)] = (
+            self.handle_value(create_info.action), self.hand_index(create_info.subaction_path))
+        return handle
+
+    def attach_session_action_sets(self, session, attach_info):
+        pass
+
+    def sync_actions(self, session, sync_info):
+        for key, value in self.input_values.items():
+            previous = self.synced_values.get(key)
+            if previous is None or previous[0] != value:
+                self.synced_values[key] = (value, True, self.display_time)
+            elif previous[1]:
+                self.synced_values[key] = (value, False, previous[2])
+
+    def get_input_state(self, get_info, state, default) -> None:
+        action_name = self.action_names[self.handle_value(get_info.action)]
+        subaction_path = self.subaction_string(get_info.subaction_path)
+        value, changed, change_time = self.synced_values.get((action_name, subaction_path), (default, False, 0))
+        state.is_active = (action_name, subaction_path) in self.synced_values
+        state.changed_since_last_sync = changed
+        state.last_change_time = change_time
+        return value
+
+    def get_action_state_boolean_into(self, session, get_info, state):
+        state.current_state = self.get_input_state(get_info, state, False)
+
+    def get_action_state_float_into(self, session, get_info, state):
+        state.current_state = self.get_input_state(get_info, state, 0.0)
+
+    def get_action_state_vector2f_into(self, session, get_info, state):
+        state.current_state = xr.Vector2f(*self.get_input_state(get_info, state, (0.0, 0.0)))
+
+    def apply_haptic_feedback(self, session, haptic_action_info, haptic_feedback):
+        vibration = ctypes.cast(ctypes.byref(haptic_feedback), ctypes.POINTER(xr.HapticVibration)).contents
+        self.haptic_feedbacks.append((
+            self.action_names[self.handle_value(haptic_action_info.action)],
+            self.subaction_string(haptic_action_info.subaction_path),
+            vibration.amplitude, vibration.duration, vibration.frequency))
+
+    def stop_haptic_feedback(self, session, haptic_action_info):
+        pass
+
+    def get_action_state_pose(self, session, get_info):
+        state = xr.ActionStatePose()
+        self.get_action_state_pose_into(session, get_info, state)
+        return state
+
+    def get_action_state_pose_into(self, session, get_info, state):
+        if self.handle_value(get_info.action) in self.gaze_actions:
+            state.is_active = self.gaze_pose(self.elapsed(self.display_time)) is not None
+            return
+        hand = self.hand_index(get_info.subaction_path)
+        state.is_active = self.hand_pose(hand, self.elapsed(self.display_time)) is not None
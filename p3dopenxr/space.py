@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import ctypes
+from typing import Sequence, TYPE_CHECKING
 import xr
 
 if TYPE_CHECKING:
@@ -13,8 +14,9 @@ class Space:
             session: Session,
             reference_space_type: str = "Stage"
     ):
+        self.backend = session.backend
         reference_space_create_info = self.get_xr_reference_space_create_info(reference_space_type)
-        self.handle = xr.create_reference_space(session.handle, reference_space_create_info)
+        self.handle = self.backend.create_reference_space(session.handle, reference_space_create_info)
 
     def get_xr_reference_space_create_info(self, reference_space_type: str) -> xr.ReferenceSpaceCreateInfo:
         create_info = xr.ReferenceSpaceCreateInfo(
@@ -32,5 +34,64 @@ class Space:
 
     def destroy(self):
         if self.handle is not None:
-            xr.destroy_space(self.handle)
+            self.backend.destroy_space(self.handle)
             self.handle = None
+
+
+class SpaceLocator:
+    """
+    Locate a set of spaces relative to a base space in a single runtime call.
+
+    xrLocateSpaces (OpenXR 1.1 or XR_KHR_locate_spaces) is used when the runtime supports it, otherwise each
+    space is located with xrLocateSpace. In both cases the locations are stored in one contiguous array of
+    SpaceLocationData, which can also be accessed as NumPy arrays using flags, orientations and positions.
+    """
+
+    def __init__(self, session: Session, base_space: Space, spaces: Sequence[xr.Space]):
+        self.session = session
+        self.backend = session.backend
+        self.instance = session.system.instance
+        self.base_space = base_space
+        self.spaces = (xr.Space * len(spaces))(*spaces)
+        self.count = len(spaces)
+        self.locations = (xr.SpaceLocationData * self.count)()
+        self.locate_info = xr.SpacesLocateInfo(
+            base_space=base_space.handle, time=0, space_count=self.count, spaces=self.spaces)
+        self.space_locations = xr.SpaceLocations(location_count=self.count, locations=self.locations)
+        self.batched = (
+            self.instance.api_version >= xr.Version(1, 1, 0) or
+            xr.KHR_LOCATE_SPACES_EXTENSION_NAME in self.instance.enabled_extensions)
+        if not self.batched:
+            self.space_location = xr.SpaceLocation()
+
+    def locate(self, time: int) -> ctypes.Array:
+        """
+        Locate all the spaces at the given time and return the array of locations.
+        """
+
+        if self.batched:
+            self.locate_info.time = time
+            self.backend.locate_spaces_into(
+                self.instance.handle, self.session.handle, self.locate_info, self.space_locations)
+        else:
+            space_location = self.space_location
+            base_space = self.base_space.handle
+            for space, location in zip(self.spaces, self.locations):
+                self.backend.locate_space_into(space, base_space, time, space_location)
+                location.location_flags = space_location.location_flags
+                location.pose = space_location.pose
+        return self.locations
+
+    def as_arrays(self):
+        """
+        Return NumPy views, sharing the memory of the locations array, on the location flags, the orientations
+        (x, y, z, w) and the positions of all the spaces.
+        """
+
+        import numpy as np
+
+        raw = (ctypes.c_char * ctypes.sizeof(self.locations)).from_buffer(self.locations)
+        stride = ctypes.sizeof(xr.SpaceLocationData)
+        flags = np.frombuffer(raw, dtype=np.uint64).reshape(self.count, stride // 8)[:, 0]
+        floats = np.frombuffer(raw, dtype=np.float32).reshape(self.count, stride // 4)
+        return flags, floats[:, 2:6], floats[:, 6:9]
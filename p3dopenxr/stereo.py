@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import logging
+import math
+from panda3d.core import LMatrix4, LVector3, NodePath, PTA_LMatrix4f
+
+from .gl import GL, LazyModule
+from .projection_view import ProjectionView
+
+OVR_multiview = LazyModule('OpenGL.GL.OVR.multiview')
+
+
+MULTIVIEW_VERTEX_HEADER = """
+#extension GL_OVR_multiview2 : require
+layout(num_views = {nb_views}) in;
+uniform mat4 xr_view_projection[{nb_views}];
+#define XR_VIEW_ID int(gl_ViewID_OVR)
+#define XR_SET_LAYER()
+"""
+
+INSTANCED_VERTEX_HEADER = """
+#extension GL_ARB_shader_viewport_layer_array : require
+uniform mat4 xr_view_projection[{nb_views}];
+#define XR_VIEW_ID (gl_InstanceID % {nb_views})
+#define XR_SET_LAYER() gl_Layer = XR_VIEW_ID
+"""
+
+
+class StereoRenderer:
+    """
+    Render all the views in a single pass into a texture array swapchain.
+
+    Two modes are supported :
+
+    * 'multiview' uses GL_OVR_multiview, the driver broadcasts each draw call to all the layers.
+    * 'instanced' is the fallback when multiview is not available, each object is drawn once per view
+      using hardware instancing and the vertex shader selects the target layer.
+
+    In both cases the scene is culled once using a camera whose frustum encloses all the views, and the
+    shaders must use the view-projection matrices provided in the xr_view_projection shader input
+    instead of the Panda3D camera matrices. Use get_vertex_header() to retrieve the GLSL declarations.
+    """
+
+    def __init__(self, nb_views: int, mode: str = None):
+        self.logger = logging.getLogger("stereo")
+        if mode is None:
+            mode = self.detect_mode()
+        if mode not in ('multiview', 'instanced'):
+            raise ValueError(f"Unknown stereo mode '{mode}'")
+        self.mode = mode
+        self.nb_views = nb_views
+        self.view_projections = PTA_LMatrix4f.empty_array(nb_views)
+        self.depth_texture = None
+        self.depth_size = None
+        self.cull_key: tuple = None
+        self.logger.info(f"Single pass stereo rendering using {mode} mode")
+
+    @staticmethod
+    def detect_mode() -> str:
+        """
+        Select multiview if the current OpenGL context supports it, instanced stereo otherwise.
+        """
+
+        try:
+            if OVR_multiview.glInitMultiviewOVR():
+                return 'multiview'
+        except ImportError:
+            pass
+        return 'instanced'
+
+    def get_vertex_header(self) -> str:
+        """
+        Return the GLSL declarations to insert after the #version line of the vertex shaders.
+        """
+
+        if self.mode == 'multiview':
+            header = MULTIVIEW_VERTEX_HEADER
+        else:
+            header = INSTANCED_VERTEX_HEADER
+        return header.format(nb_views=self.nb_views)
+
+    def setup_scene(self, root: NodePath) -> None:
+        root.set_shader_input('xr_view_projection', self.view_projections)
+        if self.mode == 'instanced':
+            root.set_instance_count(self.nb_views)
+
+    def update_view_projections(self, cams: list[NodePath]) -> None:
+        """
+        Update the world to clip space matrix of each view from the eye cameras.
+        """
+
+        for i, cam in enumerate(cams):
+            view_mat = LMatrix4(cam.get_net_transform().get_mat())
+            view_mat.invert_in_place()
+            self.view_projections[i] = view_mat * cam.node().get_lens().get_projection_mat()
+
+    def update_cull_camera(
+            self, cull_cam: NodePath, views: list[ProjectionView], cams: list[NodePath],
+            near: float, far: float) -> None:
+        """
+        Configure the culling camera so that its frustum encloses the frustum of every view.
+
+        The camera is placed between the eyes and pulled back until the combined field of view covers
+        both eye frusta, the near and far planes are moved accordingly.
+        """
+
+        tan_left = min(math.tan(view.fov.angle_left) for view in views)
+        tan_right = max(math.tan(view.fov.angle_right) for view in views)
+        tan_down = min(math.tan(view.fov.angle_down) for view in views)
+        tan_up = max(math.tan(view.fov.angle_up) for view in views)
+        first = cams[0].get_pos()
+        last = cams[-1].get_pos()
+        center = (first + last) * 0.5
+        half_distance = (last - first).length() * 0.5
+        pull_back = half_distance / max(min(tan_right, -tan_left), 1e-6)
+        quat = cams[0].get_quat()
+        cull_cam.set_quat(quat)
+        cull_cam.set_pos(center - quat.xform(LVector3.forward()) * pull_back)
+        key = (tan_left, tan_right, tan_up, tan_down, near + pull_back, far + pull_back)
+        if key != self.cull_key:
+            self.cull_key = key
+            proj_mat = ProjectionView._create_projection(*key)
+            cull_cam.node().get_lens().set_user_mat(views[0].coord_mat_inv * proj_mat)
+
+    def attach(
+            self, image: int, width: int, height: int, depth_image: int = None,
+            depth_attachment: int = None) -> None:
+        """
+        Attach all the layers of the swapchain image to the currently bound draw framebuffer.
+
+        The depth is rendered in the layers of depth_image, e.g. an image of a depth swapchain, if given or else in
+        an internal depth texture array.
+
+        Must be called from the draw callback, with the OpenGL context current.
+        """
+
+        if depth_attachment is None:
+            depth_attachment = GL.GL_DEPTH_ATTACHMENT
+        if depth_image is None:
+            if self.depth_texture is None or self.depth_size != (width, height):
+                self.create_depth_texture(width, height)
+            depth_image = self.depth_texture
+            depth_attachment = GL.GL_DEPTH_ATTACHMENT
+        if self.mode == 'multiview':
+            OVR_multiview.glFramebufferTextureMultiviewOVR(
+                GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image, 0, 0, self.nb_views)
+            OVR_multiview.glFramebufferTextureMultiviewOVR(
+                GL.GL_DRAW_FRAMEBUFFER, depth_attachment, depth_image, 0, 0, self.nb_views)
+        else:
+            GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, image, 0)
+            GL.glFramebufferTexture(GL.GL_DRAW_FRAMEBUFFER, depth_attachment, depth_image, 0)
+
+    def create_depth_texture(self, width: int, height: int) -> None:
+        """
+        Create the layered depth buffer, a multiview framebuffer requires all its attachments to be layered.
+        """
+
+        self.release_depth_texture()
+        previous = GL.glGetIntegerv(GL.GL_TEXTURE_BINDING_2D_ARRAY)
+        self.depth_texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.depth_texture)
+        GL.glTexStorage3D(GL.GL_TEXTURE_2D_ARRAY, 1, GL.GL_DEPTH_COMPONENT24, width, height, self.nb_views)
+        # Restore the binding known by Panda3D state cache
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, previous)
+        self.depth_size = (width, height)
+
+    def release_depth_texture(self) -> None:
+        if self.depth_texture is not None:
+            GL.glDeleteTextures([self.depth_texture])
+            self.depth_texture = None
+            self.depth_size = None
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import ctypes
 import logging
 import xr
 
@@ -14,65 +15,95 @@ class Swapchain:
     def __init__(
             self,
             session: Session,
-            view: ConfigurationView,
+            view: Optional[ConfigurationView],
             sc_format: int,
             width: Optional[int] = None,
             height: Optional[int] = None,
-            sample_count: Optional[int] = None):
+            sample_count: Optional[int] = None,
+            array_size: int = 1,
+            usage_flags: xr.SwapchainUsageFlags = None):
         self.logger = logging.getLogger('swapchain')
         self.session = session
+        self.backend = session.backend
         self.view = view
         self.handle: xr.Swapchain = None
         self.images = None
-        self.logger.info(
-            "Creating swapchain for "
-            f"view {view.index} with dimensions "
-            f"Width={view.recommended_image_rect_width} "
-            f"Height={view.recommended_image_rect_height} "
-            f"SampleCount={view.recommended_swapchain_sample_count}")
-
+        # Without view, e.g. for a quad layer, the dimensions must be given
         if width is None:
-            width = view.recommended_image_rect_width
+            width = view.render_width
         self.width = width
         if height is None:
-            height = view.recommended_image_rect_height
+            height = view.render_height
         self.height = height
+        if usage_flags is None:
+            usage_flags = xr.SwapchainUsageFlags.SAMPLED_BIT | xr.SwapchainUsageFlags.COLOR_ATTACHMENT_BIT
+        self.usage_flags = usage_flags
         if sample_count is None:
-            sample_count = view.recommended_swapchain_sample_count
+            sample_count = view.recommended_swapchain_sample_count if view is not None else 1
         self.sample_count = sample_count
+        self.logger.info(
+            "Creating swapchain for "
+            f"{f'view {view.index}' if view is not None else 'layer'} "
+            f"{'depth ' if self.is_depth() else ''}with dimensions "
+            f"Width={self.width} "
+            f"Height={self.height} "
+            f"SampleCount={self.sample_count} "
+            f"ArraySize={array_size}")
+        self.array_size = array_size
+        # Area of the images actually rendered and submitted, see set_image_rect()
+        self.image_rect_width = self.width
+        self.image_rect_height = self.height
 
         swapchain_create_info = xr.SwapchainCreateInfo(
-            array_size=1,
+            array_size=self.array_size,
             format=sc_format,
             width=self.width,
             height=self.height,
             mip_count=1,
             face_count=1,
             sample_count=self.sample_count,
-            usage_flags=xr.SwapchainUsageFlags.SAMPLED_BIT | xr.SwapchainUsageFlags.COLOR_ATTACHMENT_BIT,
+            usage_flags=self.usage_flags,
         )
 
-        self.handle = xr.create_swapchain(session.handle, swapchain_create_info)
-        self.images = xr.enumerate_swapchain_images(self.handle, xr.SwapchainImageOpenGLKHR)
+        self.handle = self.backend.create_swapchain(session.handle, swapchain_create_info)
+        self.images = self.backend.enumerate_swapchain_images(self.handle, xr.SwapchainImageOpenGLKHR)
         for i, si in enumerate(self.images):
             self.logger.debug(f"Swapchain image {i} type = {xr.StructureType(si.type)}")
+        self.acquire_info = xr.SwapchainImageAcquireInfo()
+        self.wait_info = xr.SwapchainImageWaitInfo(xr.INFINITE_DURATION)
+        self.release_info = xr.SwapchainImageReleaseInfo()
+        self.image_index = ctypes.c_uint32()
 
     def destroy(self):
         if self.handle is not None:
             try:
-                xr.destroy_swapchain(self.handle)
+                self.backend.destroy_swapchain(self.handle)
             finally:
                 self.handle = None
                 self.images = None
 
+    def is_depth(self) -> bool:
+        return self.usage_flags & xr.SwapchainUsageFlags.DEPTH_STENCIL_ATTACHMENT_BIT != 0
+
+    def set_image_rect(self, width: int, height: int) -> None:
+        """
+        Only render and submit the given area of the images, starting at the bottom left corner.
+        """
+
+        self.image_rect_width = min(width, self.width)
+        self.image_rect_height = min(height, self.height)
+
+    def acquire_image(self) -> int:
+        return self.backend.acquire_swapchain_image_into(self.handle, self.acquire_info, self.image_index)
+
+    def wait_image(self) -> None:
+        self.backend.wait_swapchain_image(self.handle, self.wait_info)
+
     def acquire_image_info(self):
-        ai = xr.SwapchainImageAcquireInfo(None)
-        swapchain_index = xr.acquire_swapchain_image(self.handle, ai)
-        wi = xr.SwapchainImageWaitInfo(xr.INFINITE_DURATION)
-        xr.wait_swapchain_image(self.handle, wi)
+        swapchain_index = self.acquire_image()
+        self.wait_image()
         sw_image = self.images[swapchain_index]
         return sw_image
 
     def release_image_info(self):
-        ri = xr.SwapchainImageReleaseInfo()
-        xr.release_swapchain_image(self.handle, ri)
+        self.backend.release_swapchain_image(self.handle, self.release_info)
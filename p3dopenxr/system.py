@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import ctypes
 import logging
 from typing import TYPE_CHECKING
 import xr
@@ -8,6 +7,7 @@ import xr
 from .config_view import ConfigurationView
 
 if TYPE_CHECKING:
+    from .capabilities import RuntimeCapabilities
     from .instance import Instance
 
 
@@ -21,6 +21,7 @@ class System:
         self.logger = logging.getLogger("system")
         self.handle = None
         self.instance = instance
+        self.backend = instance.backend
         self.view_configuration_type = view_configuration_type
         self.views: list[ConfigurationView] = []
         self.graphics_requirements = None
@@ -28,18 +29,26 @@ class System:
         system_get_info = xr.SystemGetInfo(
             form_factor=form_factor,
         )
-        self.handle = xr.get_system(instance.handle, system_get_info)
+        self.handle = self.backend.get_system(instance.handle, system_get_info)
         self.logger.debug(f"Using system {hex(self.handle.value)} for form factor {str(form_factor)}")
 
-        self.log_system_properties()
-        self.log_view_configurations()
-
-        view_configs = xr.enumerate_view_configurations(self.instance.handle, self.handle)
-        if view_configuration_type.value not in view_configs:
-            raise ValueError(f"View configuration type '{view_configuration_type}' not supported")
+        capabilities = instance.capabilities
+        if capabilities is not None:
+            self.validate_capabilities(capabilities)
+            configuration_views = capabilities.get_views(view_configuration_type.value)
+        else:
+            configuration_views = None
+        if configuration_views is None:
+            view_configs = self.backend.enumerate_view_configurations(self.instance.handle, self.handle)
+            if view_configuration_type.value not in view_configs:
+                raise ValueError(f"View configuration type '{view_configuration_type}' not supported")
+            configuration_views = self.backend.enumerate_view_configuration_views(
+                self.instance.handle, self.handle, self.view_configuration_type)
+            if capabilities is not None:
+                capabilities.set_view_configurations(view_configs)
+                capabilities.set_views(view_configuration_type.value, configuration_views)
 
-        for i, config in enumerate(xr.enumerate_view_configuration_views(
-                self.instance.handle, self.handle, self.view_configuration_type)):
+        for i, config in enumerate(configuration_views):
             view = ConfigurationView(i, config)
             self.views.append(view)
 
@@ -50,25 +59,34 @@ class System:
         self.graphics_requirements = None
         self.instance = None
 
+    def log_diagnostics(self):
+        """
+        Log the properties of the system and all its view configurations, these queries are not needed to use the
+        system.
+        """
+
+        self.log_system_properties()
+        self.log_view_configurations()
+
+    def validate_capabilities(self, capabilities: RuntimeCapabilities) -> None:
+        """
+        Check that the capability snapshot was captured with the current system, otherwise capture its properties
+        and forget the views and formats of the previous system.
+        """
+
+        system_properties = self.backend.get_system_properties(self.instance.handle, self.handle)
+        if not capabilities.matches_system(system_properties.system_name.decode()):
+            if capabilities.system_name is not None:
+                self.logger.info(
+                    f"System changed from '{capabilities.system_name}' to "
+                    f"'{system_properties.system_name.decode()}', capturing its capabilities again")
+            capabilities.set_system_properties(system_properties)
+
     def create_opengl_system(self):
-        self.pxrGetOpenGLGraphicsRequirementsKHR = ctypes.cast(
-            xr.get_instance_proc_addr(
-                self.instance.handle,
-                "xrGetOpenGLGraphicsRequirementsKHR",
-            ),
-            xr.PFN_xrGetOpenGLGraphicsRequirementsKHR
-        )
-        self.graphics_requirements = xr.GraphicsRequirementsOpenGLKHR()
-        result = self.pxrGetOpenGLGraphicsRequirementsKHR(
-            self.instance.handle,
-            self.handle,
-            ctypes.byref(self.graphics_requirements))
-        result = xr.check_result(xr.Result(result))
-        if result.is_exception():
-            raise result
+        self.graphics_requirements = self.backend.get_opengl_graphics_requirements(self.instance.handle, self.handle)
 
     def log_system_properties(self):
-        system_properties = xr.get_system_properties(self.instance.handle, self.handle)
+        system_properties = self.backend.get_system_properties(self.instance.handle, self.handle)
         self.logger.info(
             "System Properties: "
             f"Name={system_properties.system_name.decode()} "
@@ -84,25 +102,26 @@ class System:
             f"PositionTracking={bool(system_properties.tracking_properties.position_tracking)}")
 
     def log_environment_blend_mode(self, view_config_type):
-        blend_modes = xr.enumerate_environment_blend_modes(self.instance.handle, self.handle, view_config_type)
+        blend_modes = self.backend.enumerate_environment_blend_modes(
+            self.instance.handle, self.handle, view_config_type)
         self.logger.info("Available Environment Blend Mode:")
         for mode_value in blend_modes:
             mode = xr.EnvironmentBlendMode(mode_value)
             self.logger.info(f"    {str(mode)}")
 
     def log_view_configurations(self):
-        view_config_types = xr.enumerate_view_configurations(self.instance.handle, self.handle)
+        view_config_types = self.backend.enumerate_view_configurations(self.instance.handle, self.handle)
         self.logger.info(f"Available View Configuration Types: ({len(view_config_types)})")
         for view_config_type_value in view_config_types:
             view_config_type = xr.ViewConfigurationType(view_config_type_value)
             self.logger.debug(f"  View Configuration Type: {str(view_config_type)}")
-            view_config_properties = xr.get_view_configuration_properties(
+            view_config_properties = self.backend.get_view_configuration_properties(
                 instance=self.instance.handle,
                 system_id=self.handle,
                 view_configuration_type=view_config_type,
             )
             self.logger.debug(f"  View configuration FovMutable={bool(view_config_properties.fov_mutable)}")
-            configuration_views = xr.enumerate_view_configuration_views(
+            configuration_views = self.backend.enumerate_view_configuration_views(
                 self.instance.handle, self.handle, view_config_type)
             if configuration_views is None or len(configuration_views) < 1:
                 self.logger.error("Empty view configuration type")
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+from panda3d.core import BitMask32, GraphicsOutput
+from typing import Optional, Sequence, Union
+import xr
+
+
+VIEW_CONFIGURATIONS = {
+    'mono': xr.ViewConfigurationType.PRIMARY_MONO,
+    'stereo': xr.ViewConfigurationType.PRIMARY_STEREO,
+    # Left and right context views, then left and right inset views, see XR_VARJO_quad_views
+    'quad': xr.ViewConfigurationType.PRIMARY_STEREO_WITH_FOVEATED_INSET,
+}
+
+
+def get_view_configuration_type(
+        view_configuration: Union[str, xr.ViewConfigurationType]) -> xr.ViewConfigurationType:
+    if isinstance(view_configuration, xr.ViewConfigurationType):
+        return view_configuration
+    if view_configuration not in VIEW_CONFIGURATIONS:
+        raise ValueError(f"Unknown view configuration '{view_configuration}'")
+    return VIEW_CONFIGURATIONS[view_configuration]
+
+
+def get_view_policies(
+        policies: Optional[Sequence[Optional[ViewPolicy]]], nb_views: int) -> list[ViewPolicy]:
+    """
+    Return one policy per view, the missing ones being the default policy.
+    """
+
+    policies = list(policies) if policies is not None else []
+    if len(policies) > nb_views:
+        logging.getLogger("view-policy").warning(
+            f"{len(policies)} view policies given for {nb_views} views, the extra ones are ignored")
+    policies = policies[:nb_views] + [None] * (nb_views - len(policies))
+    return [policy if policy is not None else ViewPolicy() for policy in policies]
+
+
+class ViewPolicy:
+    """
+    How one view of the view configuration is rendered.
+
+    scale is the resolution of the view relative to the resolution recommended by the runtime, the dynamic
+    resolution is applied on top of it.
+
+    The view is only rendered once every interval frames. In between, the last image is submitted again with the
+    pose and the field of view it was rendered with, and the runtime reprojects it. It suits the inset views of a
+    quad view configuration, which only cover the center of the field of view.
+
+    camera_mask restricts the scene drawn in the view, the nodes hidden for the mask with NodePath.hide(mask) are
+    left out of the view while the other views still draw them.
+    """
+
+    def __init__(self, scale: float = 1.0, interval: int = 1, camera_mask: BitMask32 = None):
+        if scale <= 0 or interval < 1:
+            raise ValueError("Invalid view scale or interval")
+        self.scale = scale
+        self.interval = interval
+        self.camera_mask = camera_mask
+
+    def is_default(self) -> bool:
+        return self.scale == 1.0 and self.interval == 1 and self.camera_mask is None
+
+
+class ViewScheduler:
+    """
+    Select the views rendered in each frame according to the interval of their policy, the render buffers of the
+    other views are deactivated for the frame.
+
+    The views sharing the same interval are rendered in the same frames, so the left and right inset views always
+    match.
+    """
+
+    def __init__(self, policies: Sequence[ViewPolicy], buffers: Sequence[Sequence[GraphicsOutput]]):
+        self.logger = logging.getLogger("view-policy")
+        self.policies = list(policies)
+        # Render buffers of each view, including the periphery buffers of the foveated rendering
+        self.buffers = [list(view_buffers) for view_buffers in buffers]
+        self.rendered = [True] * len(self.policies)
+        self.rendered_views = list(range(len(self.policies)))
+        self.first_frame: int = None
+
+    def update(self, frame: int) -> list[int]:
+        """
+        Select the views rendered in the given frame and return their indices. The render buffers must be active,
+        all the views are rendered in the first frame.
+        """
+
+        if self.first_frame is None:
+            self.first_frame = frame
+        elapsed = frame - self.first_frame
+        for i, policy in enumerate(self.policies):
+            rendered = elapsed % policy.interval == 0
+            self.rendered[i] = rendered
+            for buffer in self.buffers[i]:
+                buffer.set_active(rendered)
+        self.rendered_views = [i for i, rendered in enumerate(self.rendered) if rendered]
+        return self.rendered_views
@@ -0,0 +1,236 @@
+# Run the OpenXR frame loop without headset using the simulated runtime and report the time spent per frame.
+#
+# Usage: python3 main.py [--frames N] [--allocations] [--late-latching] [--realtime] [--pipelined] [--app-load MS]
+#                         [--dynamic-resolution] [--foveation fixed|gaze] [--overlays]
+#                         [--single-pass] [--depth] [--msaa N] [--msaa-auto] [--capabilities FILE]
+#                         [--replay FILE] [--pose-history] [--hand-tracking] [--record FILE]
+#                         [--replay-session FILE] [--mirror MODE] [--mirror-rate HZ] [--capture PATTERN]
+#                         [--capture-interval N] [--quad-views] [--inset-interval N] [--verbose]
+#
+# With --realtime the simulated runtime throttles the frame loop like an actual compositor, combined with --app-load
+# it shows how the pacing thread of the pipelined mode lets the application work overlap the wait for the next frame:
+#
+#     python3 main.py --realtime --app-load 12
+#     python3 main.py --realtime --app-load 12 --pipelined
+#
+# With --capabilities the capabilities of the runtime are saved in FILE at the first run and reused by the next
+# ones, with --replay the simulated runtime reproduces the headset recorded in FILE.
+#
+# With --record the tracking session is recorded in FILE, with --replay-session it is replayed in a loop instead of
+# the scripted poses, so the frame loop can be measured again with the exact same head and hand motion.
+#
+# With --quad-views the simulated headset has high resolution insets, which are rendered once every N frames with
+# --inset-interval.
+
+import argparse
+import gc
+import logging
+import math
+import statistics
+import time
+import tracemalloc
+import xr
+
+from panda3d.core import load_prc_file_data
+
+load_prc_file_data("", """
+window-type offscreen
+load-display p3tinydisplay
+audio-library-name null
+""")
+
+from direct.gui.OnscreenText import OnscreenText  # noqa: E402
+from direct.showbase.ShowBase import ShowBase  # noqa: E402
+from panda3d.core import NodePath  # noqa: E402
+
+from p3dopenxr.capabilities import RuntimeCapabilities  # noqa: E402
+from p3dopenxr.capture import ImageWriter  # noqa: E402
+from p3dopenxr.dynamic_resolution import DynamicResolution  # noqa: E402
+from p3dopenxr.foveation import FoveatedRenderer  # noqa: E402
+from p3dopenxr.mirror import DesktopMirror, MIRROR_MODES  # noqa: E402
+from p3dopenxr.p3dopenxr import P3DOpenXR  # noqa: E402
+from p3dopenxr.recording import ReplayBackend  # noqa: E402
+from p3dopenxr.simulated import SimulatedBackend, yaw_quaternion  # noqa: E402
+from p3dopenxr.view_policy import ViewPolicy  # noqa: E402
+
+
+parser = argparse.ArgumentParser(description="Measure the frame loop overhead using the simulated runtime")
+parser.add_argument('--frames', type=int, default=1000, help="Number of frames to measure")
+parser.add_argument('--allocations', action='store_true',
+                    help="Report the memory blocks still allocated per frame in steady state")
+parser.add_argument('--late-latching', action='store_true', help="Locate the views again before the draw")
+parser.add_argument('--realtime', action='store_true', help="Throttle the frame loop at the display rate")
+parser.add_argument('--pipelined', action='store_true', help="Wait for the frames on a pacing thread")
+parser.add_argument('--app-load', type=float, default=0, metavar='MS',
+                    help="Time spent by the application in each frame, outside of the GIL like the rendering")
+parser.add_argument('--dynamic-resolution', action='store_true', help="Adapt the resolution to the frame time")
+parser.add_argument('--foveation', choices=('fixed', 'gaze'), help="Render the periphery at a lower resolution")
+parser.add_argument('--overlays', action='store_true',
+                    help="Add a head-locked quad layer and a cylinder layer updated every 10 frames")
+parser.add_argument('--single-pass', action='store_true', help="Render all the views in one pass")
+parser.add_argument('--depth', action='store_true', help="Submit the depth of the views with the projection layer")
+parser.add_argument('--msaa', type=int, default=0, metavar='N', help="Render the views with N samples")
+parser.add_argument('--msaa-auto', action='store_true', help="Adapt the sample count to the frame time")
+parser.add_argument('--capabilities', metavar='FILE', help="Cache the capabilities of the runtime in FILE")
+parser.add_argument('--replay', metavar='FILE', help="Simulate the runtime and headset recorded in FILE")
+parser.add_argument('--pose-history', action='store_true', help="Record the poses of the HMD, views and hands")
+parser.add_argument('--hand-tracking', action='store_true', help="Locate the joints of the hands")
+parser.add_argument('--record', metavar='FILE', help="Record the tracking session in FILE")
+parser.add_argument('--replay-session', metavar='FILE', help="Replay the tracking session recorded in FILE")
+parser.add_argument('--mirror', choices=MIRROR_MODES, help="Mirror the views in the main window")
+parser.add_argument('--mirror-rate', type=float, metavar='HZ', help="Refresh rate of the mirror")
+parser.add_argument('--capture', metavar='PATTERN', help="Capture the left eye into images named after PATTERN")
+parser.add_argument('--capture-interval', type=int, default=1, metavar='N', help="Capture one frame out of N")
+parser.add_argument('--quad-views', action='store_true', help="Render the inset views of a quad view headset")
+parser.add_argument('--inset-interval', type=int, default=1, metavar='N', help="Render the insets every N frames")
+parser.add_argument('--verbose', action='store_true', help="Log the debug messages")
+args = parser.parse_args()
+logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+nb_frames = args.frames
+
+base = ShowBase()
+
+# Run as fast as possible with small views, we measure the overhead of the frame loop, not the rendering
+capabilities = None
+if args.replay is not None:
+    capabilities = RuntimeCapabilities.load(args.replay)
+    if capabilities is None:
+        parser.error(f"Invalid capability snapshot {args.replay}")
+if args.replay_session is not None:
+    backend = ReplayBackend(
+        args.replay_session, realtime=args.realtime, loop=True, view_size=(64, 64), capabilities=capabilities)
+else:
+    backend = SimulatedBackend(
+        realtime=args.realtime, view_size=(64, 64), eye_gaze=lambda t: yaw_quaternion(0.2 * math.sin(2 * t)),
+        inset_size=(48, 48) if args.quad_views else None, capabilities=capabilities)
+openxr = P3DOpenXR()
+dynamic_resolution = DynamicResolution(min_scale=0.5, max_scale=1.5) if args.dynamic_resolution else None
+foveation = FoveatedRenderer(args.foveation) if args.foveation is not None else None
+fb_props = None
+if args.msaa > 0:
+    fb_props = openxr.create_default_fb_props()
+    fb_props.set_multisamples(args.msaa)
+openxr.init(backend=backend, late_latching=args.late_latching, pipelined=args.pipelined,
+            dynamic_resolution=dynamic_resolution, foveation=foveation, single_pass=args.single_pass,
+            depth_submission=args.depth, fb_props=fb_props, msaa_mode='auto' if args.msaa_auto else 'fixed',
+            capabilities_cache=args.capabilities, hand_tracking=args.hand_tracking,
+            view_configuration='quad' if args.quad_views else 'stereo',
+            view_policies=[None, None] + [ViewPolicy(interval=args.inset_interval)] * 2 if args.quad_views else None,
+            mirroring=DesktopMirror(args.mirror, scale=0.5, refresh_rate=args.mirror_rate) if args.mirror else None)
+profiler = openxr.enable_profiler(size=nb_frames)
+pose_history = openxr.enable_pose_history() if args.pose_history else None
+recorder = openxr.start_recording(args.record) if args.record is not None else None
+if args.capture is not None:
+    openxr.start_capture(ImageWriter(args.capture), interval=args.capture_interval, scale=0.5)
+
+panda = base.loader.loadModel("panda")
+panda.reparentTo(base.render)
+panda.set_scale(0.1)
+panda.set_pos(0, 2, 0)
+
+if args.hand_tracking:
+    # The joints are only given to the shaders of the hands, without any per joint NodePath
+    for hand_tracker in openxr.hand_trackers:
+        hand = openxr.tracking_space_anchor.attach_new_node(f"hand-{hand_tracker.hand}")
+        hand_tracker.bind_shader_inputs(hand)
+
+if args.overlays:
+    hud = NodePath("hud")
+    OnscreenText(text="HUD", parent=hud, scale=0.5)
+    openxr.add_quad_layer(hud, 32, 32, size=(0.2, 0.2), position=(0, 1, 0), head_locked=True)
+    menu = NodePath("menu")
+    OnscreenText(text="Menu", parent=menu, scale=0.5)
+    openxr.add_cylinder_layer(menu, 64, 32, radius=2.0, central_angle=1.0, aspect_ratio=2.0, position=(0, 0, 0),
+                              update_policy='interval', update_interval=10)
+
+
+def app_load_task(task):
+    time.sleep(args.app_load / 1000)
+    return task.cont
+
+
+if args.app_load > 0:
+    base.taskMgr.add(app_load_task, "app-load")
+
+# Let the session reach the focused state and the caches warm up
+while backend.session_state != backend.session_state.FOCUSED:
+    base.taskMgr.step()
+for i in range(100):
+    base.taskMgr.step()
+profiler.reset()
+
+if args.allocations:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+collections = sum(stats['collections'] for stats in gc.get_stats())
+
+frame_times = []
+loop_start = time.perf_counter()
+for i in range(nb_frames):
+    start = time.perf_counter()
+    base.taskMgr.step()
+    frame_times.append((time.perf_counter() - start) * 1000)
+
+loop_time = time.perf_counter() - loop_start
+collections = sum(stats['collections'] for stats in gc.get_stats()) - collections
+frame_times.sort()
+print(f"Frames: {nb_frames} submitted: {backend.frame_count} layers: {backend.submitted_layers}")
+print(f"Frame time (ms): mean={statistics.mean(frame_times):.3f} "
+      f"p50={frame_times[len(frame_times) // 2]:.3f} "
+      f"p99={frame_times[int(len(frame_times) * 0.99)]:.3f} "
+      f"max={frame_times[-1]:.3f}")
+print(f"Frame rate: {nb_frames / loop_time:.1f} fps")
+if dynamic_resolution is not None:
+    sizes = [(swapchain.image_rect_width, swapchain.image_rect_height) for swapchain in openxr.swapchains]
+    print(f"Render scale: {dynamic_resolution.scale:.2f} sizes: {sizes}")
+if args.msaa > 0:
+    samples = openxr.multisampling.samples if openxr.multisampling is not None else args.msaa
+    print(f"Sample count: {samples} swapchain samples: {[swapchain.sample_count for swapchain in openxr.swapchains]}")
+if args.depth:
+    print(f"Views submitted with depth: {backend.submitted_depth_views}")
+if args.overlays:
+    print(f"Overlay updates: {[layer.last_update for layer in openxr.layers.overlays]}")
+if pose_history is not None:
+    times, positions, orientations, valid = pose_history.get_samples('hmd')
+    middle = (times[-2] + times[-1]) // 2
+    position, orientation, pose_valid = pose_history.interpolate('/user/hand/left', middle)
+    print(f"Pose history: {len(pose_history)} samples, left hand between the last two: {position[0].round(3)} "
+          f"valid: {pose_valid[0]}")
+    for device in ('hmd', '/user/hand/right'):
+        linear, angular, velocity_valid = pose_history.get_velocity(device)
+        print(f"  {device} velocity: linear={linear.round(3)} angular={angular.round(3)} valid: {velocity_valid}")
+if args.hand_tracking:
+    for hand_tracker in openxr.hand_trackers:
+        print(f"{hand_tracker.hand}: active: {hand_tracker.is_active} valid joints: {hand_tracker.valid.sum()} "
+              f"index tip: {hand_tracker.positions[xr.HandJointEXT.INDEX_TIP].round(3)}")
+if openxr.mirror is not None:
+    print(f"Mirror updates: {openxr.mirror.updates} size: {openxr.mirror.size}")
+if openxr.frame_capture is not None:
+    # The simulated runtime has no swapchain images, the frames are only selected
+    capture = openxr.frame_capture
+    print(f"Capture: {capture.frames} frames selected, images: {capture.captured} read back, {capture.written} "
+          f"written, {capture.dropped} dropped, size: {capture.size}")
+if args.quad_views:
+    renders = [profiler.summary().get(f"view{i}.draw", {}).get('count', 0) for i in range(len(openxr.swapchains))]
+    print(f"Views: {len(openxr.swapchains)} sizes: {[(sc.width, sc.height) for sc in openxr.swapchains]} "
+          f"renders: {renders}")
+if recorder is not None:
+    print(f"Records: {recorder.nb_records} in {args.record}")
+if args.replay_session is not None:
+    print(f"Replayed frames: {backend.frame + 1} of {len(backend.recording)} recorded")
+print(f"GC collections: {collections}")
+
+if args.allocations:
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # Only the library is measured, not the simulated runtime
+    filters = [tracemalloc.Filter(True, "*p3dopenxr*"), tracemalloc.Filter(False, "*simulated.py")]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    blocks = sum(stat.count_diff for stat in stats)
+    print(f"Blocks allocated per frame in p3dopenxr: {blocks / nb_frames:.3f}")
+    for stat in stats[:5]:
+        if stat.count_diff:
+            print(f"  {stat}")
+
+print()
+profiler.dump()
@@ -0,0 +1,71 @@
+# Measure the time from the launch of the application to its first frame using the simulated runtime.
+#
+# Usage: python3 main.py [--runs N] [--diagnostics]
+#
+# Each run is done in a new process, so the import time is included. The time is split between the import of the
+# library, the creation of ShowBase, init() and the steps of the main loop until the first frame is begun.
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+start = time.perf_counter()
+
+
+def run_once(diagnostics: bool) -> dict:
+    from panda3d.core import load_prc_file_data
+
+    load_prc_file_data("", """
+    window-type offscreen
+    load-display p3tinydisplay
+    audio-library-name null
+    """)
+
+    timings = {}
+    timings['import'] = time.perf_counter()
+    from direct.showbase.ShowBase import ShowBase
+    from p3dopenxr.p3dopenxr import P3DOpenXR
+    from p3dopenxr.simulated import SimulatedBackend
+    timings['showbase'] = time.perf_counter()
+    base = ShowBase()
+    timings['init'] = time.perf_counter()
+    openxr = P3DOpenXR()
+    openxr.init(backend=SimulatedBackend(), diagnostics=diagnostics)
+    timings['first_frame'] = time.perf_counter()
+    while openxr.frame_count == 0:
+        base.taskMgr.step()
+    end = time.perf_counter()
+    # Duration of each phase, in ms
+    phases = list(timings.items())
+    durations = {}
+    for (name, phase_start), (_, phase_end) in zip(phases, phases[1:] + [('end', end)]):
+        durations[name] = (phase_end - phase_start) * 1000
+    durations['total'] = (end - start) * 1000
+    return durations
+
+
+parser = argparse.ArgumentParser(description="Measure the time to the first frame using the simulated runtime")
+parser.add_argument('--runs', type=int, default=5, help="Number of runs")
+parser.add_argument('--diagnostics', action='store_true', help="Log the properties of the runtime at startup")
+parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if args.single:
+    print(json.dumps(run_once(args.diagnostics)))
+    sys.exit(0)
+
+results = []
+for i in range(args.runs):
+    command = [sys.executable, __file__, '--single']
+    if args.diagnostics:
+        command.append('--diagnostics')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    results.append(json.loads(output.splitlines()[-1]))
+
+print(f"Startup time (ms) over {args.runs} runs{' with diagnostics' if args.diagnostics else ''}:")
+for name in results[0]:
+    values = sorted(result[name] for result in results)
+    print(f"  {name:<12} median={statistics.median(values):8.1f} min={values[0]:8.1f} max={values[-1]:8.1f}")
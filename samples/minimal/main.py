@@ -1,9 +1,12 @@
 from direct.showbase.ShowBase import ShowBase
+import logging
 
 from p3dopenxr.p3dopenxr import P3DOpenXR
 from panda3d.core import LPoint3
 
 
+logging.basicConfig(level=logging.DEBUG)
+
 # Set up the window, camera, etc.
 
 base = ShowBase()
@@ -12,7 +15,7 @@ base.setFrameRateMeter(True)
 # Create and configure the VR environment
 
 openxr = P3DOpenXR()
-openxr.init()
+openxr.init(diagnostics=True)
 
 panda = base.loader.loadModel("panda")
 panda.reparentTo(base.render)
@@ -0,0 +1,69 @@
+from panda3d.core import load_prc_file_data
+
+load_prc_file_data("", """
+window-type offscreen
+load-display p3tinydisplay
+audio-library-name null
+""")
+
+from direct.showbase.ShowBase import ShowBase  # noqa: E402
+from direct.task.TaskManagerGlobal import taskMgr  # noqa: E402
+import pytest  # noqa: E402
+
+from p3dopenxr.p3dopenxr import P3DOpenXR  # noqa: E402
+
+
+TASK_NAMES = ("openXRPollEvents", "openXRWaitFrame", "openXRUpdateViews", "openXRPollActions", "openXREndFrame")
+
+
+@pytest.fixture(scope='session')
+def base():
+    base = ShowBase()
+    yield base
+    base.destroy()
+
+
+def stop_openxr(base, openxr):
+    buffers = openxr.periphery_buffers + openxr.buffers + [layer.buffer for layer in openxr.layers.overlays]
+    openxr.destroy()
+    for name in TASK_NAMES:
+        taskMgr.remove(name)
+    for buffer in buffers:
+        if buffer is not None:
+            base.graphicsEngine.remove_window(buffer)
+    for anchor in ('tracking_space_anchor', 'view_space_anchor'):
+        if hasattr(openxr, anchor):
+            getattr(openxr, anchor).remove_node()
+    base.camera.reparent_to(base.render)
+
+
+@pytest.fixture
+def start_openxr(base):
+    """
+    Return a function creating a P3DOpenXR running on the given backend, with a small scene, once the session is
+    focused and the frame loop has reached its steady state. Starting a new one stops the previous one.
+    """
+
+    instances = []
+    scene = base.loader.load_model("panda")
+    scene.reparent_to(base.render)
+    scene.set_scale(0.1)
+    scene.set_pos(0, 2, 0)
+
+    def start(backend, warmup=100, **kwargs):
+        if instances:
+            stop_openxr(base, instances.pop())
+        openxr = P3DOpenXR(base)
+        instances.append(openxr)
+        openxr.init(backend=backend, **kwargs)
+        while backend.session_state != backend.session_state.FOCUSED:
+            base.taskMgr.step()
+        for i in range(warmup):
+            base.taskMgr.step()
+        return openxr
+
+    yield start
+
+    if instances:
+        stop_openxr(base, instances.pop())
+    scene.remove_node()
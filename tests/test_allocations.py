@@ -0,0 +1,100 @@
+from collections import Counter
+import ctypes
+import gc
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+import p3dopenxr
+from p3dopenxr.simulated import SimulatedBackend
+
+
+PACKAGE_DIR = os.path.dirname(p3dopenxr.__file__)
+# The simulated runtime stands for the OpenXR runtime, its allocations are not counted
+RUNTIME_FILES = {os.path.join(PACKAGE_DIR, name) for name in ('simulated.py', 'recording.py')}
+CTYPES_TYPES = (ctypes.Structure, ctypes.Union, ctypes.Array, ctypes._Pointer, ctypes._SimpleCData)
+CTYPES_FUNCTIONS = (ctypes.byref, ctypes.pointer)
+
+
+class CtypesAllocationCounter:
+    """
+    Count the ctypes objects created by the library, directly or through pyopenxr, while it is active.
+
+    The structures of pyopenxr are counted when their __init__() is called, the ctypes references when byref() or
+    pointer() is called. Each allocation is attributed to the innermost frame of the library in the call stack.
+    """
+
+    def __init__(self):
+        self.allocations = Counter()
+
+    def __enter__(self):
+        sys.setprofile(self.profile)
+        return self
+
+    def __exit__(self, *args):
+        sys.setprofile(None)
+
+    @property
+    def total(self) -> int:
+        return sum(self.allocations.values())
+
+    @staticmethod
+    def get_origin(frame):
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(PACKAGE_DIR):
+                return None if filename in RUNTIME_FILES else frame
+            frame = frame.f_back
+        return None
+
+    def add(self, name: str, frame) -> None:
+        origin = self.get_origin(frame)
+        if origin is not None:
+            self.allocations[f"{name} at {os.path.basename(origin.f_code.co_filename)}:{origin.f_lineno}"] += 1
+
+    def profile(self, frame, event, arg):
+        if event == 'call':
+            code = frame.f_code
+            if code.co_name != '__init__' or code.co_argcount == 0:
+                return
+            instance = frame.f_locals.get(code.co_varnames[0])
+            # The __init__() of the base classes are called with the same instance
+            if isinstance(instance, CTYPES_TYPES) and frame.f_back.f_locals.get('self') is not instance:
+                self.add(type(instance).__name__, frame.f_back)
+        elif event == 'c_call' and arg in CTYPES_FUNCTIONS:
+            self.add(arg.__name__, frame)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'late_latching': True},
+    {'persistent_fbo': True},
+    {'depth_submission': True},
+])
+def test_no_ctypes_allocation_per_frame(base, start_openxr, options):
+    start_openxr(SimulatedBackend(realtime=False, view_size=(64, 64)), **options)
+    with CtypesAllocationCounter() as counter:
+        for i in range(100):
+            base.taskMgr.step()
+    assert counter.total == 0, f"ctypes objects allocated per frame: {dict(counter.allocations)}"
+
+
+def test_steady_state_memory(base, start_openxr):
+    start_openxr(SimulatedBackend(realtime=False, view_size=(64, 64)))
+    gc.disable()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for i in range(200):
+            base.taskMgr.step()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    filters = [tracemalloc.Filter(True, os.path.join(PACKAGE_DIR, '*'))]
+    filters += [tracemalloc.Filter(False, filename) for filename in RUNTIME_FILES]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    blocks = sum(stat.count_diff for stat in stats)
+    assert blocks < 20, f"Memory blocks kept by the library: {[str(stat) for stat in stats[:5]]}"
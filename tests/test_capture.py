@@ -0,0 +1,45 @@
+import time
+
+from p3dopenxr.simulated import SimulatedBackend
+
+
+class RecordingWriter:
+
+    def __init__(self):
+        self.closed = False
+
+    def __call__(self, frame):
+        pass
+
+    def close(self):
+        # Slow enough for the writer thread to be still running if it is not joined
+        time.sleep(0.1)
+        self.closed = True
+
+
+def test_restart_capture(base, start_openxr):
+    # Starting a capture closes the current one and its writer
+    openxr = start_openxr(SimulatedBackend(realtime=False, view_size=(64, 64)), warmup=10)
+    first_writer = RecordingWriter()
+    first = openxr.start_capture(first_writer)
+    for i in range(10):
+        base.taskMgr.step()
+    second_writer = RecordingWriter()
+    second = openxr.start_capture(second_writer)
+    assert first_writer.closed
+    assert first.finished
+    assert openxr.frame_capture is second
+    for i in range(10):
+        base.taskMgr.step()
+    # The simulated runtime has no images to read back, the frames are only selected
+    assert second.frames == 10
+    assert not second_writer.closed
+    # A stopped capture is closed once its writer thread has ended
+    openxr.stop_capture()
+    for i in range(100):
+        if openxr.frame_capture is None:
+            break
+        time.sleep(0.01)
+        base.taskMgr.step()
+    assert openxr.frame_capture is None
+    assert second_writer.closed
@@ -0,0 +1,52 @@
+from panda3d.core import FrameBufferProperties
+
+from p3dopenxr.dynamic_resolution import DynamicResolution
+from p3dopenxr.simulated import SimulatedBackend
+
+
+def destroy_with_context(openxr, backend, objects, release='release'):
+    """
+    Destroy openxr as with an actual runtime and return, for each object, if its release function was called while
+    the swapchains still existed.
+    """
+
+    released = {}
+    for i, obj in enumerate(objects):
+        def release_function(i=i):
+            released[i] = all(swapchain.handle is not None for swapchain in openxr.swapchains)
+        setattr(obj, release, release_function)
+    # The simulated runtime has no OpenGL objects, the release is done as with an actual runtime
+    backend.headless = False
+    openxr.destroy()
+    assert not openxr.gl_releases
+    assert not any(buffer.is_active() for buffer in openxr.buffers)
+    return [released.get(i, False) for i in range(len(objects))]
+
+
+def test_release_framebuffers(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, persistent_fbo=True)
+    framebuffers = openxr.framebuffers
+    assert destroy_with_context(openxr, backend, framebuffers) == [True] * len(framebuffers)
+
+
+def test_release_gpu_timer(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, dynamic_resolution=DynamicResolution())
+    assert destroy_with_context(openxr, backend, [openxr.gpu_timer]) == [True]
+
+
+def test_release_multisample_targets(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    fb_props = FrameBufferProperties(FrameBufferProperties.get_default())
+    fb_props.set_multisamples(4)
+    openxr = start_openxr(backend, fb_props=fb_props, msaa_mode='auto')
+    targets = openxr.msaa_targets
+    assert len(targets) == 2
+    assert destroy_with_context(openxr, backend, targets) == [True] * len(targets)
+
+
+def test_release_stereo_depth_texture(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, single_pass=True)
+    assert destroy_with_context(openxr, backend, [openxr.stereo], 'release_depth_texture') == [True]
@@ -0,0 +1,40 @@
+from p3dopenxr import dynamic_resolution
+from p3dopenxr.dynamic_resolution import GpuTimer
+
+
+class QueryGL:
+    """
+    OpenGL calls of the timer queries, whose results are never available.
+    """
+
+    GL_TIME_ELAPSED = 0x88BF
+
+    def __init__(self):
+        self.next_query = 1
+        self.active_query = None
+
+    def glGenQueries(self, count):
+        queries = list(range(self.next_query, self.next_query + count))
+        self.next_query += count
+        return queries
+
+    def glBeginQuery(self, target, query):
+        assert self.active_query is None, "Query already active"
+        self.active_query = query
+
+    def glEndQuery(self, target):
+        assert self.active_query is not None, "No active query"
+        self.active_query = None
+
+
+def test_gpu_timer_queries_in_flight(monkeypatch):
+    gl = QueryGL()
+    monkeypatch.setattr(dynamic_resolution, 'GL', gl)
+    timer = GpuTimer(size=4)
+    # More views than queries, the GPU never catches up
+    for frame in range(3):
+        for view in range(2):
+            timer.begin(frame)
+            timer.end()
+    assert gl.active_query is None
+    assert len(timer.pending) == 4
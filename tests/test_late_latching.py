@@ -0,0 +1,82 @@
+import math
+
+from panda3d.core import LMatrix4f, LPoint3f, PythonCallbackObject
+import pytest
+
+from p3dopenxr.foveation import FoveatedRenderer
+from p3dopenxr.simulated import rotate_vector, SimulatedBackend, yaw_quaternion
+
+
+HEAD_POSES = [
+    ((0.0, 1.6, 0.0), yaw_quaternion(0.0)),
+    ((0.05, 1.62, -0.03), yaw_quaternion(0.1)),
+]
+
+
+class MovingHead:
+    """
+    Head pose switching to the second pose when moved is set, between the update of the views and the draw.
+    """
+
+    def __init__(self):
+        self.moved = False
+
+    def __call__(self, t):
+        return HEAD_POSES[1] if self.moved else HEAD_POSES[0]
+
+
+def to_view_space(backend, head_pose, point):
+    """
+    Transform a point of the OpenXR tracking space into the view space of the left eye, whose axes are the ones of
+    the OpenGL view space.
+    """
+
+    position, orientation = head_pose
+    eye_offset = rotate_vector(orientation, (-backend.ipd / 2, 0.0, 0.0))
+    relative = [p - h - o for p, h, o in zip(point, position, eye_offset)]
+    x, y, z, w = orientation
+    return rotate_vector((-x, -y, -z, w), relative)
+
+
+def test_late_latch_correction(base, start_openxr):
+    head = MovingHead()
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64), head_pose=head)
+    openxr = start_openxr(backend, late_latching=True)
+
+    def move_head(task):
+        head.moved = True
+        return task.done
+
+    # Runs after the views are updated for the cull and before the draw callbacks
+    base.taskMgr.add(move_head, "move-head", sort=0)
+    base.taskMgr.step()
+    delta = LMatrix4f(openxr.late_latching.deltas[0][0])
+
+    point = (0.3, 1.5, -2.0)
+    culled = to_view_space(backend, HEAD_POSES[0], point)
+    expected = to_view_space(backend, HEAD_POSES[1], point)
+    corrected = delta.xform_point(LPoint3f(*culled))
+    assert not math.isclose(culled[0], expected[0], abs_tol=1e-3)
+    assert tuple(corrected) == pytest.approx(expected, abs=1e-4)
+
+
+def test_late_latch_before_periphery(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, late_latching=True, foveation=FoveatedRenderer())
+    events = []
+    latch = openxr.late_latching.latch
+
+    def logged_latch():
+        events.append('latch')
+        return latch()
+
+    openxr.late_latching.latch = logged_latch
+    for i, buffer in enumerate(openxr.periphery_buffers):
+        def render_periphery(cbdata, i=i):
+            events.append(f'periphery-{i}')
+            openxr.render_periphery(i, cbdata)
+        buffer.get_display_region(buffer.get_num_display_regions() - 1).set_draw_callback(
+            PythonCallbackObject(render_periphery))
+    base.taskMgr.step()
+    # The periphery is corrected with the delta of the current frame, like the fovea drawn over it
+    assert events == ['periphery-0', 'latch', 'periphery-1']
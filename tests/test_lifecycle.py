@@ -0,0 +1,29 @@
+from panda3d.core import NodePath
+import xr
+
+from p3dopenxr.simulated import SimulatedBackend
+
+
+def test_overlay_buffers_follow_session_state(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend)
+    layer = openxr.add_quad_layer(NodePath("hud"), 32, 32, head_locked=True)
+    base.taskMgr.step()
+    assert layer.buffer.is_active()
+
+    # The session is still running but its frames are not displayed
+    backend.queue_state(xr.SessionState.VISIBLE)
+    backend.queue_state(xr.SessionState.SYNCHRONIZED)
+    for i in range(3):
+        base.taskMgr.step()
+    assert not any(buffer.is_active() for buffer in openxr.buffers)
+    assert not layer.buffer.is_active()
+
+    backend.queue_state(xr.SessionState.VISIBLE)
+    backend.queue_state(xr.SessionState.FOCUSED)
+    for i in range(3):
+        base.taskMgr.step()
+    assert layer.buffer.is_active()
+
+    openxr.remove_layer(layer)
+    assert len(openxr.lifecycle.buffers) == len(openxr.buffers)
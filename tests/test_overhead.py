@@ -0,0 +1,30 @@
+import copy
+
+import pytest
+
+from p3dopenxr.simulated import SimulatedBackend
+
+
+# Budget of the per-frame Python overhead of the frame loop, the median time of all the stages but the draw of the
+# scene. It is a few tenths of a millisecond on a desktop CPU, the margin absorbs the slower CI machines.
+OVERHEAD_BUDGET = 2.0
+
+
+def test_unsupported_calls():
+    backend = SimulatedBackend(realtime=False)
+    assert not hasattr(backend, 'create_passthrough_fb')
+    assert getattr(backend, 'create_passthrough_fb', None) is None
+    with pytest.raises(AttributeError, match="not supported by the simulated runtime"):
+        backend.create_passthrough_fb()
+    assert copy.copy(backend).view_size == backend.view_size
+
+
+def test_frame_loop_overhead(base, start_openxr):
+    openxr = start_openxr(SimulatedBackend(realtime=False, view_size=(64, 64)))
+    profiler = openxr.enable_profiler(size=500)
+    for i in range(500):
+        base.taskMgr.step()
+    summary = profiler.summary()
+    assert summary['end_frame']['count'] == 500
+    overhead = sum(stats['p50'] for stage, stats in summary.items() if not stage.endswith('.draw'))
+    assert overhead < OVERHEAD_BUDGET, f"Frame loop overhead {overhead:.3f} ms, budget {OVERHEAD_BUDGET} ms"
@@ -0,0 +1,85 @@
+import time
+
+from p3dopenxr.pacing import FramePacer
+from p3dopenxr.simulated import SimulatedBackend
+
+
+# Time spent by the application in each frame, outside of the GIL like the rendering. At 90 Hz it is longer than
+# the time left by the sequential loop after the wait, which then misses every other vsync.
+APP_LOAD = 0.012
+FRAMES = 60
+# The sequential loop runs at about half the display rate, the pipelined one close to the display rate
+MARGIN = 1.2
+# The frame rates depend on the load of the machine, the measure is repeated before failing
+ATTEMPTS = 3
+
+
+def measure_frame_rate(base, start_openxr, pipelined):
+    backend = SimulatedBackend(realtime=True, view_size=(64, 64))
+    start_openxr(backend, warmup=10, pipelined=pipelined)
+
+    def app_load_task(task):
+        time.sleep(APP_LOAD)
+        return task.cont
+
+    base.taskMgr.add(app_load_task, "app-load")
+    try:
+        start_count = backend.frame_count
+        start = time.perf_counter()
+        for i in range(FRAMES):
+            base.taskMgr.step()
+        elapsed = time.perf_counter() - start
+    finally:
+        base.taskMgr.remove("app-load")
+    return (backend.frame_count - start_count) / elapsed
+
+
+def test_pipelined_overlap(base, start_openxr):
+    for attempt in range(ATTEMPTS):
+        sequential = measure_frame_rate(base, start_openxr, pipelined=False)
+        pipelined = measure_frame_rate(base, start_openxr, pipelined=True)
+        if pipelined > sequential * MARGIN:
+            break
+    assert pipelined > sequential * MARGIN, f"Sequential {sequential:.1f} fps, pipelined {pipelined:.1f} fps"
+
+
+def test_pacer_timeout(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, warmup=10, pipelined=True)
+    display_times = []
+    end_frame = backend.end_frame
+
+    def recording_end_frame(session, frame_end_info):
+        display_times.append(frame_end_info.display_time)
+        end_frame(session, frame_end_info)
+
+    backend.end_frame = recording_end_frame
+    pacer = openxr.pacer
+    acquire_frame = pacer.acquire_frame
+
+    def late_acquire_frame(timeout=0.1):
+        # The frame is begun by the pacer thread just after the timeout
+        pacer.ready.wait(1.0)
+        return False
+
+    base.taskMgr.step()
+    pacer.acquire_frame = late_acquire_frame
+    base.taskMgr.step()
+    pacer.acquire_frame = acquire_frame
+    for i in range(5):
+        base.taskMgr.step()
+    # The frame begun after the timeout is rendered in the next loop, with its own frame state
+    assert len(display_times) == 6
+    assert all(a < b for a, b in zip(display_times, display_times[1:])), display_times
+
+
+def test_pacer_stages_registered(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64))
+    openxr = start_openxr(backend, warmup=10, pipelined=True)
+    # The stages of the pacing thread exist before it records them, summary() never sees the stages change
+    profiler = openxr.enable_profiler(size=64)
+    assert set(FramePacer.STAGES) <= set(profiler.stages)
+    for i in range(10):
+        base.taskMgr.step()
+    summary = profiler.summary()
+    assert all(summary[stage]['count'] > 0 for stage in FramePacer.STAGES)
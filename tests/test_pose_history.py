@@ -0,0 +1,11 @@
+from p3dopenxr.foveation import FoveatedRenderer
+from p3dopenxr.simulated import SimulatedBackend, yaw_quaternion
+
+
+def test_pose_names(base, start_openxr):
+    backend = SimulatedBackend(realtime=False, view_size=(64, 64), eye_gaze=lambda t: yaw_quaternion(0.1))
+    openxr = start_openxr(backend, warmup=10, foveation=FoveatedRenderer('gaze'))
+    pose_history = openxr.enable_pose_history()
+    assert 'eye_gaze' in pose_history.names
+    assert '/user/hand/left' in pose_history.names
+    assert not any(name.startswith('None') for name in pose_history.names)